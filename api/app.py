@@ -1,74 +1,655 @@
-from fastapi import FastAPI, Query
-from pydantic import BaseModel
-from typing import List, Tuple, Optional
+from fastapi import FastAPI, Query, HTTPException, Request
+from fastapi.responses import PlainTextResponse
+from fastapi.concurrency import run_in_threadpool
+from pydantic import BaseModel, Field
+from typing import List, Tuple, Optional, Dict
 import uvicorn
 import os
+import re
+from contextlib import nullcontext
 
 from src.vsm_basic import VSM
-from utils.logger import get_logger
+from src.sharded_vsm import ShardedVSM
+from api.build_jobs import BuildJobManager
+from api.index_registry import IndexRegistry, INDEX_NAME_PATTERN
+from api.shared_indexes import SharedIndexes
+from api.ingest import ingest_stream
+from utils.document_sources import iter_source
+from utils.logger import get_logger, log_sampled
+from utils import metrics
 
 logger = get_logger(__name__)
 
+INDEX_DOCUMENTS = metrics.gauge("vsm_index_documents", "Documents in a resident index", ("index",))
+INDEX_TERMS = metrics.gauge("vsm_index_terms", "Terms in a resident index", ("index",))
+INDEX_GENERATION = metrics.gauge("vsm_index_generation", "Generation of a resident index, bumped by builds, updates and loads", ("index",))
+INDEX_MEMORY = metrics.gauge("vsm_index_memory_bytes", "Estimated memory of a resident index", ("index",))
+INDEX_MEMORY_BUDGET = metrics.gauge("vsm_index_memory_budget_bytes", "Total memory budget of resident indexes")
+QUERY_CACHE = metrics.gauge("vsm_query_cache", "Query result cache statistics of a resident index", ("index", "statistic"))
+
 app = FastAPI(
     title="Vector Space Model Search API",
     description="Search documents using lnc.ltc vector space model with Soundex fallback",
     version="1.0.0"
 )
 
-#globally declaring VSM engine
-vsm_engine: Optional[VSM]=None
-current_corpus: Optional[str]=None
+#name of the index used when a request names none
+DEFAULT_INDEX="default"
+
+#directory of a saved index to serve on startup as the default index, avoiding a rebuild
+INDEX_DIR=os.environ.get("VSM_INDEX_DIR")
+#directory holding a saved index per name: indexes found there are served on startup, loaded when first queried,
+#and builds, updates and ingestions of an index are saved into its subdirectory
+INDEX_ROOT=os.environ.get("VSM_INDEX_ROOT")
+#total memory of resident indexes in MiB, least recently queried indexes over it are evicted and reloaded on demand
+MEMORY_BUDGET=int(float(os.environ["VSM_MEMORY_BUDGET_MB"]) * 2**20) if os.environ.get("VSM_MEMORY_BUDGET_MB") else None
+#directory of the persistent text extraction cache
+CACHE_DIR=os.environ.get("VSM_CACHE_DIR")
+#"i/n" when this service serves shard i of a corpus split into n shards
+SHARD=tuple(int(part) for part in os.environ["VSM_SHARD"].split("/")) if os.environ.get("VSM_SHARD") else None
+#comma separated base URLs of shard services, makes this service their coordinator
+SHARD_URLS=[url for url in os.environ.get("VSM_SHARD_URLS", "").split(",") if url]
+#directory indexes are published into as generations shared by all worker processes, e.g. under /dev/shm; set it
+#to run several workers (uvicorn --workers N) that map one copy of each index and follow each other's changes
+SHARED_ROOT=os.environ.get("VSM_SHARED_ROOT")
+#"1" to only serve saved indexes: build, update and ingestion endpoints are disabled, no extraction cache is opened
+#and the text extraction backends are never imported
+SERVE_ONLY=os.environ.get("VSM_SERVE_ONLY", "0")=="1"
+
+def load_engine(index_dir: str):
+    """
+    Loads a saved single or sharded index
+    """
+    cache_dir = None if SERVE_ONLY else CACHE_DIR
+    if os.path.exists(os.path.join(index_dir, "shards.json")):
+        return ShardedVSM.load(index_dir, cache_dir=cache_dir)
+    return VSM.load(index_dir, cache_dir=cache_dir)
+
+def is_saved_index(index_dir: str) -> bool:
+    return os.path.exists(os.path.join(index_dir, "meta.json")) or os.path.exists(os.path.join(index_dir, "shards.json"))
+
+def persistent_dir(index: str, index_dir=None):
+    """
+    Directory an index is saved into after builds, updates and ingestions, None to keep it in memory until evicted
+    """
+    if index_dir:
+        return index_dir
+    if SHARED_ROOT:
+        # published generations are the saved form
+        return None
+    if index == DEFAULT_INDEX and INDEX_DIR:
+        return INDEX_DIR
+    if INDEX_ROOT:
+        return os.path.join(INDEX_ROOT, index)
+    return None
+
+def serve_only_error(action: str) -> dict:
+    logger.error(f"{action} attempted in serve-only mode")
+    return {"error": "This service only serves saved indexes (VSM_SERVE_ONLY=1)"}
+
+def index_not_built(index: str, action: str) -> dict:
+    logger.error(f"{action} attempted before building index {index}")
+    return {"error": f"Index {index} not built. Please build the index using /build endpoint."}
+
+def index_not_found(index: str, action: str) -> HTTPException:
+    """
+    404 for endpoints reading an index (search, batch search, similar documents, cache statistics), which the
+    index_not_built error body of the endpoints changing an index would leave as a 200
+    """
+    logger.error(f"{action} attempted before building index {index}")
+    return HTTPException(status_code=404, detail=f"Index {index} not built. Please build the index using /build endpoint.")
+
+#indexes served by this process, by name
+registry=IndexRegistry(load_engine, MEMORY_BUDGET, INDEX_ROOT)
+#published generations followed by this worker, None unless several workers share the indexes
+shared=SharedIndexes(SHARED_ROOT, registry) if SHARED_ROOT else None
+
+def get_engine(index: str, wait=False):
+    """
+    Engine of an index, switched to its latest published generation first when workers share the indexes
+    """
+    if shared is not None:
+        shared.sync(index, wait)
+    return registry.get(index)
+
+def index_writer(index: str, blocking=True):
+    """
+    Context serializing changes of an index across worker processes when they share the indexes, yielding False if
+    blocking is False and another worker is changing it
+    """
+    return shared.writer(index, blocking) if shared is not None else nullcontext(True)
+
+def save_changes(index: str, engine) -> None:
+    """
+    Saves an index changed in place, or publishes it to every worker as a new generation when they share the indexes
+    """
+    if shared is not None:
+        shared.publish(index, engine)
+    else:
+        registry.updated(index, persistent_dir(index))
+
+if SHARD_URLS:
+    coordinator=ShardedVSM(shard_urls=SHARD_URLS)
+    try:
+        coordinator.refresh()
+    except OSError as e:
+        logger.error(f"Shards not reachable yet, use /shards/refresh once they are up: {e}")
+    registry.put(DEFAULT_INDEX, coordinator, pinned=True)
+    logger.info(f"Coordinating {len(SHARD_URLS)} shard services")
+elif SHARED_ROOT:
+    # the first worker to start publishes the saved indexes it is pointed at, the others attach to them
+    seeds = {}
+    if INDEX_ROOT and os.path.isdir(INDEX_ROOT):
+        seeds.update((name, os.path.join(INDEX_ROOT, name)) for name in sorted(os.listdir(INDEX_ROOT))
+                     if re.match(INDEX_NAME_PATTERN, name) and is_saved_index(os.path.join(INDEX_ROOT, name)))
+    if INDEX_DIR and os.path.isdir(INDEX_DIR):
+        seeds[DEFAULT_INDEX] = INDEX_DIR
+    for name, index_dir in seeds.items():
+        with shared.writer(name):
+            if name not in shared.names():
+                shared.publish(name, load_engine(index_dir))
+    for name in shared.names():
+        shared.sync(name)
+    if DEFAULT_INDEX in registry.names():
+        registry.get(DEFAULT_INDEX)
+    logger.info(f"Serving {len(registry.names())} shared indexes from {SHARED_ROOT} in worker {os.getpid()}")
+elif INDEX_DIR and os.path.isdir(INDEX_DIR):
+    registry.put(DEFAULT_INDEX, load_engine(INDEX_DIR), index_dir=INDEX_DIR, persistent=True)
+    logger.info(f"Loaded saved index from {INDEX_DIR}")
+if INDEX_ROOT and os.path.isdir(INDEX_ROOT) and not SHARED_ROOT:
+    for name in sorted(os.listdir(INDEX_ROOT)):
+        path = os.path.join(INDEX_ROOT, name)
+        if name not in registry.names() and re.match(INDEX_NAME_PATTERN, name) and is_saved_index(path):
+            registry.register(name, path)
+if SERVE_ONLY and not registry.names():
+    logger.error("Serve-only mode without a saved index, set VSM_INDEX_DIR, VSM_INDEX_ROOT or VSM_SHARED_ROOT, or use /index/load")
+
+#background index builds, the serving engine is only replaced once a build completes
+build_jobs=BuildJobManager()
+
+class Snippet(BaseModel):
+    text: str
+    highlights: List[Tuple[int, int]]
 
 class QueryResponse(BaseModel):
     query: str
     results: List[Tuple[str, float]]
     elapsed_time: float
+    snippets: Optional[List[Optional[Snippet]]] = None
+
+class ShardSearchRequest(BaseModel):
+    qvec: Dict[str, float]
+    phrases: List[Tuple[List[str], Optional[int]]] = []
+    k: int = Field(10, ge=1)
+    scoring: Optional[str] = Field(None, pattern="^(python|numpy|maxscore)$")
+    n_probe: Optional[int] = Field(None, ge=1)
+    index: str = DEFAULT_INDEX
+
+class ShardSnippetsRequest(BaseModel):
+    names: List[str]
+    terms: List[str]
+    index: str = DEFAULT_INDEX
+
+class BatchSearchRequest(BaseModel):
+    queries: List[str]
+    k: int = Field(10, ge=1)
+    n_probe: Optional[int] = Field(None, ge=1)
+    index: str = DEFAULT_INDEX
+
+class BatchSearchResponse(BaseModel):
+    results: List[QueryResponse]
+    elapsed_time: float
+
+class SimilarResponse(BaseModel):
+    doc: str
+    method: str
+    results: List[Tuple[str, float]]
+    elapsed_time: float
 
 @app.get("/")
 def root():
     return {"message": "Welcome to the Vector Space Model Search API. Use /build to set the document corpus and /search to perform searches."}
 
+def swap_engine(job, engine: VSM):
+    """
+    Atomically replaces the index of the job's name with a freshly built one, in every worker when they share the indexes
+    """
+    if shared is not None:
+        with shared.writer(job.index):
+            shared.publish(job.index, engine)
+    else:
+        registry.put(job.index, engine, index_dir=job.index_dir, persistent=job.index_dir is not None)
+    logger.info(f"Swapped in index {job.index} built by job {job.id} for corpus directory: {job.corpus_dir}")
+
 @app.post("/build")
-def build_index(corpus_dir: str = Query(..., description="Path to the directory containing documents")):
+def build_index(corpus_dir: str = Query(..., description="Path to the directory containing documents"),
+                n_workers: int = Query(1, ge=1, description="Number of processes used for text extraction and preprocessing"),
+                index_dir: Optional[str] = Query(None, description="Directory to save the built index to"),
+                n_shards: int = Query(1, ge=1, description="Number of shards, each built and searched by its own process"),
+                index: str = Query(DEFAULT_INDEX, pattern=INDEX_NAME_PATTERN, description="Name to serve the index under")):
     """
-    Build the VSM index for the given corpus directory
+    Start building the VSM index for the given corpus directory in the background.
+    Searches keep using the current index of that name until the new one is complete.
     Args:
         corpus_dir: Path to the directory containing documents
+        n_workers: Number of processes used for text extraction and preprocessing
+        index_dir: Directory to save the built index to, defaults to VSM_INDEX_DIR for the default index or to
+            the index's subdirectory of VSM_INDEX_ROOT if set
+        n_shards: Number of shards, each built and searched by its own process
+        index: Name to serve the index under, replacing the index of that name
     Returns:
-        dict: Message indicating success or failure
+        dict: Job id and status of the build, or an error
     """
-    global vsm_engine, current_corpus
+    if SERVE_ONLY:
+        return serve_only_error("Build")
 
     if not os.path.isdir(corpus_dir):
         logger.error(f"Invalid corpus directory: {corpus_dir}")
         return {"error": "Invalid directory path"}
-    
-    vsm_engine = VSM(corpus_dir)
-    vsm_engine.build_index()
-    current_corpus = corpus_dir
 
-    logger.info(f"Built index for corpus directory: {corpus_dir}")
-    return {"message": f"Index built for corpus directory: {corpus_dir}"}
+    if SHARD_URLS and index == DEFAULT_INDEX:
+        logger.error("Build attempted on a shard coordinator")
+        return {"error": "Shard services build their own indexes, use /shards/refresh once they are done"}
+
+    if n_shards > 1:
+        job = build_jobs.submit(corpus_dir, n_workers, persistent_dir(index, index_dir), swap_engine, n_shards=n_shards, index=index, cache_dir=CACHE_DIR)
+    else:
+        job = build_jobs.submit(corpus_dir, n_workers, persistent_dir(index, index_dir), swap_engine, index=index, cache_dir=CACHE_DIR, shard=SHARD)
+    return {"message": f"Index build started for corpus directory: {corpus_dir}", "index": index, "job_id": job.id, "status": job.status}
+
+@app.get("/build/{job_id}")
+def build_status(job_id: str):
+    """
+    Status and progress of a build job
+    Args:
+        job_id: Id returned by /build
+    Returns:
+        dict: status, phase, documents processed and total, estimated seconds left
+    """
+    job = build_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown build job")
+    return job.to_dict()
+
+@app.delete("/build/{job_id}")
+def cancel_build(job_id: str):
+    """
+    Cancel a queued or running build job
+    Args:
+        job_id: Id returned by /build
+    Returns:
+        dict: status of the job after the cancellation request
+    """
+    job = build_jobs.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown build job")
+    logger.info(f"Cancellation requested for build {job_id}")
+    return job.to_dict()
 
-@app.get("/search", response_model=QueryResponse)
-def search(query: str = Query(..., description="Search query string")):
+@app.post("/index/update")
+def update_index(recluster: bool = Query(False, description="Force a full re-clustering after the update"),
+                 index: str = Query(DEFAULT_INDEX, description="Name of the index to update")):
+    """
+    Incrementally apply added, modified and deleted files of an index's corpus to the index
+    Args:
+        recluster: Force a full re-clustering after the update
+        index: Name of the index to update
+    Returns:
+        dict: Files added, modified and deleted, and whether clustering was redone
+    """
+    if SERVE_ONLY:
+        return serve_only_error("Index update")
+
+    with index_writer(index):
+        if shared is not None:
+            shared.sync(index, wait=True)
+        if index not in registry.names():
+            return index_not_built(index, "Index update")
+        with registry.in_use(index):
+            engine = registry.get(index)
+            if engine is None:
+                return index_not_built(index, "Index update")
+            summary = engine.update_index(recluster=recluster)
+            save_changes(index, engine)
+
+    logger.info(f"Updated index {index} for corpus directory: {engine.corpus_dir}")
+    return summary
+
+@app.post("/documents")
+async def ingest_documents(request: Request,
+                           source: Optional[str] = Query(None, description="Directory (walked recursively), zip or tar archive on the server to ingest instead of the request body"),
+                           n_workers: int = Query(1, ge=1, description="Number of processes used for text extraction and preprocessing"),
+                           recluster: bool = Query(False, description="Force a full re-clustering after the ingestion"),
+                           index: str = Query(DEFAULT_INDEX, pattern=INDEX_NAME_PATTERN, description="Name of the index to ingest into, created if new")):
+    """
+    Stream documents into an index without staging them on disk.
+    The body is newline-delimited JSON, one {"id": ..., "text": ...} or {"id": ..., "content": <base64 file bytes>, "file_type": "pdf"}
+    object per line, and may be sent with chunked transfer encoding. A document whose id was ingested before is replaced.
+    The body is read only as fast as documents are indexed, so a full ingest queue slows the sender down, and a
+    second ingestion into the same index while one is running, in this or another worker sharing the index, is
+    refused with 429; ingestions into different indexes run side by side.
+    Args:
+        request: Request whose body holds the documents
+        source: Directory, zip or tar archive on the server to ingest instead of the request body
+        n_workers: Number of processes used for text extraction and preprocessing
+        recluster: Force a full re-clustering after the ingestion
+        index: Name of the index to ingest into, created if new
+    Returns:
+        dict: Numbers of documents added, modified, unchanged and skipped, and whether clustering was redone
+    """
+    if SERVE_ONLY:
+        return serve_only_error("Ingestion")
+
+    if source is not None and not os.path.exists(source):
+        logger.error(f"Invalid ingest source: {source}")
+        return {"error": "Invalid source path"}
+
+    try:
+        with index_writer(index, blocking=False) as writing, registry.in_use(index) as entry:
+            if not writing:
+                raise HTTPException(status_code=429, detail="Another worker is ingesting into this index", headers={"Retry-After": "1"})
+            if not entry.ingest_lock.acquire(blocking=False):
+                raise HTTPException(status_code=429, detail="Another ingestion into this index is running", headers={"Retry-After": "1"})
+            try:
+                engine = await run_in_threadpool(get_engine, index, True)
+                if isinstance(engine, ShardedVSM):
+                    logger.error("Ingestion attempted on a sharded index")
+                    return {"error": "Sharded indexes do not support ingestion, send the documents to every shard service instead, each keeps the documents of its shard"}
+                if engine is None:
+                    # documents can be streamed in without building from a corpus directory first
+                    engine = VSM(corpus_dir="", cache_dir=CACHE_DIR, shard=SHARD)
+                try:
+                    if source is not None:
+                        summary = await run_in_threadpool(engine.ingest_documents, iter_source(source), n_workers, recluster)
+                    else:
+                        summary = await ingest_stream(request.stream(), engine, n_workers, recluster)
+                finally:
+                    if registry.peek(index) is not engine and engine.N:
+                        registry.put(index, engine)
+                    if registry.peek(index) is engine:
+                        await run_in_threadpool(save_changes, index, engine)
+            finally:
+                entry.ingest_lock.release()
+    except ValueError as e:
+        logger.error(f"Ingestion stopped: {e}")
+        raise HTTPException(status_code=400, detail=f"{e}; documents before it were indexed")
+
+    logger.info(f"Ingested documents into index {index}: {summary}")
+    return summary
+
+@app.post("/index/load")
+def load_index(index_dir: str = Query(..., description="Directory containing a saved index"),
+               index: str = Query(DEFAULT_INDEX, pattern=INDEX_NAME_PATTERN, description="Name to serve the index under")):
+    """
+    Load a previously saved index instead of rebuilding it, publishing it to every worker when they share the indexes
+    Args:
+        index_dir: Directory containing a saved index
+        index: Name to serve the index under, replacing the index of that name
+    Returns:
+        dict: Message indicating success or failure
+    """
+    if not os.path.isdir(index_dir):
+        logger.error(f"Invalid index directory: {index_dir}")
+        return {"error": "Invalid directory path"}
+
+    try:
+        engine = load_engine(index_dir)
+    except ValueError as e:
+        logger.error(f"Failed to load index from {index_dir}: {e}")
+        return {"error": str(e)}
+    if shared is not None:
+        with shared.writer(index):
+            shared.publish(index, engine)
+    else:
+        # updates are saved into the index's own directory, the loaded one is left as it is
+        registry.put(index, engine, index_dir=index_dir, persistent=index_dir == persistent_dir(index))
+
+    logger.info(f"Loaded index {index} from: {index_dir}")
+    return {"message": f"Index {index} loaded from: {index_dir}"}
+
+@app.get("/indexes")
+def list_indexes():
+    """
+    Indexes served by this process with their estimated memory, lookup hit rates, loads and evictions
+    Returns:
+        dict: memory budget, bytes of resident indexes, and statistics per index name; the worker's process id
+            when workers share the indexes, each reports its own
+    """
+    if shared is not None:
+        for name in shared.names():
+            shared.sync(name)
+    stats = registry.stats()
+    if shared is not None:
+        stats["worker_pid"] = os.getpid()
+    return stats
+
+@app.delete("/indexes/{index}")
+def remove_index(index: str):
+    """
+    Stop serving an index, in every worker when they share the indexes; its saved form is kept
+    Args:
+        index: Name of the index
+    Returns:
+        dict: Message indicating success
+    """
+    withdrawn = False
+    if shared is not None:
+        with shared.writer(index):
+            withdrawn = shared.withdraw(index)
+    if not registry.remove(index) and not withdrawn:
+        raise HTTPException(status_code=404, detail="Unknown index")
+    return {"message": f"Index {index} removed"}
+
+@app.get("/search", response_model=QueryResponse, response_model_exclude_none=True)
+def search(query: str = Query(..., description="Search query string"),
+           scoring: Optional[str] = Query(None, pattern="^(python|numpy|maxscore)$", description="Scoring backend, python, numpy or maxscore"),
+           k: int = Query(10, ge=1, description="Number of results to return"),
+           n_probe: Optional[int] = Query(None, ge=1, description="Number of clusters to score, more is slower with higher recall"),
+           index: str = Query(DEFAULT_INDEX, description="Name of the index to search"),
+           snippets: bool = Query(False, description="Add a passage of each result with the query terms highlighted")):
     """
     Search the indexed VSM space for the given query
 
     Args:
         query: The search query string
+        scoring: Scoring backend, defaults to the engine's configured backend
+        k: Number of results to return
+        n_probe: Number of clusters to score, defaults to the engine's configured n_probe
+        index: Name of the index to search, loaded from its saved form if it was evicted
+        snippets: Add a snippet per result, read from the compressed document store
 
     Returns:
-        QueryResponse: Contains the original query, list of (document, score) tuples, and time taken to search
+        QueryResponse: Contains the original query, list of (document, score) tuples, and time taken to search;
+            with snippets, the passage of each result and the character offsets of its highlighted words; 404 if the
+            index is unknown or not built
     """
-    if vsm_engine is None:
-        logger.error("Search attempted before building index")
-        return {"error": "Index not built. Please build the index using /build endpoint."}
-    
-    results, elapsed_time = vsm_engine.query(query)
-    logger.info(f"Search completed for query: '{query}' with {len(results)} results in {elapsed_time:.6f} seconds")
+    engine = get_engine(index)
+    if engine is None:
+        raise index_not_found(index, "Search")
     
+    results, elapsed_time = engine.query(query, scoring=scoring, k=k, n_probe=n_probe)
+    if log_sampled():
+        logger.info(f"Search completed for query: '{query}' with {len(results)} results in {elapsed_time:.6f} seconds")
+
+    if snippets:
+        # not part of the cached results, and not counted in elapsed_time
+        result_snippets = engine.snippets([name for name, score in results], engine.highlight_terms(query))
+        return QueryResponse(query=query, results=results, elapsed_time=elapsed_time, snippets=result_snippets)
     return QueryResponse(query=query, results=results, elapsed_time=elapsed_time)
 
+@app.post("/search/batch", response_model=BatchSearchResponse)
+def search_batch(request: BatchSearchRequest):
+    """
+    Search the indexed VSM space for many queries at once.
+    Query terms are processed once per batch and all queries are scored together, which is much faster per query than separate /search calls.
+
+    Args:
+        request: Query strings, number of results per query, optional number of clusters to score and index name
+
+    Returns:
+        BatchSearchResponse: A QueryResponse per query, in request order, and the total time taken; 404 if the index is unknown or not built
+    """
+    engine = get_engine(request.index)
+    if engine is None:
+        raise index_not_found(request.index, "Batch search")
+
+    results, elapsed_times, elapsed_time = engine.query_batch(request.queries, k=request.k, n_probe=request.n_probe)
+    if log_sampled():
+        logger.info(f"Batch search completed for {len(request.queries)} queries in {elapsed_time:.6f} seconds")
+
+    return BatchSearchResponse(
+        results=[QueryResponse(query=query, results=query_results, elapsed_time=query_elapsed)
+                 for query, query_results, query_elapsed in zip(request.queries, results, elapsed_times)],
+        elapsed_time=elapsed_time
+    )
+
+@app.get("/similar")
+def similar(doc: str = Query(..., description="File name of a corpus document, or id of an ingested document"),
+            k: int = Query(10, ge=1, description="Number of results to return"),
+            method: str = Query("exact", pattern="^(exact|lsh|cluster)$", description="exact to score every document sharing a term, lsh or cluster for approximate search"),
+            n_probe: Optional[int] = Query(None, ge=1, description="Number of clusters scored by the cluster method"),
+            index: str = Query(DEFAULT_INDEX, description="Name of the index to search")):
+    """
+    Find the documents most similar to an indexed document ("more like this"), by cosine similarity of their
+    document vectors, without preprocessing or fuzzy matching its text as a query
+
+    Args:
+        doc: File name of a corpus document, or id of an ingested document
+        k: Number of results to return
+        method: exact (default) to score every document sharing a term, lsh or cluster for approximate search
+        n_probe: Number of clusters scored by the cluster method, defaults to the engine's configured n_probe
+        index: Name of the index to search
+
+    Returns:
+        SimilarResponse: The document, the method, list of (document, similarity) tuples, and time taken; 404 if the
+            index is unknown or not built, or the document is unknown; 501 on a sharded index; 400 for invalid arguments
+    """
+    engine = get_engine(index)
+    if engine is None:
+        raise index_not_found(index, "Similar document search")
+    if isinstance(engine, ShardedVSM):
+        # the coordinator knows no document ids, they live on the shards
+        logger.error("Similar document search attempted on a sharded index")
+        raise HTTPException(status_code=501, detail="Similar document search is not supported on sharded indexes")
+
+    doc_id = engine.doc_id_of(doc)
+    if doc_id is None:
+        raise HTTPException(status_code=404, detail="Unknown document")
+    try:
+        results, elapsed_time = engine.similar(doc_id, k=k, method=method, n_probe=n_probe)
+    except ValueError as e:
+        logger.error(f"Similar document search failed: {e}")
+        raise HTTPException(status_code=400, detail=str(e))
+    if log_sampled():
+        logger.info(f"Similar search for '{doc}' with {method} returned {len(results)} results in {elapsed_time:.6f} seconds")
+
+    return SimilarResponse(doc=doc, method=method, results=results, elapsed_time=elapsed_time)
+
+@app.get("/search/cache")
+def search_cache_stats(index: str = Query(DEFAULT_INDEX, description="Name of the index")):
+    """
+    Hit and miss counters and size of the query result cache of a resident index
+    Args:
+        index: Name of the index
+    Returns:
+        dict: entries, estimated bytes, bounds, hits, misses, hit rate and evictions; 404 if the index is unknown, not
+            built or not resident
+    """
+    engine = registry.peek(index)
+    if engine is None:
+        if index not in registry.names():
+            raise index_not_found(index, "Cache statistics request")
+        raise HTTPException(status_code=404, detail=f"Index {index} is not resident")
+    return engine.query_cache.stats()
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics_endpoint():
+    """
+    Query phase timings, postings scanned, fuzzy fallbacks, build phase and text extraction timings, index
+    lookups, loads and evictions, and the size and estimated memory of every resident index, in the Prometheus
+    text exposition format
+    Returns:
+        str: Metrics text, empty histograms while recording is disabled with VSM_METRICS=0
+    """
+    for gauge in (INDEX_DOCUMENTS, INDEX_TERMS, INDEX_GENERATION, INDEX_MEMORY, QUERY_CACHE):
+        gauge.clear()
+    if registry.memory_budget is not None:
+        INDEX_MEMORY_BUDGET.set(registry.memory_budget)
+    for index, entry in registry.stats()["indexes"].items():
+        engine = registry.peek(index)
+        if engine is None:
+            continue
+        INDEX_DOCUMENTS.set(engine.N, index)
+        INDEX_TERMS.set(len(engine.dictionary), index)
+        INDEX_GENERATION.set(engine.generation, index)
+        INDEX_MEMORY.set(entry["memory_bytes"], index)
+        for statistic, value in entry["query_cache"].items():
+            if statistic in ("entries", "bytes", "hits", "misses", "evictions"):
+                QUERY_CACHE.set(value, index, statistic)
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/shard/statistics")
+def shard_statistics(index: str = Query(DEFAULT_INDEX, description="Name of the index")):
+    """
+    Document count and document frequencies of this service's index, pulled by a shard coordinator
+    Args:
+        index: Name of the index
+    Returns:
+        dict: N and term --> document frequency
+    """
+    engine = get_engine(index)
+    if engine is None:
+        return index_not_built(index, "Shard statistics request")
+    return engine.term_statistics()
+
+@app.post("/shard/search")
+def shard_search(request: ShardSearchRequest):
+    """
+    Scores this service's index against a query vector weighted by a shard coordinator
+    Args:
+        request: Normalized query vector, matched phrase terms, number of results, scoring backend and index name
+    Returns:
+        dict: top k [document id, file name, score] triples
+    """
+    engine = get_engine(request.index)
+    if engine is None:
+        return index_not_built(request.index, "Shard search")
+    phrases = [(tuple(terms), slop) for terms, slop in request.phrases]
+    return {"results": engine.search_shard(request.qvec, phrases, request.k, request.scoring, request.n_probe)}
+
+@app.post("/shard/snippets")
+def shard_snippets(request: ShardSnippetsRequest):
+    """
+    Snippets of the documents of this service's index, requested by a shard coordinator for its search results
+    Args:
+        request: Document names, query terms matched by the coordinator and index name
+    Returns:
+        dict: snippet per document, null for documents of other shards
+    """
+    engine = get_engine(request.index)
+    if engine is None:
+        return index_not_built(request.index, "Shard snippets request")
+    return {"snippets": engine.snippets(request.names, set(request.terms))}
+
+@app.post("/shards/refresh")
+def refresh_shards(index: str = Query(DEFAULT_INDEX, description="Name of the sharded index")):
+    """
+    Pulls document frequencies from the shard services again, e.g. after they rebuilt or updated their indexes
+    Args:
+        index: Name of the sharded index
+    Returns:
+        dict: Number of documents and terms across all shards
+    """
+    engine = get_engine(index)
+    if not isinstance(engine, ShardedVSM):
+        return {"error": "This service is not a shard coordinator"}
+    try:
+        engine.refresh()
+    except OSError as e:
+        logger.error(f"Shard refresh failed: {e}")
+        return {"error": str(e)}
+    registry.updated(index)
+    return {"N": engine.N, "terms": len(engine.dictionary)}
+
 if __name__=="__main__":
     uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
@@ -0,0 +1,174 @@
+import time
+import uuid
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from src.vsm_basic import VSM, BuildCancelled
+from src.sharded_vsm import ShardedVSM
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+class BuildJob:
+    """
+    State of one background index build
+    """
+    def __init__(self, corpus_dir: str, n_workers: int, index_dir=None, index=None) -> None:
+        """
+        Args:
+            corpus_dir: Directory containing the documents
+            n_workers: Number of ingestion processes
+            index_dir: Directory to save the built index to, if any
+            index: Name the index is served under once built
+        """
+        self.id = uuid.uuid4().hex
+        self.index = index
+        self.corpus_dir = corpus_dir
+        self.n_workers = n_workers
+        self.index_dir = index_dir
+
+        self.status = "queued" # queued, running, completed, failed, cancelled
+        self.phase = None
+        self.docs_processed = 0
+        self.docs_total = 0
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+        self.cancel_event = threading.Event()
+        self.future = None
+
+    def progress(self, phase: str, done: int, total: int) -> None:
+        """
+        Progress callback handed to VSM.build_index, also the cancellation point of the build
+        """
+        if self.cancel_event.is_set():
+            raise BuildCancelled(f"Build {self.id} cancelled")
+        self.phase = phase
+        self.docs_processed = done
+        self.docs_total = total
+
+    def eta_seconds(self):
+        """
+        Returns:
+            float: estimated seconds left in the extraction phase, None if unknown
+        """
+        if self.status != "running" or self.phase != "extracting" or not self.docs_processed:
+            return None
+        elapsed = time.time() - self.started_at
+        return elapsed / self.docs_processed * (self.docs_total - self.docs_processed)
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.id,
+            "index": self.index,
+            "corpus_dir": self.corpus_dir,
+            "status": self.status,
+            "phase": self.phase,
+            "docs_processed": self.docs_processed,
+            "docs_total": self.docs_total,
+            "eta_seconds": self.eta_seconds(),
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+class BuildJobManager:
+    """
+    Runs index builds in a background executor, keeping a bounded history of jobs
+    """
+    def __init__(self, max_workers=1, max_history=100) -> None:
+        """
+        Args:
+            max_workers: Number of builds allowed to run concurrently
+            max_history: Number of jobs kept for status queries
+        """
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="vsm-build")
+        self.jobs = OrderedDict()
+        self.max_history = max_history
+        self.lock = threading.Lock()
+
+    def submit(self, corpus_dir: str, n_workers: int, index_dir, on_complete, n_shards=1, index=None, **vsm_kwargs) -> BuildJob:
+        """
+        Queues a build
+
+        Args:
+            corpus_dir: Directory containing the documents
+            n_workers: Number of ingestion processes
+            index_dir: Directory to save the built index to, if any
+            on_complete: Called with (job, vsm) once the index is built, to swap it in
+            n_shards: Number of shards, more than one builds a ShardedVSM with a process per shard
+            index: Name the index is served under once built
+            vsm_kwargs: Further VSM settings
+
+        Returns:
+            BuildJob: The queued job
+        """
+        job = BuildJob(corpus_dir, n_workers, index_dir, index)
+        with self.lock:
+            self.jobs[job.id] = job
+            while len(self.jobs) > self.max_history:
+                oldest_id, oldest = next(iter(self.jobs.items()))
+                if oldest.status in ("queued", "running"):
+                    break
+                del self.jobs[oldest_id]
+
+        job.future = self.executor.submit(self._run, job, on_complete, n_shards, vsm_kwargs)
+        logger.info(f"Queued build {job.id} for corpus directory: {corpus_dir}")
+        return job
+
+    def _run(self, job: BuildJob, on_complete, n_shards: int, vsm_kwargs: dict) -> None:
+        if job.cancel_event.is_set():
+            job.status = "cancelled"
+            job.finished_at = time.time()
+            return
+
+        job.status = "running"
+        job.started_at = time.time()
+        vsm = None
+        try:
+            if n_shards > 1:
+                vsm = ShardedVSM(job.corpus_dir, n_shards=n_shards, n_workers=job.n_workers, **vsm_kwargs)
+            else:
+                vsm = VSM(job.corpus_dir, n_workers=job.n_workers, **vsm_kwargs)
+            vsm.build_index(progress=job.progress)
+            job.progress("saving" if job.index_dir else "swapping", job.docs_total, job.docs_total)
+            if job.index_dir:
+                vsm.save(job.index_dir)
+            on_complete(job, vsm)
+            job.phase = "done"
+            job.status = "completed"
+            logger.info(f"Build {job.id} completed for corpus directory: {job.corpus_dir}")
+        except BuildCancelled:
+            job.status = "cancelled"
+            logger.info(f"Build {job.id} cancelled")
+        except Exception as e:
+            job.status = "failed"
+            job.error = str(e)
+            logger.error(f"Build {job.id} failed: {e}")
+        finally:
+            if isinstance(vsm, ShardedVSM) and job.status != "completed":
+                vsm.close()
+            job.finished_at = time.time()
+
+    def get(self, job_id: str):
+        return self.jobs.get(job_id)
+
+    def cancel(self, job_id: str):
+        """
+        Requests cancellation; a running build stops at its next progress report
+
+        Returns:
+            BuildJob: The job, or None if unknown
+        """
+        job = self.jobs.get(job_id)
+        if job is None:
+            return None
+        job.cancel_event.set()
+        if job.status == "queued" and job.future.cancel():
+            job.status = "cancelled"
+            job.finished_at = time.time()
+        return job
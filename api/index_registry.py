@@ -0,0 +1,368 @@
+import os
+import re
+import time
+import tempfile
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from src.sharded_vsm import ShardedVSM
+from utils.logger import get_logger
+from utils import metrics
+
+logger = get_logger(__name__)
+
+INDEX_LOOKUPS = metrics.counter("vsm_index_lookups_total", "Index lookups by whether the index was resident or had to be reloaded", ("index", "outcome"))
+INDEX_EVICTIONS = metrics.counter("vsm_index_evictions_total", "Indexes dropped from memory to stay within the memory budget", ("index",))
+INDEX_LOAD_SECONDS = metrics.histogram("vsm_index_load_seconds", "Time to reload an evicted index from its saved form", ("index",))
+
+# Index names double as directory names under the index root
+INDEX_NAME_PATTERN = "^[A-Za-z0-9][A-Za-z0-9_.-]{0,63}$"
+
+class IndexEntry:
+    """
+    A named index: where its saved form lives and, while resident, the loaded engine
+    """
+    def __init__(self, name: str, index_dir=None, persistent=False, pinned=False) -> None:
+        """
+        Args:
+            name: Index name
+            index_dir: Directory of the saved index, None until it is first saved
+            persistent: Whether index_dir belongs to this index, so updates are saved back into it
+            pinned: Never evicted, e.g. a shard coordinator that has no saved form
+        """
+        self.name = name
+        self.index_dir = index_dir
+        self.persistent = persistent
+        self.pinned = pinned
+
+        self.engine = None
+        self.corpus_dir = None
+        self.memory = {}
+        self.dirty = False # changed since it was last saved
+        self.busy = 0 # requests changing the engine in place, which must not be evicted meanwhile
+
+        self.hits = 0
+        self.misses = 0
+        self.loads = 0
+        self.evictions = 0
+        self.last_used = None
+
+        self.lock = threading.Lock() # serializes loading, saving and evicting the engine
+        self.ingest_lock = threading.Lock() # held while documents are ingested, ingestions into the index run one at a time
+
+    @property
+    def memory_bytes(self) -> int:
+        return self.memory.get("total", 0) if self.engine is not None else 0
+
+    def to_dict(self) -> dict:
+        lookups = self.hits + self.misses
+        engine = self.engine
+        return {
+            "name": self.name,
+            "resident": engine is not None,
+            "pinned": self.pinned,
+            "index_dir": self.index_dir,
+            "corpus_dir": self.corpus_dir,
+            "documents": engine.N if engine is not None else None,
+            "memory_bytes": self.memory_bytes,
+            "memory": self.memory if engine is not None else {},
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "loads": self.loads,
+            "evictions": self.evictions,
+            "last_used": self.last_used,
+            "query_cache": engine.query_cache.stats() if engine is not None else None,
+        }
+
+class IndexRegistry:
+    """
+    Named indexes served by one process, kept resident within a total memory budget.
+    Indexes are ordered by when they were last queried; once the resident ones exceed the budget, the least recently
+    queried are dropped from memory, after saving them if they changed, and loaded again from their saved form the
+    next time they are queried. Memory is the estimate of VSM.memory_usage, taken when an index is registered,
+    loaded or updated.
+    """
+    def __init__(self, load, memory_budget=None, index_root=None) -> None:
+        """
+        Args:
+            load: Called with an index directory to load a saved index
+            memory_budget: Total bytes of resident indexes, None for no limit
+            index_root: Directory evicted indexes without a directory of their own are saved under, a temporary
+                directory if None
+        """
+        self.load = load
+        self.memory_budget = memory_budget
+        self.index_root = index_root
+        self.scratch_dir = None
+        self.entries = OrderedDict() # name --> IndexEntry, least recently used first
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def validate_name(name: str) -> None:
+        if not re.match(INDEX_NAME_PATTERN, name):
+            raise ValueError(f"Invalid index name: {name}")
+
+    def names(self) -> list:
+        with self.lock:
+            return list(self.entries)
+
+    def resident_bytes(self) -> int:
+        return sum(entry.memory_bytes for entry in self.entries.values())
+
+    def _entry(self, name: str, **kwargs) -> IndexEntry:
+        with self.lock:
+            entry = self.entries.get(name)
+            if entry is None:
+                self.validate_name(name)
+                entry = self.entries[name] = IndexEntry(name, **kwargs)
+            return entry
+
+    def register(self, name: str, index_dir: str, persistent=True) -> None:
+        """
+        Makes a saved index available under a name without loading it, it is loaded when first queried
+
+        Args:
+            name: Index name
+            index_dir: Directory of the saved index
+            persistent: Whether updates of the index are saved back into index_dir
+        """
+        entry = self._entry(name)
+        with entry.lock:
+            entry.index_dir = index_dir
+            entry.persistent = persistent
+        logger.info(f"Registered saved index {name} at {index_dir}")
+
+    def put(self, name: str, engine, index_dir=None, persistent=False, pinned=False) -> None:
+        """
+        Serves an engine under a name, replacing the index of that name, then evicts other indexes over the budget
+
+        Args:
+            name: Index name
+            engine: Built or loaded VSM
+            index_dir: Directory the engine is saved in, None if it only exists in memory
+            persistent: Whether later updates are saved back into index_dir
+            pinned: Never evict the engine
+        """
+        entry = self._entry(name)
+        memory = engine.memory_usage()
+        with entry.lock:
+            previous = entry.engine
+            with self.lock:
+                entry.engine = engine
+                entry.corpus_dir = engine.corpus_dir
+                entry.memory = memory
+                entry.index_dir = index_dir
+                entry.persistent = persistent
+                entry.pinned = pinned
+                entry.dirty = index_dir is None
+                entry.last_used = time.time()
+                self.entries.move_to_end(name)
+        if isinstance(previous, ShardedVSM) and previous is not engine:
+            previous.close()
+        logger.info(f"Serving index {name} ({memory['total'] / 2**20:.1f} MiB)")
+        self.enforce_budget(keep=name)
+
+    def get(self, name: str):
+        """
+        Engine of an index, loaded from its saved form if it was evicted. Counts as a use for the eviction order.
+
+        Args:
+            name: Index name
+
+        Returns:
+            VSM: The engine, None for an unknown name or an index that has neither been built nor saved
+        """
+        with self.lock:
+            entry = self.entries.get(name)
+            if entry is None:
+                return None
+            self.entries.move_to_end(name)
+            entry.last_used = time.time()
+            engine = entry.engine
+            if engine is not None:
+                entry.hits += 1
+            elif entry.index_dir is not None:
+                entry.misses += 1
+        if engine is not None:
+            INDEX_LOOKUPS.inc(1, name, "hit")
+            return engine
+        if entry.index_dir is None:
+            return None
+
+        INDEX_LOOKUPS.inc(1, name, "miss")
+        with entry.lock:
+            if entry.engine is None:
+                start = time.perf_counter()
+                engine = self.load(entry.index_dir)
+                memory = engine.memory_usage()
+                with self.lock:
+                    entry.engine = engine
+                    entry.corpus_dir = engine.corpus_dir
+                    entry.memory = memory
+                    entry.dirty = False
+                    entry.loads += 1
+                elapsed = time.perf_counter() - start
+                INDEX_LOAD_SECONDS.observe(elapsed, name)
+                logger.info(f"Loaded index {name} from {entry.index_dir} in {elapsed:.3f} seconds ({memory['total'] / 2**20:.1f} MiB)")
+            engine = entry.engine
+        self.enforce_budget(keep=name)
+        return engine
+
+    @contextmanager
+    def in_use(self, name: str):
+        """
+        Keeps an index from being evicted while a request changes it in place, e.g. an update or an ingestion.
+        Entered before get, so an eviction in progress completes first and get reloads the index.
+
+        Args:
+            name: Index name, registered if new so an ingestion can create it
+        """
+        entry = self._entry(name)
+        with entry.lock:
+            with self.lock:
+                entry.busy += 1
+        try:
+            yield entry
+        finally:
+            with self.lock:
+                entry.busy -= 1
+                if not entry.busy and entry.engine is None and entry.index_dir is None and self.entries.get(name) is entry:
+                    # nothing was built or ingested under the name
+                    del self.entries[name]
+
+    def peek(self, name: str):
+        """
+        Returns:
+            VSM: Engine of an index if it is resident, without loading it or counting a use
+        """
+        entry = self.entries.get(name)
+        return entry.engine if entry is not None else None
+
+    def index_dir(self, name: str):
+        """
+        Returns:
+            str: Directory of an index's saved form, None for an unknown name or an index only held in memory
+        """
+        entry = self.entries.get(name)
+        return entry.index_dir if entry is not None else None
+
+    def updated(self, name: str, index_dir=None) -> None:
+        """
+        Records an in-place change of a resident index, such as an update or an ingestion: remeasures its memory and
+        saves it if its directory belongs to it, otherwise it is saved when evicted
+
+        Args:
+            name: Index name
+            index_dir: Directory to save the index into from now on, if any
+        """
+        entry = self._entry(name)
+        with entry.lock:
+            engine = entry.engine
+            if engine is None:
+                return
+            if index_dir is not None:
+                entry.index_dir = index_dir
+                entry.persistent = True
+            if entry.persistent and entry.index_dir is not None and not entry.pinned:
+                engine.save(entry.index_dir)
+                entry.dirty = False
+            else:
+                entry.dirty = True
+            memory = engine.memory_usage()
+            with self.lock:
+                entry.memory = memory
+        self.enforce_budget(keep=name)
+
+    def remove(self, name: str) -> bool:
+        """
+        Stops serving an index, its saved form is left in place
+
+        Returns:
+            bool: False if the name is unknown
+        """
+        with self.lock:
+            entry = self.entries.pop(name, None)
+        if entry is None:
+            return False
+        with entry.lock:
+            engine, entry.engine = entry.engine, None
+        if isinstance(engine, ShardedVSM):
+            engine.close()
+        logger.info(f"Removed index {name}")
+        return True
+
+    def saved_dir(self, name: str) -> str:
+        """
+        Directory an index that has none of its own is saved into when evicted
+        """
+        if self.index_root:
+            return os.path.join(self.index_root, name)
+        with self.lock:
+            if self.scratch_dir is None:
+                self.scratch_dir = tempfile.mkdtemp(prefix="vsm-indexes-")
+            return os.path.join(self.scratch_dir, name)
+
+    def enforce_budget(self, keep=None) -> None:
+        """
+        Evicts least recently queried indexes until the resident ones fit the memory budget
+
+        Args:
+            keep: Index never evicted by this call, the one just used
+        """
+        while self.memory_budget is not None:
+            with self.lock:
+                resident = self.resident_bytes()
+                if resident <= self.memory_budget:
+                    return
+                victim = next((entry for entry in self.entries.values()
+                               if entry.engine is not None and not entry.pinned and not entry.busy and entry.name != keep), None)
+            if victim is None:
+                logger.warning(f"Resident indexes use {resident / 2**20:.1f} MiB, over the {self.memory_budget / 2**20:.1f} MiB budget, with nothing left to evict")
+                return
+            self.evict(victim.name)
+
+    def evict(self, name: str) -> bool:
+        """
+        Drops a resident index from memory, saving it first if it has no up-to-date saved form
+
+        Returns:
+            bool: False if the index was not resident, is pinned or is being changed
+        """
+        entry = self.entries.get(name)
+        if entry is None:
+            return False
+        with entry.lock:
+            engine = entry.engine
+            if engine is None or entry.pinned or entry.busy:
+                return False
+            if entry.dirty or entry.index_dir is None:
+                if entry.index_dir is None or not entry.persistent:
+                    entry.index_dir = self.saved_dir(name)
+                    entry.persistent = self.index_root is not None
+                engine.save(entry.index_dir)
+                entry.dirty = False
+            with self.lock:
+                memory_bytes = entry.memory_bytes
+                entry.engine = None
+                entry.evictions += 1
+        if isinstance(engine, ShardedVSM):
+            engine.close()
+        INDEX_EVICTIONS.inc(1, name)
+        logger.info(f"Evicted index {name}, freeing about {memory_bytes / 2**20:.1f} MiB")
+        return True
+
+    def stats(self) -> dict:
+        """
+        Returns:
+            dict: memory budget, resident bytes, and per index memory, hit and miss counts, loads and evictions
+        """
+        with self.lock:
+            entries = list(self.entries.values())
+            resident = self.resident_bytes()
+        return {
+            "memory_budget_bytes": self.memory_budget,
+            "resident_bytes": resident,
+            "indexes": {entry.name: entry.to_dict() for entry in entries},
+        }
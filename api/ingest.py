@@ -0,0 +1,126 @@
+import json
+import queue
+import base64
+import asyncio
+
+from utils.document_sources import IngestDocument
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+# Batches of body lines buffered between the request and the ingestion thread, one batch per received body chunk
+INGEST_QUEUE_BATCHES = 64
+# How often a request waiting on a full queue checks whether it has room again
+INGEST_POLL_SECONDS = 0.01
+
+def parse_document_line(line: bytes, line_number: int) -> IngestDocument:
+    """
+    Parses one line of a newline-delimited JSON ingest body
+
+    Args:
+        line: {"id": ..., "text": ...} for extracted text, or {"id": ..., "content": ..., "file_type": ...} with the
+            base64 encoded bytes of a PDF, DOCX or TXT file; file_type defaults to the extension of the id
+        line_number: 1-based line number, for error messages
+
+    Returns:
+        IngestDocument: The document
+    """
+    try:
+        record = json.loads(line)
+    except ValueError as e:
+        raise ValueError(f"Line {line_number} is not valid JSON: {e}")
+    if not isinstance(record, dict) or not isinstance(record.get("id"), str) or not record["id"]:
+        raise ValueError(f"Line {line_number} has no document id")
+
+    if isinstance(record.get("text"), str):
+        data = record["text"]
+    elif isinstance(record.get("content"), str):
+        try:
+            data = base64.b64decode(record["content"], validate=True)
+        except ValueError as e:
+            raise ValueError(f"Line {line_number} has invalid base64 content: {e}")
+    else:
+        raise ValueError(f"Line {line_number} has neither text nor content")
+    return IngestDocument(record["id"], data, record.get("file_type"))
+
+
+class IngestQueue:
+    """
+    Bounded queue between a request body read on the event loop and VSM.ingest_documents running in a thread.
+    While the queue is full the request stops reading its body, so TCP flow control slows the client down to
+    the rate documents are indexed at instead of buffering the stream in memory.
+    """
+    def __init__(self, maxsize=INGEST_QUEUE_BATCHES) -> None:
+        self.queue = queue.Queue(maxsize)
+
+    async def put(self, lines, consumer) -> bool:
+        """
+        Args:
+            lines: List of body lines, or None to end the stream
+            consumer: Future of the ingestion thread
+
+        Returns:
+            bool: False if the ingestion stopped, e.g. on an invalid line, and no longer takes lines
+        """
+        while True:
+            try:
+                self.queue.put_nowait(lines)
+                return True
+            except queue.Full:
+                if consumer.done():
+                    return False
+                await asyncio.sleep(INGEST_POLL_SECONDS)
+
+    def documents(self):
+        """
+        Consumed by the ingestion thread
+
+        Yields:
+            IngestDocument: Documents of the body lines, until the stream ends
+        """
+        line_number = 0
+        while True:
+            lines = self.queue.get()
+            if lines is None:
+                return
+            for line in lines:
+                line_number += 1
+                if line.strip():
+                    yield parse_document_line(line, line_number)
+
+
+async def ingest_stream(body, engine, n_workers=None, recluster=False) -> dict:
+    """
+    Streams a newline-delimited JSON body into an index, reading it only as fast as its documents are indexed
+
+    Args:
+        body: Async iterator of body bytes, e.g. request.stream()
+        engine: VSM to ingest into
+        n_workers: Number of ingestion processes
+        recluster: Force a full re-clustering after the ingestion
+
+    Returns:
+        dict: Summary returned by VSM.ingest_documents
+    """
+    stream = IngestQueue()
+    consumer = asyncio.get_running_loop().run_in_executor(None, lambda: engine.ingest_documents(stream.documents(), n_workers, recluster))
+    try:
+        pieces = [] # start of an unfinished line, a base64 encoded file may span many body chunks
+        async for chunk in body:
+            pieces.append(chunk)
+            if b"\n" not in chunk:
+                continue
+            lines = b"".join(pieces).split(b"\n")
+            pieces = [lines.pop()]
+            if not await stream.put(lines, consumer):
+                break
+        else:
+            last = b"".join(pieces)
+            if last:
+                await stream.put([last], consumer)
+    finally:
+        # also on a client disconnect the documents received so far are indexed, and the index is only
+        # free for the next ingestion once this one has finished
+        await stream.put(None, consumer)
+        await asyncio.wait([consumer])
+    return consumer.result()
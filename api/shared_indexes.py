@@ -0,0 +1,156 @@
+import os
+import re
+import threading
+from contextlib import contextmanager
+
+from src.sharded_vsm import ShardedVSM
+from api.index_registry import INDEX_NAME_PATTERN
+from utils.index_store import publish_index, current_generation, GENERATION_POINTER
+from utils.logger import get_logger
+from utils import metrics
+
+logger = get_logger(__name__)
+
+GENERATION_SWAPS = metrics.counter("vsm_shared_generation_swaps_total", "Published generations of an index this worker switched to", ("index",))
+
+# Lock file of an index's publishing root, held while a worker changes and republishes the index
+WRITER_LOCK = ".lock"
+
+class SharedIndexes:
+    """
+    Indexes served by several API worker processes from published generations.
+    A worker that builds, updates or ingests into an index publishes the result as a new generation directory under
+    root/<index> and atomically repoints its CURRENT file (utils.index_store.publish_index). Every worker, the
+    publisher included, notices the new pointer on its next request for the index and swaps in the generation loaded
+    with VSM.load. Postings, positions and CSR arrays are memory maps of the same files in every worker, so the page
+    cache holds them once however many workers serve them. Requests already running finish on the engine they started
+    with, and a worker switches generations only between requests, so a query never mixes two generations.
+    """
+    def __init__(self, root: str, registry, keep=2) -> None:
+        """
+        Args:
+            root: Directory holding a publishing root per index name
+            registry: IndexRegistry of this worker, the published indexes are served through it
+            keep: Generations kept per index, older ones are deleted when a new one is published
+        """
+        self.root = root
+        self.registry = registry
+        self.keep = keep
+        self.pointers = {} # name --> (inode, modification time) of the CURRENT file last synced
+        self.lock = threading.Lock() # held while a generation is loaded
+
+    def index_root(self, name: str) -> str:
+        return os.path.join(self.root, name)
+
+    def names(self) -> list:
+        """
+        Returns:
+            list: Names of the indexes with a published generation
+        """
+        if not os.path.isdir(self.root):
+            return []
+        return [name for name in sorted(os.listdir(self.root))
+                if re.match(INDEX_NAME_PATTERN, name) and os.path.exists(os.path.join(self.root, name, GENERATION_POINTER))]
+
+    def sync(self, name: str, wait=False) -> None:
+        """
+        Switches this worker to the current generation of an index if another one was published since the last
+        call. Costs one stat of the CURRENT file when nothing changed.
+
+        Args:
+            name: Index name
+            wait: Wait for a load already in progress in another thread, instead of serving the resident
+                generation meanwhile
+        """
+        if not re.match(INDEX_NAME_PATTERN, name):
+            return
+        try:
+            stat = os.stat(os.path.join(self.index_root(name), GENERATION_POINTER))
+        except FileNotFoundError:
+            if self.pointers.pop(name, None) is not None:
+                # the index was withdrawn by another worker
+                self.registry.remove(name)
+            return
+        pointer = (stat.st_ino, stat.st_mtime_ns)
+        if self.pointers.get(name) == pointer:
+            return
+
+        # requests for a resident index keep being answered while one thread loads the new generation
+        if not self.lock.acquire(blocking=wait or self.registry.peek(name) is None):
+            return
+        try:
+            if self.pointers.get(name) == pointer:
+                return
+            generation_dir = current_generation(self.index_root(name))
+            if generation_dir is not None and generation_dir != self.registry.index_dir(name):
+                if self.registry.peek(name) is not None:
+                    self.registry.put(name, self.registry.load(generation_dir), index_dir=generation_dir)
+                    GENERATION_SWAPS.inc(1, name)
+                    logger.info(f"Switched index {name} to {generation_dir}")
+                else:
+                    # loaded when first queried
+                    self.registry.register(name, generation_dir, persistent=False)
+            self.pointers[name] = pointer
+        finally:
+            self.lock.release()
+
+    @contextmanager
+    def writer(self, name: str, blocking=True):
+        """
+        Serializes changes of an index across worker processes with an exclusive lock on a file of its publishing
+        root, so concurrent updates are not lost by publishing on top of a stale generation. POSIX only.
+
+        Args:
+            name: Index name
+            blocking: Wait for another worker's change to finish instead of giving up
+
+        Yields:
+            bool: Whether the lock was acquired, only False if blocking is False
+        """
+        import fcntl
+
+        os.makedirs(self.index_root(name), exist_ok=True)
+        with open(os.path.join(self.index_root(name), WRITER_LOCK), "w") as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def publish(self, name: str, engine) -> str:
+        """
+        Publishes an index as its next generation and switches this worker to it, other workers follow on their next
+        request. Called while holding writer(name).
+
+        Args:
+            name: Index name
+            engine: Built or changed VSM or ShardedVSM
+
+        Returns:
+            str: Directory of the new generation
+        """
+        generation_dir = publish_index(engine, self.index_root(name), self.keep)
+        # the in-memory engine is replaced by the mapped generation, shared with the other workers
+        self.sync(name, wait=True)
+        if isinstance(engine, ShardedVSM) and self.registry.peek(name) is not engine:
+            engine.close()
+        return generation_dir
+
+    def withdraw(self, name: str) -> bool:
+        """
+        Stops every worker serving an index by removing its CURRENT file, its generations are kept
+
+        Returns:
+            bool: False if the index has no published generation
+        """
+        try:
+            os.remove(os.path.join(self.index_root(name), GENERATION_POINTER))
+        except FileNotFoundError:
+            return False
+        self.pointers.pop(name, None)
+        logger.info(f"Withdrew shared index {name}")
+        return True
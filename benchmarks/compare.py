@@ -0,0 +1,75 @@
+import sys
+import json
+import argparse
+from utils.logger import get_logger
+
+logger=get_logger(__name__)
+
+# Metrics where a larger value is an improvement, every other timing or size metric is better when smaller
+HIGHER_IS_BETTER=("qps", "recall_at_k")
+# Metrics describing the run rather than its performance
+IGNORED=("count", "batch_size", "documents", "terms", "postings", "position_bytes")
+
+def flatten(results: dict, prefix="")->dict:
+    """
+    Args:
+        results: Nested results of one corpus
+        prefix: Key prefix of the nested level
+
+    Returns:
+        dict: dotted metric name --> numeric value
+    """
+    flat={}
+    for key, value in results.items():
+        name=f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten(value, name + "."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool) and key not in IGNORED:
+            flat[name]=value
+    return flat
+
+def compare(baseline: dict, candidate: dict, threshold: float)->list:
+    """
+    Args:
+        baseline: Results JSON of the reference run
+        candidate: Results JSON of the run to check
+        threshold: Relative change treated as a regression, e.g. 0.1 for 10%
+
+    Returns:
+        list: (corpus, metric, baseline value, candidate value, relative change, regressed) for metrics in both runs
+    """
+    baseline_runs={run["corpus"]["name"]: run for run in baseline["runs"]}
+    rows=[]
+    for run in candidate["runs"]:
+        name=run["corpus"]["name"]
+        if name not in baseline_runs:
+            continue
+        before=flatten({key: value for key, value in baseline_runs[name].items() if key!="corpus"})
+        after=flatten({key: value for key, value in run.items() if key!="corpus"})
+        for metric in sorted(before.keys() & after.keys()):
+            if not before[metric]:
+                continue
+            change=(after[metric] - before[metric]) / before[metric]
+            worse=-change if metric.rsplit(".", 1)[-1] in HIGHER_IS_BETTER else change
+            rows.append((name, metric, before[metric], after[metric], change, worse > threshold))
+    return rows
+
+if __name__=="__main__":
+    parser=argparse.ArgumentParser(description="Compare two benchmark result files, exiting with status 1 on regressions")
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    parser.add_argument("--threshold", type=float, default=0.1, help="Relative change reported as a regression")
+    args=parser.parse_args()
+
+    with open(args.baseline) as f:
+        baseline=json.load(f)
+    with open(args.candidate) as f:
+        candidate=json.load(f)
+    print(f"{baseline.get('commit')} -> {candidate.get('commit')}")
+
+    rows=compare(baseline, candidate, args.threshold)
+    for name, metric, before, after, change, regressed in rows:
+        print(f"{'REGRESSION ' if regressed else '           '}{name:<40} {metric:<45} {before:>12.4f} {after:>12.4f} {change:>+8.1%}")
+    regressions=sum(regressed for *_, regressed in rows)
+    print(f"{regressions} regressions above {args.threshold:.0%} in {len(rows)} metrics")
+    sys.exit(1 if regressions else 0)
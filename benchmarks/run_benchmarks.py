@@ -0,0 +1,400 @@
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+import urllib.request
+import urllib.parse
+import multiprocessing
+from datetime import datetime, timezone
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+try:
+    import resource
+except ImportError: # not available on Windows, peak RSS is then reported as None
+    resource=None
+
+from src.vsm_basic import VSM
+from benchmarks.synthetic_corpus import generate_corpus, misspell
+from benchmarks.startup import benchmark_startup
+from utils.logger import get_logger
+
+logger=get_logger(__name__)
+
+# Bumped whenever the layout of the results JSON changes
+RESULTS_FORMAT_VERSION=1
+WORD_PATTERN=re.compile(r"[A-Za-z]{4,}")
+
+def percentiles(latencies: list)->dict:
+    """
+    Args:
+        latencies: Latencies in seconds
+
+    Returns:
+        dict: count, mean, p50, p95, p99 and max latency in milliseconds, and throughput in calls per second
+    """
+    samples=np.asarray(latencies) * 1000
+    total=float(samples.sum()) / 1000
+    return {
+        "count": len(samples),
+        "mean_ms": float(samples.mean()),
+        "p50_ms": float(np.percentile(samples, 50)),
+        "p95_ms": float(np.percentile(samples, 95)),
+        "p99_ms": float(np.percentile(samples, 99)),
+        "max_ms": float(samples.max()),
+        "qps": len(samples) / total if total > 0 else None,
+    }
+
+def time_calls(fn, items: list, before=None)->list:
+    """
+    Args:
+        fn: Callable applied to each item
+        items: Arguments, one call each
+        before: Optional callable run untimed before every call, e.g. to clear a cache
+
+    Returns:
+        list: Wall clock latency of each call in seconds
+    """
+    latencies=[]
+    for item in items:
+        if before is not None:
+            before()
+        start=time.perf_counter()
+        fn(item)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+def peak_rss_mb(who=None):
+    """
+    Args:
+        who: resource.RUSAGE_SELF (default) or resource.RUSAGE_CHILDREN
+
+    Returns:
+        float: Peak resident set size in MiB, None where unsupported
+    """
+    if resource is None:
+        return None
+    usage=resource.getrusage(resource.RUSAGE_SELF if who is None else who).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return usage / (1 << 20) if sys.platform=="darwin" else usage / 1024
+
+def directory_size(path: str)->int:
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+def make_queries(doc_store, doc_ids: list, n: int, rng, max_terms=3)->list:
+    """
+    Samples queries of 1 to max_terms words that co-occur in one document, so frequent words are drawn
+    as often as they occur in the corpus
+
+    Args:
+        doc_store: DocumentStore holding the document texts
+        doc_ids: Ids of the documents to sample from
+        n: Number of queries
+        rng: numpy Generator
+        max_terms: Maximum words per query
+
+    Returns:
+        list: Query strings
+    """
+    queries=[]
+    while len(queries) < n:
+        words=WORD_PATTERN.findall(doc_store.get(doc_ids[rng.integers(0, len(doc_ids))]))
+        if words:
+            n_terms=min(int(rng.integers(1, max_terms + 1)), len(words))
+            queries.append(" ".join(words[i].lower() for i in rng.choice(len(words), n_terms, replace=False)))
+    return queries
+
+def cluster_pruning(vsm, queries: list, k: int, scoring: str)->dict:
+    """
+    Latency and recall@k of every number of probed clusters, against exhaustive scoring of all clusters
+
+    Args:
+        vsm: Built index, with its query cache disabled
+        queries: Query strings
+        k: Number of results per query
+        scoring: Scoring backend
+
+    Returns:
+        dict: n_probe --> latency statistics with the mean recall@k
+    """
+    n_clusters=max(vsm.n_clusters, 1)
+    exhaustive=[{filename for filename, _ in vsm.query(query, scoring=scoring, k=k, n_probe=n_clusters)[0]} for query in queries]
+    results={}
+    for n_probe in range(1, n_clusters + 1):
+        ranked=[]
+        stats=percentiles(time_calls(lambda q: ranked.append(vsm.query(q, scoring=scoring, k=k, n_probe=n_probe)[0]), queries))
+        recalls=[len(expected & {filename for filename, _ in found}) / len(expected) for expected, found in zip(exhaustive, ranked) if expected]
+        stats["recall_at_k"]=sum(recalls) / len(recalls) if recalls else None
+        results[str(n_probe)]=stats
+    return results
+
+def similarity_search(vsm, doc_ids: list, k: int, lsh_settings: list)->dict:
+    """
+    Latency and recall@k of similar document search per method and setting, against the exact method
+
+    Args:
+        vsm: Built index
+        doc_ids: Document ids to find similar documents for
+        k: Number of results per document
+        lsh_settings: (tables, bits) of the LSH indexes to build and time
+
+    Returns:
+        dict: latency statistics of the exact method; per LSH setting "<tables>x<bits>" and per n_probe of the
+            cluster method, latency statistics with the mean recall@k, plus LSH build time and candidates per lookup
+    """
+    exact=[]
+    results={"exact": percentiles(time_calls(lambda doc_id: exact.append(vsm.similar(doc_id, k, "exact")[0]), doc_ids))}
+    expected=[{filename for filename, _ in found} for found in exact]
+
+    def measure(method, **kwargs):
+        ranked=[]
+        stats=percentiles(time_calls(lambda doc_id: ranked.append(vsm.similar(doc_id, k, method, **kwargs)[0]), doc_ids))
+        recalls=[len(e & {filename for filename, _ in found}) / len(e) for e, found in zip(expected, ranked) if e]
+        stats["recall_at_k"]=sum(recalls) / len(recalls) if recalls else None
+        return stats
+
+    configured=(vsm.lsh_tables, vsm.lsh_bits)
+    results["lsh"]={}
+    for tables, bits in lsh_settings:
+        vsm.lsh_tables, vsm.lsh_bits=tables, bits
+        start=time.perf_counter()
+        index=vsm.get_similarity_index()
+        build_seconds=time.perf_counter() - start
+        stats=measure("lsh")
+        stats["build_seconds"]=build_seconds
+        stats["candidates"]=float(np.mean([len(index.candidates(doc_id)) for doc_id in doc_ids]))
+        results["lsh"][f"{tables}x{bits}"]=stats
+        vsm.similarity_index=None
+    vsm.lsh_tables, vsm.lsh_bits=configured
+    results["cluster"]={str(n_probe): measure("cluster", n_probe=n_probe) for n_probe in range(1, max(vsm.n_clusters, 1) + 1)}
+    return results
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def prepare_corpus(scale: str, args)->tuple:
+    """
+    Args:
+        scale: "corpus" for the bundled corpus/ directory, or a number of synthetic documents
+        args: Parsed command line arguments
+
+    Returns:
+        tuple: (corpus directory, corpus description)
+    """
+    if not scale.isdigit():
+        return scale, {"name": os.path.basename(os.path.normpath(scale)), "n_docs": len(os.listdir(scale))}
+
+    params={
+        "n_docs": int(scale),
+        "vocab_size": args.vocab,
+        "exponent": args.zipf,
+        "mean_length": args.mean_length,
+        "misspell_rate": args.misspell_rate,
+        "seed": args.seed,
+    }
+    if args.topics:
+        # only part of the name when used, so results of untopical corpora stay comparable across versions
+        params.update(n_topics=args.topics, topic_weight=args.topic_weight)
+    name="synthetic_" + "_".join(str(value) for value in params.values())
+    corpus_dir=os.path.join(args.data_dir, name)
+    # generated corpora are reused across runs, the description file is written once generation completed
+    info_path=corpus_dir + ".json"
+    if os.path.exists(info_path):
+        with open(info_path) as f:
+            info=json.load(f)
+    else:
+        shutil.rmtree(corpus_dir, ignore_errors=True)
+        start=time.perf_counter()
+        info=generate_corpus(corpus_dir, **params)
+        info["generation_seconds"]=time.perf_counter() - start
+        with open(info_path, "w") as f:
+            json.dump(info, f)
+    return corpus_dir, dict(info, name=name)
+
+def benchmark_api(api_url: str, index_dir: str, queries: list, batch_queries: list)->dict:
+    """
+    Loads the saved index into a running API service and times /search and /search/batch over HTTP
+
+    Args:
+        api_url: Base URL of the service, which must be able to read index_dir. Its query cache stays enabled,
+            so repeated queries are answered from the cache as in production
+        index_dir: Directory of the saved index
+        queries: Single queries
+        batch_queries: Lists of queries, one /search/batch request each
+
+    Returns:
+        dict: Latency statistics per endpoint
+    """
+    def request(path, body=None):
+        data=json.dumps(body).encode() if body is not None else None
+        req=urllib.request.Request(api_url.rstrip("/") + path, data=data, method="POST" if body is not None or path.startswith("/index") else "GET",
+                                   headers={"Content-Type": "application/json"})
+        with urllib.request.urlopen(req) as response:
+            return json.loads(response.read())
+
+    loaded=request("/index/load?" + urllib.parse.urlencode({"index_dir": index_dir}))
+    if "error" in loaded:
+        raise RuntimeError(f"API could not load {index_dir}: {loaded['error']}")
+    results={"search": percentiles(time_calls(lambda q: request("/search?" + urllib.parse.urlencode({"query": q})), queries))}
+    batch=percentiles(time_calls(lambda batch: request("/search/batch", {"queries": batch}), batch_queries))
+    batch["qps"]=batch["qps"] * len(batch_queries[0]) if batch["qps"] else None
+    results["search_batch"]=batch
+    return results
+
+def benchmark_corpus(corpus_dir: str, corpus_info: dict, args)->dict:
+    """
+    Builds, saves and queries one corpus. Runs in its own process so peak RSS belongs to this corpus alone.
+
+    Args:
+        corpus_dir: Directory of the documents
+        corpus_info: Description of the corpus, copied to the results
+        args: Parsed command line arguments
+
+    Returns:
+        dict: Results for this corpus
+    """
+    rng=np.random.default_rng(args.seed)
+    result={"corpus": corpus_info}
+
+    # the query cache is disabled so every timed query is scored
+    vsm=VSM(corpus_dir, n_workers=args.workers, query_cache_size=0)
+    phase_starts={}
+    def progress(phase, done, total):
+        phase_starts.setdefault(phase, time.perf_counter())
+    start=time.perf_counter()
+    vsm.build_index(progress=progress)
+    end=time.perf_counter()
+    phases=list(phase_starts.items()) + [("end", end)]
+    result["build"]={
+        "total_seconds": end - start,
+        "phases": {phase: phases[i+1][1] - phase_start for i, (phase, phase_start) in enumerate(phases[:-1])},
+        "peak_rss_mb": peak_rss_mb(),
+        "peak_rss_workers_mb": peak_rss_mb(resource.RUSAGE_CHILDREN) if resource is not None and args.workers > 1 else None,
+    }
+
+    index_dir=tempfile.mkdtemp(prefix="index_", dir=args.data_dir)
+    try:
+        start=time.perf_counter()
+        vsm.save(index_dir)
+        save_seconds=time.perf_counter() - start
+        start=time.perf_counter()
+        VSM.load(index_dir)
+        result["index"]={
+            "documents": vsm.N,
+            "terms": len(vsm.dictionary),
+            "postings": sum(df for df, _ in vsm.dictionary.values()),
+            "position_bytes": sum(len(positions) for term_positions in vsm.positions.values() for positions in term_positions),
+            "bytes_on_disk": directory_size(index_dir),
+            "save_seconds": save_seconds,
+            "load_seconds": time.perf_counter() - start,
+        }
+
+        doc_ids=list(vsm.doc_index)
+        queries=make_queries(vsm.doc_store, doc_ids, args.queries, rng)
+        fuzzy_queries=[" ".join(misspell(word, rng) for word in query.split()) for query in queries[:args.fuzzy_queries]]
+        # sampled separately, so a service answering the single queries from its result cache does not serve the batches too
+        batch_source=make_queries(vsm.doc_store, doc_ids, args.queries, rng)
+        batch_queries=[batch_source[i:i+args.batch_size] for i in range(0, len(batch_source) - args.batch_size + 1, args.batch_size)]
+
+        # warm up the preprocessing caches and lazily built structures before timing
+        for query in queries[:10]:
+            vsm.query(query)
+
+        single={}
+        for scoring in args.scoring:
+            single[scoring]=percentiles(time_calls(lambda q: vsm.query(q, scoring=scoring, k=args.k), queries))
+        batch=percentiles(time_calls(lambda batch: vsm.query_batch(batch, k=args.k), batch_queries))
+        # batch throughput in queries rather than batches per second
+        batch["qps"]=batch["qps"] * args.batch_size if batch["qps"] else None
+        batch["batch_size"]=args.batch_size
+
+        # fuzzy corrections are cached per term, cleared so every correction is measured cold
+        clear_fuzzy=vsm.fuzzy_cache.clear
+        fuzzy=percentiles(time_calls(lambda q: vsm.query(q, k=args.k), fuzzy_queries, before=clear_fuzzy))
+        misspelled=[word for query in fuzzy_queries for word in vsm.preprocess(query) if word not in vsm.dictionary]
+        matcher=percentiles(time_calls(vsm.fuzzy_matcher, misspelled, before=clear_fuzzy)) if misspelled else None
+        result["queries"]={"single": single, "batch": batch, "fuzzy": fuzzy, "fuzzy_matcher": matcher}
+        result["cluster_pruning"]={scoring: cluster_pruning(vsm, queries, args.k, scoring) for scoring in args.scoring if scoring!="maxscore"}
+        if args.similar_docs:
+            similar_docs=rng.choice(sorted(vsm.doc_lengths), min(args.similar_docs, len(vsm.doc_lengths)), replace=False).tolist()
+            result["similarity"]=similarity_search(vsm, similar_docs, args.k, args.lsh)
+
+        if args.startup_runs:
+            result["startup"]=benchmark_startup(os.path.abspath(index_dir), args.startup_runs)
+        if args.api_url:
+            result["api"]=benchmark_api(args.api_url, os.path.abspath(index_dir), queries, batch_queries)
+    finally:
+        shutil.rmtree(index_dir, ignore_errors=True)
+
+    result["peak_rss_mb"]=peak_rss_mb()
+    logger.info(f"Benchmarked {corpus_info['name']} in {result['build']['total_seconds']:.2f}s build")
+    return result
+
+def main(argv=None)->dict:
+    parser=argparse.ArgumentParser(description="Benchmark index build and query performance, writing results as JSON")
+    parser.add_argument("--scales", default="corpus,1000,10000",
+                        help="Comma separated corpora: a directory (e.g. corpus) or a number of synthetic documents")
+    parser.add_argument("--output", help="Results file, defaults to benchmarks/results/<commit>_<time>.json")
+    parser.add_argument("--data-dir", default=os.path.join(tempfile.gettempdir(), "vsm_benchmarks"),
+                        help="Where synthetic corpora are generated and kept for reuse")
+    parser.add_argument("--vocab", type=int, default=50000, help="Synthetic vocabulary size")
+    parser.add_argument("--zipf", type=float, default=1.1, help="Zipf exponent of the synthetic vocabulary")
+    parser.add_argument("--mean-length", type=int, default=300, help="Mean synthetic document length in tokens")
+    parser.add_argument("--misspell-rate", type=float, default=0.01, help="Fraction of misspelled synthetic tokens")
+    parser.add_argument("--topics", type=int, default=0, help="Synthetic topics giving the corpus cluster structure, 0 for none")
+    parser.add_argument("--topic-weight", type=float, default=0.5, help="Fraction of synthetic tokens drawn from the document's topic")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=1, help="Ingestion processes used by build_index")
+    parser.add_argument("--queries", type=int, default=500, help="Number of timed single queries")
+    parser.add_argument("--fuzzy-queries", type=int, default=100, help="Number of timed misspelled queries")
+    parser.add_argument("--batch-size", type=int, default=50)
+    parser.add_argument("--scoring", default="python,numpy,maxscore", help="Scoring backends timed for single queries")
+    parser.add_argument("-k", type=int, default=10)
+    parser.add_argument("--similar-docs", type=int, default=100, help="Documents timed for similar document search, 0 to skip")
+    parser.add_argument("--lsh", default="8x8,8x12,16x8,16x12", help="LSH tables x bits settings timed for similar document search")
+    parser.add_argument("--startup-runs", type=int, default=5, help="Processes started to time imports and serve-only API cold start, 0 to skip")
+    parser.add_argument("--api-url", help="Also time /search and /search/batch of a running API service, e.g. http://localhost:8000")
+    args=parser.parse_args(argv)
+    args.scoring=args.scoring.split(",")
+    args.lsh=[tuple(int(part) for part in setting.split("x")) for setting in args.lsh.split(",")]
+    os.makedirs(args.data_dir, exist_ok=True)
+
+    commit=git_commit()
+    results={
+        "format_version": RESULTS_FORMAT_VERSION,
+        "commit": commit,
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "machine": {
+            "platform": platform.platform(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "cpu_count": os.cpu_count(),
+        },
+        "settings": {key: value for key, value in vars(args).items() if key not in ("output", "data_dir", "api_url")},
+        "runs": [],
+    }
+
+    for scale in args.scales.split(","):
+        corpus_dir, corpus_info=prepare_corpus(scale, args)
+        print(f"Benchmarking {corpus_info['name']} ({corpus_info['n_docs']} documents)", flush=True)
+        # a fresh process per corpus keeps peak RSS and caches independent between scales
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+            results["runs"].append(executor.submit(benchmark_corpus, corpus_dir, corpus_info, args).result())
+
+    output=args.output or os.path.join("benchmarks", "results", f"{(commit or 'unknown')[:12]}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {output}")
+    return results
+
+if __name__=="__main__":
+    main()
@@ -0,0 +1,85 @@
+import os
+import sys
+import json
+import argparse
+import subprocess
+import time
+import numpy as np
+from utils.logger import get_logger
+
+logger=get_logger(__name__)
+
+# Text extraction backends, which query-only processes should never import
+EXTRACTION_MODULES=("fitz", "pymupdf", "docx", "pytesseract", "PIL")
+
+# Runs in a fresh interpreter: imports one module and reports how long it took and which extraction backends it loaded
+IMPORT_PROBE="""
+import sys, json, time
+start=time.perf_counter()
+import {module}
+elapsed=time.perf_counter() - start
+print(json.dumps({{"import_seconds": elapsed, "extraction_modules": [name for name in {extraction_modules!r} if name in sys.modules]}}))
+"""
+
+def time_import(module: str, env=None, repeats=5)->dict:
+    """
+    Imports a module in fresh interpreters, as a worker process starting up would
+
+    Args:
+        module: Module to import, e.g. api.app
+        env: Extra environment variables of the processes, on top of the current environment without VSM_* settings
+        repeats: Number of processes started
+
+    Returns:
+        dict: median import and whole process seconds, and the extraction backends the import loaded
+    """
+    process_env={name: value for name, value in os.environ.items() if not name.startswith("VSM_")}
+    process_env.update(env or {})
+    process_env["PYTHONPATH"]=os.pathsep.join(filter(None, [os.getcwd(), process_env.get("PYTHONPATH")]))
+
+    imports=[]
+    processes=[]
+    probe=None
+    for _ in range(repeats):
+        start=time.perf_counter()
+        completed=subprocess.run([sys.executable, "-c", IMPORT_PROBE.format(module=module, extraction_modules=EXTRACTION_MODULES)],
+                                 env=process_env, capture_output=True, text=True)
+        processes.append(time.perf_counter() - start)
+        if completed.returncode!=0:
+            raise RuntimeError(f"Importing {module} failed: {completed.stderr.strip().splitlines()[-1:]}")
+        probe=json.loads(completed.stdout.strip().splitlines()[-1])
+        imports.append(probe["import_seconds"])
+    return {
+        "import_seconds": float(np.median(imports)),
+        "process_seconds": float(np.median(processes)),
+        "extraction_modules": probe["extraction_modules"],
+    }
+
+def benchmark_startup(index_dir=None, repeats=5)->dict:
+    """
+    Cold start of the library and of API workers
+
+    Args:
+        index_dir: Saved index an API worker serves from, in serve-only mode; skipped if None
+        repeats: Processes started per measurement
+
+    Returns:
+        dict: time_import results for the library, the API without an index and the API serving index_dir
+    """
+    results={
+        "vsm": time_import("src.vsm_basic", repeats=repeats),
+        "api": time_import("api.app", repeats=repeats),
+    }
+    if index_dir:
+        results["api_serve_only"]=time_import("api.app", {"VSM_INDEX_DIR": index_dir, "VSM_SERVE_ONLY": "1"}, repeats)
+    for name, result in results.items():
+        if result["extraction_modules"]:
+            logger.warning(f"Startup of {name} imported extraction backends: {result['extraction_modules']}")
+    return results
+
+if __name__=="__main__":
+    parser=argparse.ArgumentParser(description="Measure import and API cold start time")
+    parser.add_argument("--index-dir", help="Saved index to time a serve-only API worker with")
+    parser.add_argument("--repeats", type=int, default=5)
+    args=parser.parse_args()
+    print(json.dumps(benchmark_startup(os.path.abspath(args.index_dir) if args.index_dir else None, args.repeats), indent=2))
@@ -0,0 +1,154 @@
+import os
+import argparse
+import numpy as np
+from utils.logger import get_logger
+
+logger=get_logger(__name__)
+
+CONSONANTS="bcdfghjklmnprstvwz"
+VOWELS="aeiou"
+LETTERS="abcdefghijklmnopqrstuvwxyz"
+
+# Documents generated per vectorized sampling step, bounds the memory of the token buffer
+GENERATION_CHUNK=1000
+# Tokens per line of a generated document
+LINE_LENGTH=16
+
+def make_vocabulary(vocab_size: int, rng)->list:
+    """
+    Generates distinct pronounceable pseudo-words of two to four consonant-vowel syllables
+
+    Args:
+        vocab_size: Number of words
+        rng: numpy Generator
+
+    Returns:
+        list: Words, index 0 being the most frequent rank
+    """
+    syllables=[c + v for c in CONSONANTS for v in VOWELS]
+    words=[]
+    seen=set()
+    while len(words) < vocab_size:
+        n_syllables=rng.integers(2, 5)
+        word="".join(syllables[i] for i in rng.integers(0, len(syllables), n_syllables))
+        if word not in seen:
+            seen.add(word)
+            words.append(word)
+    return words
+
+def zipf_cdf(vocab_size: int, exponent: float)->np.ndarray:
+    """
+    Args:
+        vocab_size: Number of ranks
+        exponent: Zipf exponent s, the frequency of rank r is proportional to 1 / r^s
+
+    Returns:
+        nparray: Cumulative distribution over ranks, for inverse transform sampling
+    """
+    weights=1.0 / np.arange(1, vocab_size + 1) ** exponent
+    cdf=np.cumsum(weights)
+    return cdf / cdf[-1]
+
+def misspell(word: str, rng)->str:
+    """
+    Applies one random edit: deletion, insertion, substitution or transposition of adjacent letters
+
+    Args:
+        word: Word to misspell
+        rng: numpy Generator
+
+    Returns:
+        str: Misspelled word
+    """
+    i=int(rng.integers(0, len(word)))
+    edit=rng.integers(0, 4)
+    letter=LETTERS[rng.integers(0, len(LETTERS))]
+    if edit==0 and len(word) > 3:
+        return word[:i] + word[i+1:]
+    if edit==1:
+        return word[:i] + letter + word[i:]
+    if edit==2 and i + 1 < len(word):
+        return word[:i] + word[i+1] + word[i] + word[i+2:]
+    return word[:i] + letter + word[i+1:]
+
+def generate_corpus(out_dir: str, n_docs: int, vocab_size=50000, exponent=1.1, mean_length=300, misspell_rate=0.01, seed=0, n_topics=0, topic_weight=0.5)->dict:
+    """
+    Writes a synthetic text corpus whose term frequencies follow a Zipfian distribution.
+    With topics, every document belongs to one topic and draws a topic_weight share of its tokens from the topic's own
+    Zipfian ranking of the vocabulary, giving the corpus cluster structure.
+    The same arguments always produce the same files.
+
+    Args:
+        out_dir: Directory to write the documents to, created if missing
+        n_docs: Number of documents
+        vocab_size: Number of distinct words before misspellings
+        exponent: Zipf exponent of the word distribution
+        mean_length: Mean document length in tokens (Poisson distributed)
+        misspell_rate: Fraction of tokens replaced by a misspelled variant
+        seed: Random seed
+        n_topics: Number of topics, 0 for a single global word distribution
+        topic_weight: Fraction of each document's tokens drawn from its topic
+
+    Returns:
+        dict: Generation parameters with the token and misspelling counts
+    """
+    rng=np.random.default_rng(seed)
+    vocabulary=make_vocabulary(vocab_size, rng)
+    cdf=zipf_cdf(vocab_size, exponent)
+    # each topic ranks the vocabulary in its own random order
+    topic_ranks=np.stack([rng.permutation(vocab_size) for _ in range(n_topics)]) if n_topics else None
+    os.makedirs(out_dir, exist_ok=True)
+    width=len(str(n_docs))
+    n_tokens=0
+    n_misspelled=0
+
+    for chunk_start in range(0, n_docs, GENERATION_CHUNK):
+        lengths=np.maximum(rng.poisson(mean_length, min(GENERATION_CHUNK, n_docs - chunk_start)), 1)
+        ranks=np.minimum(np.searchsorted(cdf, rng.random(int(lengths.sum()))), vocab_size - 1)
+        if n_topics:
+            token_topics=np.repeat(rng.integers(0, n_topics, len(lengths)), lengths)
+            topical=rng.random(len(ranks)) < topic_weight
+            ranks[topical]=topic_ranks[token_topics[topical], ranks[topical]]
+        misspelled=np.flatnonzero(rng.random(len(ranks)) < misspell_rate)
+        tokens=[vocabulary[rank] for rank in ranks.tolist()]
+        for i in misspelled.tolist():
+            tokens[i]=misspell(tokens[i], rng)
+        n_tokens+=len(tokens)
+        n_misspelled+=len(misspelled)
+
+        offset=0
+        for j, length in enumerate(lengths.tolist()):
+            doc_tokens=tokens[offset:offset+length]
+            offset+=length
+            lines=(" ".join(doc_tokens[i:i+LINE_LENGTH]) for i in range(0, length, LINE_LENGTH))
+            with open(os.path.join(out_dir, f"doc_{chunk_start + j:0{width}d}.txt"), "w") as f:
+                f.write("\n".join(lines))
+
+    info={
+        "n_docs": n_docs,
+        "vocab_size": vocab_size,
+        "exponent": exponent,
+        "mean_length": mean_length,
+        "misspell_rate": misspell_rate,
+        "seed": seed,
+        "n_topics": n_topics,
+        "topic_weight": topic_weight,
+        "n_tokens": n_tokens,
+        "n_misspelled": n_misspelled,
+    }
+    logger.info(f"Generated synthetic corpus of {n_docs} documents and {n_tokens} tokens in {out_dir}")
+    return info
+
+if __name__=="__main__":
+    parser=argparse.ArgumentParser(description="Generate a synthetic Zipfian corpus for benchmarking")
+    parser.add_argument("out_dir")
+    parser.add_argument("--docs", type=int, default=10000)
+    parser.add_argument("--vocab", type=int, default=50000)
+    parser.add_argument("--zipf", type=float, default=1.1)
+    parser.add_argument("--mean-length", type=int, default=300)
+    parser.add_argument("--misspell-rate", type=float, default=0.01)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--topics", type=int, default=0)
+    parser.add_argument("--topic-weight", type=float, default=0.5)
+    args=parser.parse_args()
+    print(generate_corpus(args.out_dir, args.docs, args.vocab, args.zipf, args.mean_length, args.misspell_rate, args.seed, args.topics, args.topic_weight))
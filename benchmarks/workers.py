@@ -0,0 +1,167 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+import urllib.request
+import urllib.parse
+import urllib.error
+import multiprocessing
+import numpy as np
+from benchmarks.run_benchmarks import percentiles
+from utils.logger import get_logger
+
+logger=get_logger(__name__)
+
+# Seconds a started API gets until all its workers serve the index
+READY_TIMEOUT=120
+
+def process_memory(pid: int)->dict:
+    """
+    Args:
+        pid: Process id
+
+    Returns:
+        dict: resident, proportional (shared pages split between the processes mapping them) and private MiB of a
+            process, None where /proc/<pid>/smaps_rollup is unavailable
+    """
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            fields={line.split()[0].rstrip(":"): int(line.split()[1]) for line in f if line.split()[-1]=="kB"}
+    except OSError:
+        return None
+    return {
+        "rss_mb": fields["Rss"] / 1024,
+        "pss_mb": fields["Pss"] / 1024,
+        "private_mb": (fields["Private_Clean"] + fields["Private_Dirty"]) / 1024,
+    }
+
+def worker_pids(pid: int)->list:
+    """
+    Returns:
+        list: Process ids of the workers uvicorn started, not its multiprocessing resource tracker; the server
+            itself when it runs a single worker
+    """
+    pids=[]
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            children=[int(child) for child in f.read().split()]
+        for child in children:
+            with open(f"/proc/{child}/cmdline", "rb") as f:
+                if b"spawn_main" in f.read():
+                    pids.append(child)
+    except OSError:
+        pass
+    return pids or [pid]
+
+def get_json(url: str):
+    with urllib.request.urlopen(url) as response:
+        return json.loads(response.read())
+
+def wait_ready(api_url: str, n_workers: int, server)->None:
+    """
+    Waits until n_workers distinct workers report the default index resident
+    """
+    ready=set()
+    deadline=time.time() + READY_TIMEOUT
+    while len(ready) < n_workers:
+        if server.poll() is not None:
+            raise RuntimeError(f"API exited with code {server.returncode}")
+        if time.time() > deadline:
+            raise RuntimeError(f"Only {len(ready)} of {n_workers} workers ready after {READY_TIMEOUT} seconds")
+        try:
+            stats=get_json(api_url + "/indexes")
+        except (urllib.error.URLError, ConnectionError):
+            time.sleep(0.5)
+            continue
+        if stats.get("indexes", {}).get("default", {}).get("resident"):
+            ready.add(stats["worker_pid"])
+
+def run_client(api_url: str, queries: list, scoring: str, deadline: float)->list:
+    """
+    Sends queries one after another until the deadline
+
+    Returns:
+        list: Latency of each request in seconds
+    """
+    latencies=[]
+    i=0
+    while time.time() < deadline:
+        url=api_url + "/search?" + urllib.parse.urlencode({"query": queries[i % len(queries)], "scoring": scoring})
+        start=time.perf_counter()
+        with urllib.request.urlopen(url) as response:
+            response.read()
+        latencies.append(time.perf_counter() - start)
+        i+=1
+    return latencies
+
+def benchmark_workers(index_dir: str, worker_counts: list, clients=8, duration=10.0, n_queries=1000, scoring="numpy", port=8765, seed=0)->dict:
+    """
+    Serves a saved index from API processes with a growing number of workers sharing it (VSM_SHARED_ROOT), and
+    measures the query throughput of concurrent clients and the memory of each worker
+
+    Args:
+        index_dir: Saved index
+        worker_counts: Numbers of uvicorn workers to measure
+        clients: Concurrent client processes sending queries
+        duration: Seconds of load per worker count
+        n_queries: Distinct queries cycled through, drawn from the index lexicon
+        scoring: Scoring backend of the queries
+        port: Port the API is started on
+        seed: Seed of the query sample
+
+    Returns:
+        dict: per worker count, latency statistics and throughput, and resident, proportional and private memory
+            per worker and in total; proportional memory counts the shared index once across the workers
+    """
+    with open(os.path.join(index_dir, "terms.txt"), encoding="utf-8") as f:
+        terms=f.read().split("\n")
+    rng=np.random.default_rng(seed)
+    queries=[" ".join(rng.choice(terms, int(rng.integers(1, 4)))) for _ in range(n_queries)]
+    api_url=f"http://127.0.0.1:{port}"
+    # shared memory where available, so the published index never waits on disk
+    shared_parent="/dev/shm" if os.path.isdir("/dev/shm") else None
+
+    results={}
+    for n_workers in worker_counts:
+        shared_root=tempfile.mkdtemp(prefix="vsm-workers-", dir=shared_parent)
+        env={name: value for name, value in os.environ.items() if not name.startswith("VSM_")}
+        env.update(VSM_SERVE_ONLY="1", VSM_INDEX_DIR=os.path.abspath(index_dir), VSM_SHARED_ROOT=shared_root, VSM_LOG_SAMPLE_RATE="0")
+        env["PYTHONPATH"]=os.pathsep.join(filter(None, [os.getcwd(), env.get("PYTHONPATH")]))
+        server=subprocess.Popen([sys.executable, "-m", "uvicorn", "api.app:app", "--port", str(port), "--workers", str(n_workers), "--log-level", "warning"],
+                                env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            wait_ready(api_url, n_workers, server)
+            run_client(api_url, queries, scoring, time.time() + 1)
+            deadline=time.time() + duration
+            with multiprocessing.get_context("spawn").Pool(clients) as pool:
+                latencies=[latency for client in pool.starmap(run_client, [(api_url, queries, scoring, deadline)] * clients) for latency in client]
+            result=percentiles(latencies)
+            result["qps"]=len(latencies) / duration
+            workers=[memory for memory in map(process_memory, worker_pids(server.pid)) if memory is not None]
+            result["workers"]=workers
+            for key in ("rss_mb", "pss_mb", "private_mb"):
+                result[f"total_{key}"]=sum(memory[key] for memory in workers)
+            results[n_workers]=result
+            logger.info(f"{n_workers} workers: {result['qps']:.1f} QPS, {result['total_pss_mb']:.1f} MiB proportional memory")
+        finally:
+            server.terminate()
+            server.wait()
+            shutil.rmtree(shared_root, ignore_errors=True)
+    return results
+
+if __name__=="__main__":
+    parser=argparse.ArgumentParser(description="Measure query throughput and memory of API workers sharing one index")
+    parser.add_argument("--index-dir", required=True, help="Saved index to serve")
+    parser.add_argument("--workers", default="1,2,4", help="Comma separated numbers of workers")
+    parser.add_argument("--clients", type=int, default=8, help="Concurrent client processes")
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds of load per number of workers")
+    parser.add_argument("--queries", type=int, default=1000, help="Distinct queries cycled through")
+    parser.add_argument("--scoring", default="numpy")
+    parser.add_argument("--port", type=int, default=8765)
+    args=parser.parse_args()
+    print(json.dumps(benchmark_workers(args.index_dir, [int(n) for n in args.workers.split(",")], args.clients,
+                                      args.duration, args.queries, args.scoring, args.port), indent=2))
@@ -0,0 +1,292 @@
+import sys
+import math
+import numpy as np
+from utils.logger import get_logger
+
+logger=get_logger(__name__)
+
+class CSRScorer:
+    """
+    Vectorized scoring backend for VSM.query, organized by cluster for cluster-pruned retrieval.
+    Normalized lnc document weights are precomputed into CSR arrays (term row --> document ids and weights), and a query is
+    scored as a sparse query vector times document matrix product in NumPy. Within each row the entries are grouped by
+    cluster, with documents outside any cluster in a last group, so scoring a subset of clusters reads only their slices.
+    Per-cluster term statistics make cluster selection independent of postings list length.
+    """
+    def __init__(self, dictionaries: list, doc_lengths: dict, doc_clusters: dict)->None:
+        """
+        Builds the CSR arrays and cluster statistics from the postings
+
+        Args:
+            dictionaries: term dictionaries (term --> (document frequency, postings list)) in lookup priority order
+            doc_lengths: document id --> vector length
+            doc_clusters: document id --> cluster id
+
+        Returns:
+            None
+        """
+        self.n_docs=max(max(doc_lengths, default=0), max(doc_clusters, default=0)) + 1
+        self.n_clusters=max(doc_clusters.values(), default=-1) + 1
+        self.doc_clusters=np.full(self.n_docs, -1, dtype=np.int64)
+        for docID, cluster_id in doc_clusters.items():
+            self.doc_clusters[docID]=cluster_id
+        lengths=np.zeros(self.n_docs)
+        for docID, length in doc_lengths.items():
+            lengths[docID]=length
+
+        self.term_rows={}
+        row_docs=[]
+        row_tfs=[]
+        for dictionary in dictionaries:
+            for term in dictionary:
+                if term in self.term_rows:
+                    continue
+                df, posting_list=dictionary[term]
+                doc_ids, tfs=posting_list.arrays()
+                self.term_rows[term]=len(row_docs)
+                row_docs.append(doc_ids)
+                row_tfs.append(tfs)
+
+        n_rows=len(row_docs)
+        rows=np.repeat(np.arange(n_rows), [len(doc_ids) for doc_ids in row_docs])
+        doc_ids=np.concatenate(row_docs) if row_docs else np.zeros(0, dtype=np.int64)
+        tfs=np.concatenate(row_tfs) if row_tfs else np.zeros(0, dtype=np.int64)
+
+        # log terms per distinct tf from math.log10, so weights and statistics are bit-identical to the python expressions
+        unique_tfs, tf_index=np.unique(tfs, return_inverse=True)
+        tf_weights=np.array([1 + math.log10(tf) for tf in unique_tfs.tolist()])[tf_index]
+        tf_cluster_weights=np.array([math.log10(1 + tf) for tf in unique_tfs.tolist()])[tf_index]
+
+        # cluster statistics: sum of log10(1 + tf) per term and cluster, accumulated in document id order,
+        # and the first document of the term in each cluster, which orders tied clusters
+        clusters=self.doc_clusters[doc_ids]
+        clustered=clusters >= 0
+        self.cluster_stats=np.zeros((n_rows, self.n_clusters))
+        np.add.at(self.cluster_stats, (rows[clustered], clusters[clustered]), tf_cluster_weights[clustered])
+        self.cluster_first_doc=np.full((n_rows, self.n_clusters), np.iinfo(np.int64).max)
+        np.minimum.at(self.cluster_first_doc, (rows[clustered], clusters[clustered]), doc_ids[clustered])
+
+        # documents without a vector length are never scored
+        keep=lengths[doc_ids] > 0
+        rows, doc_ids, clusters, tf_weights=rows[keep], doc_ids[keep], clusters[keep], tf_weights[keep]
+        # group n_clusters holds the documents without a cluster
+        groups=np.where(clusters >= 0, clusters, self.n_clusters)
+        order=np.lexsort((doc_ids, groups, rows))
+        self.indices=doc_ids[order].astype(np.int32)
+        self.data=tf_weights[order] / lengths[self.indices]
+
+        # group_ptr[row, g] is the offset of group g of a row, group_ptr[row, n_clusters + 1] the end of the row
+        n_groups=self.n_clusters + 1
+        counts=np.bincount(rows * n_groups + groups, minlength=n_rows * n_groups).reshape(n_rows, n_groups)
+        self.group_ptr=np.zeros((n_rows, n_groups + 1), dtype=np.int64)
+        self.group_ptr[:, 1:]=np.cumsum(counts, axis=1)
+        self.group_ptr+=np.concatenate(([0], np.cumsum(counts.sum(axis=1))[:-1]))[:, None]
+        self.indptr=np.append(self.group_ptr[:, 0], len(self.indices))
+
+        logger.info(f"Built CSR scorer with {len(self.term_rows)} rows, {len(self.data)} nonzeros and {self.n_clusters} clusters")
+
+    @classmethod
+    def from_arrays(cls, term_rows: dict, indices, data, group_ptr, cluster_stats, cluster_first_doc, doc_clusters):
+        """
+        Wraps saved CSR arrays, e.g. memory-mapped ones shared by several processes, without copying them
+
+        Args:
+            term_rows: term --> row of the arrays
+            indices: Document ids of all rows
+            data: Normalized weights aligned with indices
+            group_ptr: (n_rows, n_clusters + 2) offsets of the cluster groups of each row
+            cluster_stats: (n_rows, n_clusters) sum of log10(1 + tf) per term and cluster
+            cluster_first_doc: (n_rows, n_clusters) first document of each term in each cluster
+            doc_clusters: cluster id per document id, -1 for none
+
+        Returns:
+            CSRScorer: Scorer over the given arrays
+        """
+        scorer=cls.__new__(cls)
+        scorer.term_rows=term_rows
+        scorer.n_docs=len(doc_clusters)
+        scorer.n_clusters=cluster_stats.shape[1]
+        scorer.doc_clusters=doc_clusters
+        scorer.cluster_stats=cluster_stats
+        scorer.cluster_first_doc=cluster_first_doc
+        scorer.indices=indices
+        scorer.data=data
+        scorer.group_ptr=group_ptr
+        scorer.indptr=np.append(group_ptr[:, 0], len(indices))
+        return scorer
+
+    def nbytes(self)->int:
+        """
+        Returns:
+            int: Size of the CSR arrays, cluster statistics and term row lookup
+        """
+        arrays=(self.indices, self.data, self.group_ptr, self.indptr, self.cluster_stats, self.cluster_first_doc, self.doc_clusters)
+        return sum(array.nbytes for array in arrays) + sys.getsizeof(self.term_rows)
+
+    def cluster_scores(self, term: str)->dict:
+        """
+        Per-cluster relevance of a term, read from the precomputed statistics
+
+        Args:
+            term: Matched query term
+
+        Returns:
+            dict: cluster id --> sum of log10(1 + tf) over the term's documents in the cluster, in order of the
+                term's first document in each cluster
+        """
+        row=self.term_rows.get(term)
+        if row is None or not self.n_clusters:
+            return {}
+        present=np.flatnonzero(self.cluster_stats[row] > 0)
+        present=present[np.argsort(self.cluster_first_doc[row, present], kind="stable")]
+        return dict(zip(present.tolist(), self.cluster_stats[row, present].tolist()))
+
+    def segments(self, term: str, relevant_clusters=None)->list:
+        """
+        Args:
+            term: Matched query term
+            relevant_clusters: cluster ids to read, or None for the whole row; documents without a cluster are always read
+
+        Returns:
+            list: (document ids, weights) array pairs of the row slices to score
+        """
+        row=self.term_rows.get(term)
+        if row is None:
+            return []
+        return self.row_segments(row, relevant_clusters)
+
+    def row_segments(self, row: int, relevant_clusters=None)->list:
+        """
+        Args:
+            row: Term row
+            relevant_clusters: cluster ids to read, or None for the whole row; documents without a cluster are always read
+
+        Returns:
+            list: (document ids, weights) array pairs of the row slices to score
+        """
+        ptr=self.group_ptr[row]
+        if relevant_clusters is None:
+            return [(self.indices[ptr[0]:ptr[-1]], self.data[ptr[0]:ptr[-1]])]
+        groups=sorted({cluster_id for cluster_id in relevant_clusters if 0 <= cluster_id < self.n_clusters})
+        groups.append(self.n_clusters)
+        return [(self.indices[ptr[g]:ptr[g+1]], self.data[ptr[g]:ptr[g+1]]) for g in groups if ptr[g+1] > ptr[g]]
+
+    def allowed_mask(self, allowed):
+        """
+        Args:
+            allowed: document ids to keep
+
+        Returns:
+            nparray: boolean mask over document ids, True for allowed documents
+        """
+        mask=np.zeros(self.n_docs, dtype=bool)
+        doc_ids=np.fromiter(allowed, dtype=np.int64, count=len(allowed))
+        mask[doc_ids[doc_ids < self.n_docs]]=True
+        return mask
+
+    def score(self, qvec: dict, relevant_clusters=None, allowed=None)->list:
+        """
+        Scores documents against a normalized query vector
+
+        Args:
+            qvec: term --> normalized query weight
+            relevant_clusters: cluster ids to restrict scoring to, or None for all documents
+            allowed: document ids to restrict scoring to, e.g. phrase matches, or None for all documents
+
+        Returns:
+            tuple: ((document id, score) pairs ranked by descending score, then ascending document id,
+                number of postings read)
+        """
+        scores=np.zeros(self.n_docs)
+        matched=np.zeros(self.n_docs, dtype=bool)
+        mask=self.allowed_mask(allowed) if allowed is not None else None
+        scanned=0
+
+        # only the slices of the relevant clusters are read
+        for term, qw in qvec.items():
+            for docs, weights in self.segments(term, relevant_clusters):
+                scanned+=len(docs)
+                if mask is not None:
+                    keep=mask[docs]
+                    docs=docs[keep]
+                    weights=weights[keep]
+                scores[docs]+=qw * weights
+                matched[docs]=True
+
+        doc_ids=np.flatnonzero(matched)
+        doc_scores=scores[doc_ids]
+        order=np.lexsort((doc_ids, -doc_scores))
+        return list(zip(doc_ids[order].tolist(), doc_scores[order].tolist())), scanned
+
+    def score_batch(self, qvecs: list, relevant_clusters: list, k: int, allowed=None, max_cells=1 << 24)->list:
+        """
+        Scores many queries together as a sparse query matrix times the document matrix.
+        Each cluster group of a postings row is read once per chunk of queries, for all queries of the chunk that
+        probe the cluster, and groups of clusters no query probes are never read.
+        Results match score() up to floating point summation order.
+
+        Args:
+            qvecs: normalized query vectors, one per query
+            relevant_clusters: cluster ids to restrict scoring to, one list (or None) per query
+            k: number of results per query
+            allowed: document ids to restrict scoring to (or None), one per query, or None for no restriction
+            max_cells: upper bound on queries x documents of the dense score block held at once
+
+        Returns:
+            list: per query, top k (document id, score) pairs ranked by descending score, then ascending document id
+        """
+        chunk_size=max(1, max_cells // self.n_docs)
+        ranked=[]
+
+        for chunk_start in range(0, len(qvecs), chunk_size):
+            chunk=qvecs[chunk_start:chunk_start+chunk_size]
+            scores=np.zeros((len(chunk), self.n_docs))
+            matched=np.zeros((len(chunk), self.n_docs), dtype=bool)
+
+            # query term matrix in coordinate form, grouped by term
+            term_queries={}
+            for q, qvec in enumerate(chunk):
+                for term, qw in qvec.items():
+                    if term in self.term_rows:
+                        term_queries.setdefault(term, ([], []))
+                        term_queries[term][0].append(q)
+                        term_queries[term][1].append(qw)
+
+            # probes[q, g] tells whether query q reads cluster group g, documents without a cluster are always read
+            probes=np.zeros((len(chunk), self.n_clusters + 1), dtype=bool)
+            probes[:, self.n_clusters]=True
+            for q in range(len(chunk)):
+                clusters=relevant_clusters[chunk_start + q]
+                if clusters is None:
+                    probes[q]=True
+                else:
+                    probes[q, [cluster_id for cluster_id in clusters if 0 <= cluster_id < self.n_clusters]]=True
+
+            for term, (queries, weights) in term_queries.items():
+                ptr=self.group_ptr[self.term_rows[term]]
+                queries=np.asarray(queries)
+                weights=np.asarray(weights)
+                for g in range(self.n_clusters + 1):
+                    readers=probes[queries, g]
+                    if ptr[g+1]==ptr[g] or not readers.any():
+                        continue
+                    docs=self.indices[ptr[g]:ptr[g+1]]
+                    group_queries=queries[readers]
+                    scores[group_queries[:, None], docs[None, :]]+=np.outer(weights[readers], self.data[ptr[g]:ptr[g+1]])
+                    matched[group_queries[:, None], docs[None, :]]=True
+
+            for q in range(len(chunk)):
+                keep=matched[q]
+                if allowed is not None and allowed[chunk_start + q] is not None:
+                    keep&=self.allowed_mask(allowed[chunk_start + q])
+                doc_ids=np.flatnonzero(keep)
+                doc_scores=scores[q, doc_ids]
+                if len(doc_ids) > k:
+                    # a document tied with the k-th score may still rank above it by id, keep all ties
+                    kth=np.partition(-doc_scores, k - 1)[k - 1]
+                    top=-doc_scores <= kth
+                    doc_ids, doc_scores=doc_ids[top], doc_scores[top]
+                order=np.lexsort((doc_ids, -doc_scores))[:k]
+                ranked.append(list(zip(doc_ids[order].tolist(), doc_scores[order].tolist())))
+
+        return ranked
@@ -0,0 +1,407 @@
+import os
+import json
+import time
+import heapq
+import itertools
+import urllib.request
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import jellyfish
+
+from src.vsm_basic import VSM, QUERY_SECONDS, QUERY_BATCH_SECONDS
+from utils.fuzzy_index import FuzzyTermIndex
+from utils.rw_lock import reads_index, writes_index
+from utils.logger import get_logger, log_sampled
+
+logger=get_logger(__name__)
+
+# Per-process state of a local shard worker
+_shard_vsm=None
+_shard_kwargs={}
+
+def _init_shard_worker(corpus_dir: str, shard: tuple, vsm_kwargs: dict)->None:
+    global _shard_vsm, _shard_kwargs
+    _shard_kwargs=dict(vsm_kwargs, shard=shard)
+    _shard_vsm=VSM(corpus_dir, **_shard_kwargs)
+
+def _shard_build(n_workers)->dict:
+    _shard_vsm.build_index(n_workers=n_workers)
+    return _shard_vsm.term_statistics()
+
+def _shard_update(recluster: bool)->dict:
+    summary=_shard_vsm.update_index(recluster=recluster)
+    return {"summary": summary, "statistics": _shard_vsm.term_statistics()}
+
+def _shard_load(index_dir: str)->dict:
+    global _shard_vsm
+    _shard_vsm=VSM.load(index_dir, **{key: value for key, value in _shard_kwargs.items() if key!="shard"})
+    return _shard_vsm.term_statistics()
+
+def _shard_save(index_dir: str)->None:
+    _shard_vsm.save(index_dir)
+
+def _shard_search(qvec: dict, phrases: list, k: int, scoring, n_probe)->list:
+    return _shard_vsm.search_shard(qvec, phrases, k, scoring, n_probe)
+
+def _shard_snippets(names: list, terms: set)->list:
+    return _shard_vsm.snippets(names, terms)
+
+def _shard_statistics()->dict:
+    return _shard_vsm.term_statistics()
+
+def _shard_memory_usage()->dict:
+    return _shard_vsm.memory_usage()
+
+
+class LocalShard:
+    """
+    Shard built and served by its own worker process
+    """
+    def __init__(self, corpus_dir: str, shard_id: int, n_shards: int, vsm_kwargs: dict)->None:
+        """
+        Args:
+            corpus_dir: Directory containing the documents of all shards
+            shard_id: Index of this shard
+            n_shards: Number of shards of the corpus
+            vsm_kwargs: Settings passed to the shard's VSM
+        """
+        self.shard_id=shard_id
+        self.executor=ProcessPoolExecutor(max_workers=1, initializer=_init_shard_worker, initargs=(corpus_dir, (shard_id, n_shards), vsm_kwargs))
+
+    def build(self, n_workers):
+        return self.executor.submit(_shard_build, n_workers)
+
+    def update(self, recluster: bool):
+        return self.executor.submit(_shard_update, recluster)
+
+    def load(self, index_dir: str):
+        return self.executor.submit(_shard_load, index_dir)
+
+    def save(self, index_dir: str):
+        return self.executor.submit(_shard_save, index_dir)
+
+    def search(self, qvec: dict, phrases: list, k: int, scoring, n_probe=None):
+        return self.executor.submit(_shard_search, qvec, phrases, k, scoring, n_probe)
+
+    def snippets(self, names: list, terms: set):
+        return self.executor.submit(_shard_snippets, names, terms)
+
+    def statistics(self):
+        return self.executor.submit(_shard_statistics)
+
+    def memory_usage(self):
+        return self.executor.submit(_shard_memory_usage)
+
+    def close(self)->None:
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+
+class HTTPShard:
+    """
+    Shard served by a separate API process started with VSM_SHARD set, reached through its /shard endpoints
+    """
+    def __init__(self, url: str, executor: ThreadPoolExecutor, timeout=30)->None:
+        """
+        Args:
+            url: Base URL of the shard service
+            executor: Thread pool issuing the requests
+            timeout: Request timeout in seconds
+        """
+        self.url=url.rstrip("/")
+        self.executor=executor
+        self.timeout=timeout
+
+    def _request(self, path: str, payload=None):
+        data=json.dumps(payload).encode("utf-8") if payload is not None else None
+        request=urllib.request.Request(self.url + path, data=data, headers={"Content-Type": "application/json"})
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            result=json.load(response)
+        if isinstance(result, dict) and "error" in result:
+            raise RuntimeError(f"Shard {self.url}: {result['error']}")
+        return result
+
+    def _search(self, qvec: dict, phrases: list, k: int, scoring, n_probe)->list:
+        payload={"qvec": qvec, "phrases": [[list(terms), slop] for terms, slop in phrases], "k": k, "scoring": scoring, "n_probe": n_probe}
+        return [tuple(result) for result in self._request("/shard/search", payload)["results"]]
+
+    def search(self, qvec: dict, phrases: list, k: int, scoring, n_probe=None):
+        return self.executor.submit(self._search, qvec, phrases, k, scoring, n_probe)
+
+    def _snippets(self, names: list, terms: set)->list:
+        return self._request("/shard/snippets", {"names": names, "terms": sorted(terms)})["snippets"]
+
+    def snippets(self, names: list, terms: set):
+        return self.executor.submit(self._snippets, names, terms)
+
+    def statistics(self):
+        return self.executor.submit(self._request, "/shard/statistics")
+
+    def close(self)->None:
+        pass
+
+
+class ShardedVSM(VSM):
+    """
+    Vector space model over a corpus partitioned by document into shards, each with its own postings, document
+    lengths and clusters, built and searched in parallel.
+    The coordinator keeps only the global vocabulary with aggregated document frequencies: query terms are
+    matched and fuzzy corrected against it and weighted with global idf, so every document gets the score a single
+    index would give it. Shards return their top k for the weighted query vector and the coordinator merges them.
+    """
+    def __init__(self, corpus_dir="", n_shards=2, shard_urls=None, n_workers=1, **kwargs)->None:
+        """
+        Args:
+            corpus_dir: Directory containing files to be processed, unused for HTTP shards
+            n_shards: Number of local shard processes, ignored when shard_urls is given
+            shard_urls: Base URLs of shard services, instead of local shard processes
+            n_workers: Number of ingestion processes per shard
+            kwargs: Further VSM settings, applied to every local shard
+        """
+        coordinator_kwargs={key: value for key, value in kwargs.items() if key not in ("cache_dir", "cache_max_bytes")}
+        super().__init__(corpus_dir, n_workers=n_workers, **coordinator_kwargs)
+
+        if shard_urls:
+            self.executor=ThreadPoolExecutor(max_workers=len(shard_urls), thread_name_prefix="vsm-shard")
+            self.shards=[HTTPShard(url, self.executor) for url in shard_urls]
+        else:
+            self.executor=None
+            self.shards=[LocalShard(corpus_dir, i, n_shards, dict(kwargs)) for i in range(n_shards)]
+        self.n_shards=len(self.shards)
+        logger.info(f"Initialized sharded VSM with {self.n_shards} {'HTTP' if shard_urls else 'local'} shards")
+
+    def _local_shards(self)->list:
+        if any(not isinstance(shard, LocalShard) for shard in self.shards):
+            raise ValueError("HTTP shards are built, updated and saved by their own services")
+        return self.shards
+
+    @writes_index
+    def merge_statistics(self, statistics: list)->None:
+        """
+        Rebuilds the global vocabulary from per-shard statistics
+
+        Args:
+            statistics: term_statistics() of every shard
+        """
+        document_frequencies=Counter()
+        for shard_statistics in statistics:
+            document_frequencies.update(shard_statistics["terms"])
+
+        self.N=sum(shard_statistics["N"] for shard_statistics in statistics)
+        # postings stay on the shards, the coordinator only needs document frequencies
+        self.dictionary={term: (df, []) for term, df in document_frequencies.items()}
+        self.soundex_dict=defaultdict(list)
+        for term in self.dictionary:
+            self.soundex_dict[jellyfish.soundex(term)].append(term)
+        self.fuzzy_index=FuzzyTermIndex(self.dictionary.keys())
+        with self.fuzzy_lock:
+            self.fuzzy_cache.clear()
+        self.generation+=1
+        logger.info(f"Merged statistics of {len(statistics)} shards: {self.N} documents, {len(self.dictionary)} terms")
+
+    def refresh(self)->None:
+        """
+        Pulls document frequencies from every shard, e.g. after HTTP shards were rebuilt
+        """
+        self.merge_statistics([future.result() for future in [shard.statistics() for shard in self.shards]])
+
+    def build_index(self, n_workers=None, progress=None)->None:
+        """
+        Builds all local shards in parallel, each in its own process
+
+        Args:
+            n_workers: Ingestion processes per shard
+            progress: Optional callback progress(phase, done, total), called as shards complete
+        """
+        shards=self._local_shards()
+        report=progress or (lambda phase, done, total: None)
+        report("building shards", 0, self.n_shards)
+
+        futures=[shard.build(n_workers or self.n_workers) for shard in shards]
+        statistics=[]
+        for future in futures:
+            statistics.append(future.result())
+            report("building shards", len(statistics), self.n_shards)
+        self.merge_statistics(statistics)
+
+    def update_index(self, recluster=False)->dict:
+        """
+        Incrementally updates every local shard with the files of the corpus that belong to it
+
+        Returns:
+            dict: names of added, modified and deleted files, and whether any shard redid its clustering
+        """
+        results=[future.result() for future in [shard.update(recluster) for shard in self._local_shards()]]
+        self.merge_statistics([result["statistics"] for result in results])
+        return {
+            "added": [filename for result in results for filename in result["summary"]["added"]],
+            "modified": [filename for result in results for filename in result["summary"]["modified"]],
+            "deleted": [filename for result in results for filename in result["summary"]["deleted"]],
+            "reclustered": any(result["summary"]["reclustered"] for result in results),
+        }
+
+    def save(self, index_dir: str)->None:
+        """
+        Saves every local shard into its own subdirectory of index_dir
+
+        Args:
+            index_dir: Directory to write the shard indexes into
+        """
+        shards=self._local_shards()
+        os.makedirs(index_dir, exist_ok=True)
+        for future in [shard.save(os.path.join(index_dir, f"shard_{shard.shard_id}")) for shard in shards]:
+            future.result()
+        with open(os.path.join(index_dir, "shards.json"), "w", encoding="utf-8") as f:
+            json.dump({"n_shards": self.n_shards, "corpus_dir": self.corpus_dir}, f)
+        logger.info(f"Saved {self.n_shards} shards to {index_dir}")
+
+    @classmethod
+    def load(cls, index_dir: str, **kwargs):
+        """
+        Loads shards saved by ShardedVSM.save, each into its own process
+
+        Args:
+            index_dir: Directory written by ShardedVSM.save
+            kwargs: Runtime settings passed to the shards
+
+        Returns:
+            ShardedVSM: Instance ready for querying
+        """
+        with open(os.path.join(index_dir, "shards.json"), encoding="utf-8") as f:
+            meta=json.load(f)
+        vsm=cls(meta["corpus_dir"], n_shards=meta["n_shards"], **kwargs)
+        futures=[shard.load(os.path.join(index_dir, f"shard_{shard.shard_id}")) for shard in vsm.shards]
+        vsm.merge_statistics([future.result() for future in futures])
+        return vsm
+
+    def similar(self, doc_id: int, k=10, method="exact", n_probe=None):
+        raise ValueError("Similar document search is not supported on sharded indexes, the document vectors live on the shards")
+
+    @reads_index
+    def snippets(self, names: list, terms: set)->list:
+        """
+        Snippets of documents from whichever shard holds each of them, see VSM.snippets
+
+        Returns:
+            list: snippet of each document, None for a document no shard has text for
+        """
+        merged=[None] * len(names)
+        for future in [shard.snippets(names, terms) for shard in self.shards]:
+            for i, snippet in enumerate(future.result()):
+                if snippet is not None:
+                    merged[i]=snippet
+        return merged
+
+    @reads_index
+    def memory_usage(self)->dict:
+        """
+        Estimated memory of the coordinator's vocabulary plus that of the local shard processes; HTTP shards
+        account for their own memory
+
+        Returns:
+            dict: component --> bytes as VSM.memory_usage, with the shards' totals under "shards"
+        """
+        usage=super().memory_usage()
+        local_shards=[shard for shard in self.shards if isinstance(shard, LocalShard)]
+        usage["shards"]=sum(future.result()["total"] for future in [shard.memory_usage() for shard in local_shards])
+        usage["total"]+=usage["shards"]
+        return usage
+
+    def close(self)->None:
+        """
+        Stops the shard processes
+        """
+        for shard in self.shards:
+            shard.close()
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+
+    def resolve_phrases(self, phrases: list):
+        """
+        Args:
+            phrases: Output of parse_phrases
+
+        Returns:
+            list: phrases with their terms matched against the global vocabulary, or None if a phrase cannot match
+        """
+        resolved=[]
+        for terms, slop in phrases:
+            matches=[self.match_query_term(term) for term in terms]
+            if any(match is None for match in matches):
+                return None
+            resolved.append((tuple(matched_term for matched_term, df in matches), slop))
+        return resolved
+
+    def scatter(self, qvec: dict, phrases: list, k: int, scoring, n_probe=None)->list:
+        """
+        Sends a weighted query to every shard and merges their top k
+
+        Returns:
+            list: top k (document id, file name, score) triples ranked by descending score, then ascending document id
+        """
+        if not qvec:
+            return []
+        futures=[shard.search(qvec, phrases, k, scoring, n_probe) for shard in self.shards]
+        shard_results=[future.result() for future in futures]
+        merged=heapq.merge(*shard_results, key=lambda result: (-result[2], result[0]))
+        return list(itertools.islice(merged, k))
+
+    @reads_index
+    def query(self, qtext, scoring=None, k=10, n_probe=None):
+        """
+        Query processing across all shards, with fuzzy matching and phrase support
+
+        Args:
+            qtext: Query text, may contain "exact phrases" and "proximity terms"~N
+            scoring: Scoring backend used by the shards, defaults to the backend chosen at initialisation
+            k: Number of results to return
+            n_probe: Number of clusters each shard scores, defaults to the n_probe chosen at initialisation
+
+        Returns:
+            tuple: (list of (filename, score) pairs, elapsed_time)
+        """
+        start_time=time.perf_counter()
+        scoring=scoring or self.scoring
+        qtf=Counter(self.preprocess(qtext))
+        phrases=self.parse_phrases(qtext)
+
+        cache_key=(tuple(sorted(qtf.items())), tuple(phrases), k, n_probe or self.n_probe, scoring)
+        generation=self.generation
+        cached=self.query_cache.get(generation, cache_key)
+        if cached is not None:
+            elapsed=time.perf_counter() - start_time
+            QUERY_SECONDS.observe(elapsed, scoring, "hit")
+            if log_sampled():
+                logger.info(f"Served query from cache in {elapsed:.6f} seconds")
+            return list(cached), elapsed
+
+        qvec=self.build_query_vector(qtf)
+        resolved=self.resolve_phrases(phrases)
+        ranked=self.scatter(qvec, resolved, k, scoring, n_probe or self.n_probe) if resolved is not None else []
+
+        results=[(filename, score) for docID, filename, score in ranked]
+        self.query_cache.put(generation, cache_key, results)
+
+        elapsed=time.perf_counter() - start_time
+        QUERY_SECONDS.observe(elapsed, scoring, "miss")
+        if log_sampled():
+            logger.info(f"Processed sharded query in {elapsed:.6f} seconds across {self.n_shards} shards")
+        return list(results), elapsed
+
+    @reads_index
+    def query_batch(self, qtexts: list, k=10, n_probe=None)->tuple:
+        """
+        Runs the queries one after another, each scattered to all shards
+
+        Returns:
+            tuple: (list of per-query lists of (filename, score) pairs, list of per-query elapsed times, total elapsed time)
+        """
+        start_time=time.perf_counter()
+        results=[]
+        query_times=[]
+        for qtext in qtexts:
+            query_results, elapsed=self.query(qtext, k=k, n_probe=n_probe)
+            results.append(query_results)
+            query_times.append(elapsed)
+        elapsed=time.perf_counter() - start_time
+        QUERY_BATCH_SECONDS.observe(elapsed)
+        return results, query_times, elapsed
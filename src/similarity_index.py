@@ -0,0 +1,219 @@
+import sys
+import numpy as np
+from utils.logger import get_logger
+
+logger=get_logger(__name__)
+
+# Nonzeros x signature bits projected at once while computing LSH signatures, bounds the temporary projection block
+PROJECTION_CELLS=1 << 24
+
+class SimilarityIndex:
+    """
+    "More like this" search over the normalized lnc document vectors of a CSRScorer, for VSM.similar.
+    The scorer's term rows are transposed into document rows, so the cosine similarity of a document with any set of
+    candidates reads only the terms of those documents. Candidates come from random-hyperplane LSH: each of n_tables
+    tables keys a document by the signs of its vector's projections on n_bits random hyperplanes, so documents at a
+    small angle share a key with high probability. Lookups also probe the keys one bit flip away, and every candidate
+    is re-scored exactly, so LSH only decides which documents are considered, never their scores. The hash tables
+    are built on the first LSH lookup, exact and cluster-probing searches only need the document rows.
+    """
+    def __init__(self, scorer, n_tables=8, n_bits=12, seed=42)->None:
+        """
+        Args:
+            scorer: CSRScorer holding the normalized document weights
+            n_tables: Number of hash tables, more raise recall and lookup cost
+            n_bits: Hyperplanes per table, at most 64; more make buckets smaller and more selective
+            seed: Random seed of the hyperplanes
+        """
+        if not 0 < n_bits <= 64:
+            raise ValueError(f"n_bits must be between 1 and 64, got {n_bits}")
+        self.scorer=scorer
+        self.n_tables=n_tables
+        self.n_bits=n_bits
+        self.n_rows=len(scorer.indptr) - 1
+        self.n_docs=scorer.n_docs
+        self.row_terms=list(scorer.term_rows) # term row --> term, rows are numbered in insertion order
+
+        # document rows: the transpose of the scorer's term rows, terms ascending within a document
+        rows=np.repeat(np.arange(self.n_rows, dtype=np.int32), np.diff(scorer.indptr))
+        order=np.argsort(scorer.indices, kind="stable")
+        self.doc_rows=rows[order]
+        self.doc_weights=scorer.data[order]
+        self.doc_ptr=np.zeros(self.n_docs + 1, dtype=np.int64)
+        np.cumsum(np.bincount(scorer.indices, minlength=self.n_docs), out=self.doc_ptr[1:])
+        self.doc_ids=np.flatnonzero(np.diff(self.doc_ptr) > 0)
+
+        self.seed=seed
+        self.keys=None # (n_docs, n_tables) LSH keys, built on first use
+        self.sorted_keys=None
+        self.sorted_docs=None
+        self.flips=np.concatenate(([0], np.left_shift(np.uint64(1), np.arange(n_bits, dtype=np.uint64)))).astype(np.uint64)
+
+    def build_tables(self)->None:
+        """
+        Computes the LSH keys of all documents and sorts them per table
+        """
+        keys=self._signatures(np.random.default_rng(self.seed))
+        # per table, the keys of all documents sorted, with the documents in the same order, for binary search lookups
+        order=np.argsort(keys[self.doc_ids], axis=0, kind="stable")
+        self.sorted_docs=self.doc_ids[order].T.copy()
+        self.sorted_keys=np.take_along_axis(keys[self.doc_ids], order, axis=0).T.copy()
+        self.keys=keys
+        logger.info(f"Built LSH tables over {len(self.doc_ids)} documents: {self.n_tables} tables of {self.n_bits} bits")
+
+    def _signatures(self, rng)->np.ndarray:
+        """
+        Projects every document vector on n_tables x n_bits random Gaussian hyperplanes. The hyperplanes are drawn a
+        block of term rows at a time and dropped after use, so their memory is bounded by PROJECTION_CELLS.
+
+        Returns:
+            nparray: (n_docs, n_tables) uint64 keys, bit b of a table's key set when the projection on its b-th
+                hyperplane is positive
+        """
+        n_planes=self.n_tables * self.n_bits
+        projections=np.zeros((self.n_docs, n_planes), dtype=np.float32)
+        indptr=self.scorer.indptr
+        max_nonzeros=max(1, PROJECTION_CELLS // n_planes)
+
+        row_start=0
+        while row_start < self.n_rows:
+            # as many term rows as fit the projection block, at least one
+            row_end=max(row_start + 1, int(np.searchsorted(indptr, indptr[row_start] + max_nonzeros, side="right")) - 1)
+            row_end=min(row_end, self.n_rows)
+            planes=rng.standard_normal((row_end - row_start, n_planes), dtype=np.float32)
+            start, end=indptr[row_start], indptr[row_end]
+            rows=np.repeat(np.arange(row_end - row_start), np.diff(indptr[row_start:row_end+1]))
+            docs=self.scorer.indices[start:end]
+            contributions=planes[rows] * self.scorer.data[start:end, None].astype(np.float32)
+            # summed per document with one sort and reduceat instead of an unbuffered scatter
+            order=np.argsort(docs, kind="stable")
+            docs=docs[order]
+            if len(docs):
+                boundaries=np.flatnonzero(np.diff(docs)) + 1
+                first=np.concatenate(([0], boundaries))
+                projections[docs[first]]+=np.add.reduceat(contributions[order], first, axis=0)
+            row_start=row_end
+
+        bits=(projections > 0).reshape(self.n_docs, self.n_tables, self.n_bits).astype(np.uint64)
+        return (bits << np.arange(self.n_bits, dtype=np.uint64)).sum(axis=2, dtype=np.uint64)
+
+    def vector(self, doc_id: int)->tuple:
+        """
+        Returns:
+            tuple: (term row ids, normalized weights) of the document, empty for an unknown document
+        """
+        if not 0 <= doc_id < self.n_docs:
+            return np.zeros(0, dtype=np.int32), np.zeros(0)
+        start, end=self.doc_ptr[doc_id], self.doc_ptr[doc_id+1]
+        return self.doc_rows[start:end], self.doc_weights[start:end]
+
+    def candidates(self, doc_id: int, multiprobe=True)->np.ndarray:
+        """
+        Documents sharing an LSH bucket with a document in any table, the document itself excluded
+
+        Args:
+            doc_id: Document to find neighbours of
+            multiprobe: Also probe the buckets whose key differs in one bit
+
+        Returns:
+            nparray: Candidate document ids, ascending
+        """
+        if self.keys is None:
+            self.build_tables()
+        flips=self.flips if multiprobe else self.flips[:1]
+        found=[]
+        for table in range(self.n_tables):
+            probes=self.keys[doc_id, table] ^ flips
+            lo=np.searchsorted(self.sorted_keys[table], probes, side="left")
+            hi=np.searchsorted(self.sorted_keys[table], probes, side="right")
+            found.extend(self.sorted_docs[table, a:b] for a, b in zip(lo.tolist(), hi.tolist()) if b > a)
+        if not found:
+            return np.zeros(0, dtype=np.int64)
+        candidates=np.unique(np.concatenate(found))
+        return candidates[candidates!=doc_id]
+
+    def cosine(self, doc_id: int, candidates: np.ndarray)->np.ndarray:
+        """
+        Exact cosine similarity of a document with candidate documents, reading only the candidates' own terms
+
+        Args:
+            doc_id: Document compared against
+            candidates: Document ids with a vector
+
+        Returns:
+            nparray: Similarity per candidate
+        """
+        if not len(candidates):
+            return np.zeros(0)
+        query=np.zeros(self.n_rows)
+        rows, weights=self.vector(doc_id)
+        query[rows]=weights
+
+        starts, ends=self.doc_ptr[candidates], self.doc_ptr[candidates+1]
+        positions=self._gather(starts, ends)
+        offsets=np.concatenate(([0], np.cumsum(ends - starts)[:-1]))
+        return np.add.reduceat(self.doc_weights[positions] * query[self.doc_rows[positions]], offsets)
+
+    @staticmethod
+    def _gather(starts: np.ndarray, ends: np.ndarray)->np.ndarray:
+        """
+        Returns:
+            nparray: Positions of all [start, end) ranges, concatenated in order
+        """
+        lengths=ends - starts
+        offsets=np.concatenate(([0], np.cumsum(lengths)[:-1]))
+        return np.repeat(starts - offsets, lengths) + np.arange(int(lengths.sum()))
+
+    def exact_scores(self, doc_id: int, relevant_clusters=None)->tuple:
+        """
+        Cosine similarity of a document with every document sharing a term, by scanning the postings of its terms.
+        The row slices of all its terms are gathered and summed in one pass, in the order a per-term loop would add them.
+
+        Args:
+            doc_id: Document compared against
+            relevant_clusters: cluster ids to read, or None for all documents; documents without a cluster are always read
+
+        Returns:
+            tuple: (document ids, similarities) of the matched documents, the document itself excluded
+        """
+        rows, weights=self.vector(doc_id)
+        ptr=self.scorer.group_ptr[rows]
+        if relevant_clusters is None:
+            starts, ends=ptr[:, 0], ptr[:, -1]
+        else:
+            n_clusters=self.scorer.n_clusters
+            groups=np.array(sorted({cluster_id for cluster_id in relevant_clusters if 0 <= cluster_id < n_clusters}) + [n_clusters])
+            starts, ends=ptr[:, groups].ravel(), ptr[:, groups + 1].ravel()
+            weights=np.repeat(weights, len(groups))
+        positions=self._gather(starts, ends)
+        docs=self.scorer.indices[positions]
+        scores=np.bincount(docs, weights=self.scorer.data[positions] * np.repeat(weights, ends - starts), minlength=self.n_docs)
+        matched=np.bincount(docs, minlength=self.n_docs) > 0
+        matched[doc_id]=False
+        doc_ids=np.flatnonzero(matched)
+        return doc_ids, scores[doc_ids]
+
+    @staticmethod
+    def top_k(doc_ids: np.ndarray, scores: np.ndarray, k: int)->list:
+        """
+        Returns:
+            list: top k (document id, similarity) pairs with a positive similarity, by descending similarity then
+                ascending document id
+        """
+        positive=scores > 0
+        doc_ids, scores=doc_ids[positive], scores[positive]
+        if len(doc_ids) > k:
+            # a document tied with the k-th score may still rank above it by id, keep all ties
+            kth=np.partition(-scores, k - 1)[k - 1]
+            top=-scores <= kth
+            doc_ids, scores=doc_ids[top], scores[top]
+        order=np.lexsort((doc_ids, -scores))[:k]
+        return list(zip(doc_ids[order].tolist(), scores[order].tolist()))
+
+    def nbytes(self)->int:
+        """
+        Returns:
+            int: Size of the document rows and, once built, the hash tables
+        """
+        arrays=(self.doc_rows, self.doc_weights, self.doc_ptr, self.doc_ids, self.keys, self.sorted_docs, self.sorted_keys)
+        return sum(array.nbytes for array in arrays if array is not None) + sys.getsizeof(self.row_terms)
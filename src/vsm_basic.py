@@ -1,33 +1,124 @@
 import os
 import re
+import sys
+import zlib
 import math
-from collections import defaultdict, Counter
-import nltk
-from nltk.corpus import stopwords
-from nltk.stem import PorterStemmer
+import heapq
+import threading
+from functools import lru_cache
+from itertools import chain
+from collections import defaultdict, Counter, OrderedDict, namedtuple, deque
+from nltk.stem.porter import PorterStemmer
 import string
-from utils.document_processor import TextExtractionEngine
-from utils.logger import get_logger
+from utils.document_processor import TextExtractionEngine, file_fingerprint, content_hash
+from utils.document_sources import IngestDocument
+from utils.index_store import save_index, load_index, read_csr
+from utils.extraction_cache import ExtractionCache
+from utils.document_store import DocumentStore
+from src.csr_scorer import CSRScorer
+from src.similarity_index import SimilarityIndex
+from utils.fuzzy_index import FuzzyTermIndex
+from utils.query_cache import QueryCache
+from utils.rw_lock import ReadWriteLock, reads_index
+from utils.postings import PostingsList
+from utils.positions import encode_positions, decode_positions, intersect_postings, contains_phrase, within_window
+from utils.logger import get_logger, log_sampled
+from utils.stopwords import ENGLISH_STOP_WORDS
+from utils import metrics
 import jellyfish
 import time
 import numpy as np
-import numpy as np
+from concurrent.futures import ProcessPoolExecutor
 
 logger=get_logger(__name__)
-nltk.download("stopwords")
+
+# Estimated bytes of a dictionary entry besides its postings: the (df, postings) tuple and the PostingsList object
+DICTIONARY_ENTRY_BYTES=sys.getsizeof((0, None)) + 160
+# Bytes of a bytes object besides its data, for the encoded positions of one posting
+BYTES_OBJECT_OVERHEAD=sys.getsizeof(b"")
+
+# Number of files extracted per chunk, the unit of build progress reporting
+SERIAL_CHUNK_SIZE=64
+# Chunks of ingested documents in flight per ingestion worker, further documents are not read from the stream until one completes
+INGEST_PENDING_PER_WORKER=2
+# Ingested documents buffered before being merged into the postings, merging copies the postings lists of every touched term
+INGEST_MERGE_DOCUMENTS=4096
+
+class BuildCancelled(Exception):
+    """
+    Raised by a build_index progress callback to abort the build
+    """
+
+# Compressed sparse row matrix used for clustering
+SparseRows=namedtuple("SparseRows", ["indptr", "indices", "data", "shape"])
+
+# Identifies the preprocessing pipeline in cached token streams, bump when preprocess output changes
+PREPROCESS_VERSION="porter-1"
+
+# Hyphens and underscores separate words, all other punctuation is deleted, in a single translate pass
+PUNCTUATION_TABLE=str.maketrans({ch: " " if ch in "-_" else None for ch in string.punctuation})
+
+# Characters of text preprocessed at once by iter_tokens
+PREPROCESS_CHUNK_SIZE=1 << 20
+
+# Quoted phrase in a query, optionally followed by ~N for a proximity match within N words
+PHRASE_PATTERN=re.compile(r'"([^"]*)"(?:~(\d+))?')
+
+# Words of a search result snippet
+SNIPPET_WORDS=30
+# Bytes of a document's text searched for its snippet, so snippets of long documents cost no more than short ones
+SNIPPET_SCAN_BYTES=1 << 15
+
+QUERY_SECONDS=metrics.histogram("vsm_query_seconds", "Query latency by scoring backend and result cache outcome", ("scoring", "cache"))
+QUERY_BATCH_SECONDS=metrics.histogram("vsm_query_batch_seconds", "Latency of query_batch calls")
+QUERY_PHASE_SECONDS=metrics.histogram("vsm_query_phase_seconds", "Query time per phase, sort is part of scoring", ("phase",))
+POSTINGS_SCANNED=metrics.counter("vsm_postings_scanned_total", "Postings read while scoring queries", ("scoring",))
+FUZZY_FALLBACKS=metrics.counter("vsm_fuzzy_fallbacks_total", "Unknown query terms by how they were resolved", ("method",))
+FUZZY_SECONDS=metrics.histogram("vsm_fuzzy_match_seconds", "Time to correct one unknown query term")
+BUILD_PHASE_SECONDS=metrics.histogram("vsm_build_phase_seconds", "Index build and update time per phase", ("phase",), metrics.BUILD_BUCKETS)
+DOCUMENTS_INDEXED=metrics.counter("vsm_documents_indexed_total", "Documents indexed by builds and updates")
+SIMILAR_SECONDS=metrics.histogram("vsm_similar_seconds", "Latency of similar document searches by method", ("method",))
+
+def _observe_phase(histogram, phase: str, phase_start: float)->float:
+    """
+    Records the time since phase_start for phase
+
+    Returns:
+        float: current time, the start of the next phase
+    """
+    now=time.perf_counter()
+    histogram.observe(now - phase_start, phase)
+    return now
 
 class VSM:
     """
     Implementation of vector space model for documents, on a directory basis
     """
-    def __init__(self, corpus_dir: str, n_clusters=5, ngram_range=(1,2))->None:
+    def __init__(self, corpus_dir: str, n_clusters=5, ngram_range=(1,2), n_workers=1, recluster_threshold=0.2, cache_dir=None, cache_max_bytes=1 << 30, scoring="python", fuzzy_cache_size=10000, cluster_batch_size=None, stem_cache_size=1 << 17, query_cache_size=1024, query_cache_bytes=64 << 20, query_cache_ttl=None, shard=None, postings_encoding="raw", n_probe=3, lsh_tables=8, lsh_bits=12, doc_cache_bytes=8 << 20)->None:
         """
         Initialises VSM class
 
         Args:
             corpus_dir: Directory containing files to be processed
             n_clusters: Number of clusters for K means
-            ngram_range: Range for extraction (min, max)
+            ngram_range: Kept for compatibility, phrases of any length are answered from the positional index
+            n_workers: Number of processes used for extraction and preprocessing during build_index (1 = serial)
+            recluster_threshold: Fraction of documents added, modified or deleted by update_index after which clustering is redone
+            cache_dir: Directory of a persistent extraction cache, so unchanged files are not parsed or OCRed again
+            cache_max_bytes: Size bound of the extraction cache
+            scoring: Default scoring backend of query, "python" (postings loop), "numpy" (CSR arrays) or "maxscore" (pruned top-k)
+            fuzzy_cache_size: Maximum number of cached fuzzy corrections
+            cluster_batch_size: Rows per mini-batch k-means iteration, None for full-batch k-means
+            stem_cache_size: Maximum number of distinct surface forms whose stems are cached
+            query_cache_size: Maximum number of cached query results, 0 disables the result cache
+            query_cache_bytes: Size bound of the query result cache
+            query_cache_ttl: Seconds after which cached query results expire, None for no expiry
+            shard: Optional (shard id, number of shards), restricting the index to the files of one shard of the corpus
+            postings_encoding: Encoding of in-memory postings lists, "raw" (uint32 gaps) or "varbyte" (smaller, slower to decode)
+            n_probe: Number of clusters a query is scored against, n_clusters for exhaustive scoring; fewer is faster at some loss of recall
+            lsh_tables: Hash tables of the LSH index used by similar, more raise recall and lookup cost
+            lsh_bits: Random hyperplanes per LSH table, at most 64; more make buckets smaller
+            doc_cache_bytes: Size bound of the decompressed document text blocks cached for snippets
         
         Returns:
             None
@@ -35,111 +126,186 @@ class VSM:
         self.corpus_dir = corpus_dir
         self.n_clusters=n_clusters
         self.ngram_range=ngram_range
+        self.n_workers=n_workers
+        self.recluster_threshold=recluster_threshold
+        self.cache_dir=cache_dir
+        self.cache_max_bytes=cache_max_bytes
+        self.extraction_cache=ExtractionCache(cache_dir, cache_max_bytes) if cache_dir else None
+        self.scoring=scoring
+        self.csr_scorer=None # built at index time for numpy scoring, or on first use
+        self.similarity_index=None # LSH index over the CSR document weights for similar, built on first use
+        self.lsh_tables=lsh_tables
+        self.lsh_bits=lsh_bits
+        self.term_upper_bounds={} # term --> maximum normalized lnc document weight, for MaxScore pruning
+        self.fuzzy_index=None # candidate index for fuzzy_matcher, built at index time or on first use
+        self.fuzzy_cache=OrderedDict() # (term, threshold) --> corrected term
+        self.fuzzy_cache_size=fuzzy_cache_size
+        self.fuzzy_lock=threading.Lock() # guards fuzzy_cache, shared by the threads serving queries
+        self.cluster_batch_size=cluster_batch_size
+        self.query_cache=QueryCache(query_cache_size, query_cache_bytes, query_cache_ttl)
+        self.generation=0 # bumped whenever the index changes, invalidating cached query results
+        self.index_lock=ReadWriteLock() # queries read under it, updates and ingestions apply each batch of changes under its write lock
+        self.update_lock=threading.Lock() # held through a whole update or ingestion, they compare against the index and assign document ids
+        self.shard=tuple(shard) if shard else None
+        self.postings_encoding=postings_encoding
+        self.n_probe=n_probe
 
         self.doc_index={} # document id --> file name mapping
-        self.dictionary={} # term --> (document frequency, postings list(document id, term frequency))
+        self.dictionary={} # term --> (document frequency, PostingsList of (document id, term frequency))
         self.doc_lengths={} # document id --> vector length
         self.soundex_dict=defaultdict(list)
         self.N=0 # number of documents
 
         self.doc_clusters={}
         self.cluster_centers={}
-        self.doc_texts={}
-        self.phrase_dict=[]
+        self.doc_store=DocumentStore(cache_bytes=doc_cache_bytes) # document id --> raw text, compressed on disk
+        self.positions={} # term --> encoded token positions per posting, aligned with the postings list
+        self.cluster_vocab={} # term --> feature column of cluster_centers
+        self.cluster_idf=np.zeros(0) # idf per feature column at clustering time
+
+        # incremental maintenance state
+        self.file_stats={} # file name --> fingerprint (mtime, size, hash) and document id
+        self.ingested_docs={} # external document id --> size, hash and document id of documents added by ingest_documents
+        self.doc_terms={} # document id --> terms of the document, used to remove its postings
+        self.next_doc_id=1
+        self.changes_since_clustering=0
 
         #preprocessing tools
-        self.stop_words=set(stopwords.words("english"))
+        self.stop_words=set(ENGLISH_STOP_WORDS)
         self.stemmer=PorterStemmer()
+        self.stem_cache_size=stem_cache_size
+        self.normalize_token=lru_cache(maxsize=stem_cache_size)(self._normalize_token)
         logger.info(f"Initialized VSM for corpus directory: {corpus_dir}")
     
-    def is_meaningful_phrase(self, phrase_tokens: list) -> bool:
-            """
-            removes meaningless phrases
-            """
-            if len(phrase_tokens) < 2:
-                return False
-                
-            common_words = {'the', 'and', 'or', 'but', 'in', 'on', 'at', 'to', 'for', 'of', 'with', 'by'}
-            meaningful_count = sum(1 for token in phrase_tokens if token not in common_words)
-            
-            return meaningful_count >= 1
-
-    def extract_phrases(self, tokens: list)->list:
+    def _normalize_token(self, token: str):
         """
-        Extract n-gram tokens aka phrases from tokens
-
         Args:
-            tokens: list of processed tokens
-        
+            token: Lowercased surface form without punctuation
+
         Returns:
-            list: meaningful phrases
+            str: Porter stem of the token, or None for stop words and numbers
         """
-        phrases=[]
-        min_n, max_n, = self.ngram_range
+        if token in self.stop_words or token.isdigit():
+            return None
+        return self.stemmer.stem(token)
 
-        for n in range(min_n, max_n+1):
-            if n==1:
-                continue
-                
-            for i in range(len(tokens)-n+1):
-                phrase="_".join(tokens[i:i+n])
+    def _tokenize(self, text: str)->list:
+        normalize=self.normalize_token
+        return [stem for stem in map(normalize, text.lower().translate(PUNCTUATION_TABLE).split()) if stem is not None]
 
-                if self.is_meaningful_phrase(tokens[i:i+n]):
-                    phrases.append(phrase)
-        return phrases
+    def iter_tokens(self, text, chunk_size=PREPROCESS_CHUNK_SIZE):
+        """
+        Streams the preprocessed tokens of a text chunk by chunk, so large documents are never lowercased,
+        translated and split as a whole. Chunks are cut at whitespace, so the tokens equal those of preprocess.
+
+        Args:
+            text: Text to be preprocessed, or an iterable of text pieces (e.g. a file opened in text mode)
+            chunk_size: Characters processed at once
+
+        Yields:
+            str: Stemmed tokens in document order
+        """
+        pieces=(text[i:i+chunk_size] for i in range(0, len(text), chunk_size)) if isinstance(text, str) else text
+
+        carry=""
+        for piece in pieces:
+            chunk=carry + piece
+            cut=len(chunk)
+            while cut > 0 and not chunk[cut-1].isspace():
+                cut-=1
+            # a chunk without whitespace is a single unfinished token, keep it for the next chunk
+            carry=chunk[cut:]
+            yield from self._tokenize(chunk[:cut])
+        if carry:
+            yield from self._tokenize(carry)
 
     def preprocess(self, text: str)->list:
         """
-        Preprocesses the text by removing stop words, stemming using Porter's algorithms, and returning tokens with n-gram support
-        
+        Preprocesses the text by removing stop words and stemming using Porter's algorithm.
+        Stems are cached per surface form, and texts longer than PREPROCESS_CHUNK_SIZE are processed in chunks.
+
         Args:
             text: Text to be preprocessed
-        
+
         Returns:
-            list: List of tokens and phrases after preprocessing
+            list: List of tokens after preprocessing
         """
-        text=text.lower()
-        text=text.replace("-", " ").replace("_", " ")
-        text=text.translate(str.maketrans("", "", string.punctuation))
-        tokens=text.split()
+        if len(text) <= PREPROCESS_CHUNK_SIZE:
+            return self._tokenize(text)
+        return list(self.iter_tokens(text))
 
-        tokens=[
-            self.stemmer.stem(t) for t in tokens if t not in self.stop_words and not t.isdigit()
-        ]
-
-        phrases=self.extract_phrases(tokens)
+    @staticmethod
+    def lnc_lengths(doc_ids, tfs)->dict:
+        """
+        Vector lengths of documents under lnc weighting. Each document's squared weights are summed in ascending
+        order, so lengths do not depend on the order postings are visited in and are identical across full builds,
+        incremental updates and shards.
 
-        all_terms=tokens + phrases
+        Args:
+            doc_ids: document id of every posting
+            tfs: term frequency of every posting
 
-        logger.info(f"Preprocessed text into {len(all_terms)} tokens and phrases")
-        return tokens
+        Returns:
+            dict: document id --> vector length
+        """
+        doc_ids=np.asarray(doc_ids, dtype=np.int64)
+        if not len(doc_ids):
+            return {}
+        w=1 + np.log10(np.asarray(tfs, dtype=np.float64))
+        squared=w * w #utilising provided scheme
+        order=np.lexsort((squared, doc_ids))
+        doc_ids=doc_ids[order]
+        starts=np.flatnonzero(np.r_[True, doc_ids[1:]!=doc_ids[:-1]])
+        lengths=np.sqrt(np.add.reduceat(squared[order], starts))
+        return dict(zip(doc_ids[starts].tolist(), lengths.tolist()))
 
     def compute_doc_length(self):
         """
         Computes the vector length for each document in the corpus
         """
-        self.doc_lengths=defaultdict(float)
-        
-        # Include regular terms and phrases
-        all_terms=list(self.dictionary.keys()) + list(self.phrase_dict.keys()) if self.phrase_dict else list(self.dictionary.keys())
-        
+        doc_ids=[]
+        tfs=[]
         for term in self.dictionary:
             df, posting_list=self.dictionary[term]
-            for docID, tf in posting_list:
-                w= 1 + math.log10(tf)
-                self.doc_lengths[docID] += w * w #utilising provided scheme
-        
-        for phrase in self.phrase_dict:
-            df, posting_list=self.phrase_dict[phrase]
-            for docID, tf in posting_list:
-                w=1 + math.log10(tf)
-                self.doc_lengths[docID] += w * w
-            
-        for docID in self.doc_lengths:
-            self.doc_lengths[docID] = math.sqrt(self.doc_lengths[docID])
+            term_doc_ids, term_tfs=posting_list.arrays()
+            doc_ids.append(term_doc_ids)
+            tfs.append(term_tfs)
+
+        self.doc_lengths=defaultdict(float)
+        if doc_ids:
+            self.doc_lengths.update(self.lnc_lengths(np.concatenate(doc_ids), np.concatenate(tfs)))
         
         logger.info("Computed doc lengths")
 
+    def term_upper_bound(self, term: str)->float:
+        """
+        Maximum normalized lnc weight of a term over all documents, computed on first use if not precomputed
+
+        Args:
+            term: Term in the index
+
+        Returns:
+            float: Upper bound of the term's document weight
+        """
+        upper_bound=self.term_upper_bounds.get(term)
+        if upper_bound is None:
+            df, posting_list=self.dictionary[term]
+            upper_bound=max(
+                ((1 + math.log10(tf)) / self.doc_lengths[docID] for docID, tf in posting_list if self.doc_lengths.get(docID, 0) > 0),
+                default=0.0
+            )
+            self.term_upper_bounds[term]=upper_bound
+        return upper_bound
+
+    def compute_term_upper_bounds(self)->None:
+        """
+        Precomputes the per-term upper bounds used by MaxScore top-k retrieval
+        """
+        self.term_upper_bounds={}
+        for term in self.dictionary:
+            self.term_upper_bound(term)
+        logger.info("Computed term upper bounds")
+
     def fuzzy_matcher(self, term: str, threshold=0.8)->str:
         """
         Utilise Jaro-Winkler similarity for fuzzy matching
@@ -154,285 +320,1742 @@ class VSM:
         if term in self.dictionary:
             return term
 
+        key=(term, threshold)
+        with self.fuzzy_lock:
+            cached=self.fuzzy_cache.get(key)
+            if cached is not None:
+                self.fuzzy_cache.move_to_end(key)
+        if cached is not None:
+            FUZZY_FALLBACKS.inc(1, "cache")
+            return cached
+
+        start_time=time.perf_counter()
+        method="unmatched"
         best_match=term
         best_similarity=0
 
-        dict_terms=list(self.dictionary.keys())
+        if self.fuzzy_index is None:
+            self.fuzzy_index=FuzzyTermIndex(self.dictionary.keys())
+
+        # candidates are a superset of the terms reaching the threshold, in dictionary order
+        dict_terms=self.fuzzy_index.candidates(term, threshold)
         
         for dict_term in dict_terms:
             similarity=jellyfish.jaro_winkler_similarity(term, dict_term)
             if similarity>=threshold and similarity>best_similarity:
                 best_similarity=similarity
                 best_match=dict_term
+                method="jaro_winkler"
         
         #Fallback to soundex if no good fuzzy match
         if best_match==term:
             soundex_code=jellyfish.soundex(term)
             if soundex_code in self.soundex_dict:
                 best_match=self.soundex_dict[soundex_code][0]
+                method="soundex"
         
-        if best_match!=term:
+        FUZZY_FALLBACKS.inc(1, method)
+        FUZZY_SECONDS.observe(time.perf_counter() - start_time)
+        if best_match!=term and log_sampled():
             logger.info(f"Fuzzy matched '{term}' to '{best_match}' (similarity: {best_similarity:.3f})")
+
+        with self.fuzzy_lock:
+            self.fuzzy_cache[key]=best_match
+            if len(self.fuzzy_cache)>self.fuzzy_cache_size:
+                self.fuzzy_cache.popitem(last=False)
             
         return best_match
     
-    def build_tfidf_matrix(self, doc_texts_list):
+    def build_tfidf_matrix(self, doc_ids: list):
         """
-        Tokenizes and preprocesses each document again.
+        Builds a sparse tf-idf matrix directly from the postings, without re-tokenizing any document.
+        Memory scales with the number of postings rather than documents x vocabulary.
 
         Args:
-            doc_texts_list: list of texts retrieved from each document
+            doc_ids: document ids, in row order
         
         Returns:
-            nparray: tfidf weights
+            SparseRows: CSR tf-idf matrix of shape (len(doc_ids), vocabulary size)
+            dict: term --> column index
+            nparray: idf per column
+        """
+        N=len(doc_ids)
+        row_of={doc_id: i for i, doc_id in enumerate(doc_ids)}
+        vocab={}
+        idf=[]
+        rows=[]
+        cols=[]
+        values=[]
+
+        for term in self.dictionary:
+            df, posting_list=self.dictionary[term]
+            j=len(vocab)
+            vocab[term]=j
+            term_idf=math.log10(N / (1 + df))
+            idf.append(term_idf)
+            for docID, freq in posting_list:
+                if docID in row_of:
+                    rows.append(row_of[docID])
+                    cols.append(j)
+                    values.append((1 + math.log10(freq)) * term_idf)
+
+        rows=np.asarray(rows, dtype=np.int64)
+        order=np.argsort(rows, kind="stable")
+        indptr=np.zeros(N + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=N), out=indptr[1:])
+
+        tfidf=SparseRows(indptr, np.asarray(cols, dtype=np.int64)[order], np.asarray(values, dtype=np.float64)[order], (N, len(vocab)))
+        return tfidf, vocab, np.asarray(idf, dtype=np.float64)
+
+    @staticmethod
+    def _gather_rows(X, rows=None):
+        """
+        Flattens the nonzeros of selected sparse rows
+
+        Args:
+            X: SparseRows matrix
+            rows: row indices to select, None for all rows
+
+        Returns:
+            tuple: (output row number, column index, value) arrays, one entry per nonzero
+        """
+        if rows is None:
+            return np.repeat(np.arange(X.shape[0]), np.diff(X.indptr)), X.indices, X.data
+
+        starts=X.indptr[rows]
+        lengths=X.indptr[rows + 1] - starts
+        nnz=np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+        return np.repeat(np.arange(len(rows)), lengths), X.indices[nnz], X.data[nnz]
+
+    @staticmethod
+    def squared_distances(X, centroids, rows=None):
+        """
+        Squared euclidean distances between sparse rows and dense centroids, via ||x||^2 - 2 x.c + ||c||^2
+
+        Args:
+            X: SparseRows matrix
+            centroids: 2D array of shape (k, num_features)
+            rows: optional row indices to restrict to
+
+        Returns:
+            nparray: 2D array of shape (num_rows, k)
+        """
+        row_ids, indices, data=VSM._gather_rows(X, rows)
+        n_rows=X.shape[0] if rows is None else len(rows)
+
+        x_norms=np.bincount(row_ids, weights=data * data, minlength=n_rows)
+        c_norms=(centroids * centroids).sum(axis=1)
+        dots=np.empty((n_rows, len(centroids)))
+        for i, centroid in enumerate(centroids):
+            dots[:, i]=np.bincount(row_ids, weights=data * centroid[indices], minlength=n_rows)
+
+        return np.maximum(x_norms[:, None] - 2 * dots + c_norms[None, :], 0)
+
+    @staticmethod
+    def _dense_row(X, i):
+        row=np.zeros(X.shape[1])
+        start, end=X.indptr[i], X.indptr[i+1]
+        row[X.indices[start:end]]=X.data[start:end]
+        return row
+
+    def kmeans_plus_plus(self, X, k, rng):
+        """
+        k-means++ seeding: each next centroid is sampled with probability proportional to the squared distance to the nearest chosen one
+
+        Args:
+            X: SparseRows matrix
+            k: number of clusters
+            rng: numpy random generator
+
+        Returns:
+            nparray: 2D array of initial centroids of shape (k, num_features)
         """
-        all_docs_tokens= [self.preprocess(text) for text in doc_texts_list]
-        vocab= {}
-        df= Counter()
+        n=X.shape[0]
+        centroids=np.zeros((k, X.shape[1]))
+        centroids[0]=self._dense_row(X, rng.integers(n))
+        closest=self.squared_distances(X, centroids[:1])[:, 0]
 
-        for tokens in all_docs_tokens:
-            unique_terms= set(tokens)
-            for t in unique_terms:
-                df[t]+= 1
-            for t in tokens:
-                if t not in vocab:
-                    vocab[t]= len(vocab)
+        for i in range(1, k):
+            total=closest.sum()
+            choice=rng.choice(n, p=closest / total) if total > 0 else rng.integers(n)
+            centroids[i]=self._dense_row(X, choice)
+            closest=np.minimum(closest, self.squared_distances(X, centroids[i:i+1])[:, 0])
+        return centroids
 
-        N= len(all_docs_tokens)
-        vocab_size= len(vocab)
-        tfidf= np.zeros((N, vocab_size))
+    def centroid_sums(self, X, labels, k, rows=None):
+        """
+        Per-cluster sums of sparse rows and member counts
+
+        Args:
+            X: SparseRows matrix
+            labels: cluster label per row (of rows, if given)
+            k: number of clusters
+            rows: optional row indices that labels refer to
+
+        Returns:
+            nparray: 2D array of summed rows of shape (k, num_features)
+            nparray: number of rows per cluster
+        """
+        row_ids, indices, data=self._gather_rows(X, rows)
 
-        for i, tokens in enumerate(all_docs_tokens):
-            tf= Counter(tokens)
-            for term, freq in tf.items():
-                if term in vocab:
-                    j= vocab[term]
-                    tf_weight= 1 + math.log10(freq)
-                    idf= math.log10(N / (1 + df[term]))
-                    tfidf[i, j]= tf_weight * idf
-        return tfidf
+        n_features=X.shape[1]
+        sums=np.bincount(labels[row_ids] * n_features + indices, weights=data, minlength=k * n_features)
+        return sums.reshape(k, n_features), np.bincount(labels, minlength=k)
 
-    def kmeans(self, X, k, max_iter=100):
+    def kmeans(self, X, k, max_iter=100, batch_size=None, seed=42):
         """
-        Basic reimplementation of K-means from scikit-learn
+        K-means on a sparse matrix with k-means++ seeding.
+        Runs full Lloyd iterations, or mini-batch k-means when batch_size is given.
         Args:
-            X: list of points
+            X: SparseRows matrix of points
             k: number of clusters to be selected
             max_iter: number of cycles over which clusters to be chosen
+            batch_size: rows sampled per mini-batch iteration, None for full batch
+            seed: random seed
         
         Returns:
             nparray (labels): 1D array of cluster labels
             nparray (centroids): 2D array of cluster centers of shape (k, num_features)
         """
-        np.random.seed(42)
-        idx= np.random.choice(len(X), k, replace=False)
-        centroids= X[idx]
+        rng=np.random.default_rng(seed)
+        n=X.shape[0]
+        centroids=self.kmeans_plus_plus(X, k, rng)
+
+        if batch_size is not None and batch_size < n:
+            counts=np.zeros(k)
+            for _ in range(max_iter):
+                rows=rng.choice(n, batch_size, replace=False)
+                labels=np.argmin(self.squared_distances(X, centroids, rows), axis=1)
+                sums, batch_counts=self.centroid_sums(X, labels, k, rows)
+
+                # per-center learning rate 1 / (points seen), i.e. a running mean of assigned points
+                counts+=batch_counts
+                updated=batch_counts > 0
+                new_centroids=centroids.copy()
+                new_centroids[updated]+=(sums[updated] - batch_counts[updated, None] * centroids[updated]) / counts[updated, None]
+
+                if np.allclose(new_centroids, centroids):
+                    break
+                centroids=new_centroids
+
+            labels=np.argmin(self.squared_distances(X, centroids), axis=1)
+            return labels, centroids
 
         for _ in range(max_iter):
-            distances= np.linalg.norm(X[:, None] - centroids[None, :], axis=2)
-            labels= np.argmin(distances, axis=1)
+            labels=np.argmin(self.squared_distances(X, centroids), axis=1)
 
-            new_centroids= np.array([
-                X[labels== i].mean(axis=0) if np.any(labels==i) else centroids[i]
-                for i in range(k)
-            ])
+            sums, counts=self.centroid_sums(X, labels, k)
+            new_centroids=centroids.copy()
+            nonempty=counts > 0
+            new_centroids[nonempty]=sums[nonempty] / counts[nonempty, None]
 
             if np.allclose(new_centroids, centroids):
                 break
-            centroids= new_centroids
+            centroids=new_centroids
 
         return labels, centroids
 
 
-    def perform_clustering(self)->None:
+    def perform_clustering(self)->bool:
         """
         Perform k means clustering on the documents using tf-idf weights
+
+        Returns:
+            bool: whether clustering was performed
         """
         if self.N<self.n_clusters:
             logger.info("insufficient documents")
-            return
+            return False
             
         logger.info(f"Performing K-means clustering with {self.n_clusters} clusters...")
         
-        doc_texts_list = [self.doc_texts[doc_id] for doc_id in self.doc_texts]
-        doc_ids = list(self.doc_texts.keys())
+        doc_ids = sorted(self.doc_index)
 
-        tfidf_matrix = self.build_tfidf_matrix(doc_texts_list)
-        cluster_labels, centroids = self.kmeans(tfidf_matrix, self.n_clusters)
+        tfidf_matrix, self.cluster_vocab, self.cluster_idf = self.build_tfidf_matrix(doc_ids)
+        cluster_labels, centroids = self.kmeans(tfidf_matrix, self.n_clusters, batch_size=self.cluster_batch_size)
 
+        self.doc_clusters = {}
+        self.cluster_centers = {}
+        self.changes_since_clustering = 0
         for i, doc_id in enumerate(doc_ids):
             self.doc_clusters[doc_id] = int(cluster_labels[i])
         for i in range(self.n_clusters):
             self.cluster_centers[i] = centroids[i]
 
         logger.info("Clustering completed.")
+        return True
 
-
-    def build_index(self) -> None:
+    def index_chunk(self, files: list)->tuple:
         """
-        Building VSM index for search
+        Extracts, preprocesses and builds partial postings for a chunk of documents
+
+        Args:
+            files: list of (document id, file name) pairs, in ascending document id order
+
+        Returns:
+            tuple: (list of (document id, file name, text) for indexed documents, partial postings term --> list of (document id, term frequency),
+                list of (file name, fingerprint), partial positions term --> list of encoded positions aligned with the partial postings)
         """
-        self.N=0
-        postings=defaultdict(list)  # term --> list of (document id, term frequency)
-        phrase_postings=defaultdict(list)  # phrase --> list of (document id, term frequency)
+        documents=[]
+        postings=defaultdict(list)
+        positions=defaultdict(list)
+        fingerprints=[]
 
-        for docID, filename in enumerate(os.listdir(self.corpus_dir), start=1):
+        for docID, filename in files:
             filepath=os.path.join(self.corpus_dir, filename)
+            try:
+                fingerprint=file_fingerprint(filepath)
+            except OSError as e:
+                logger.warning(f"Could not read file {filename}: {e}. Skipping this file.")
+                continue
+            fingerprints.append((filename, fingerprint))
 
             # text extraction
-            engine=TextExtractionEngine(filepath)
-            text=engine.run()
+            engine=TextExtractionEngine(filepath, cache=self.extraction_cache, content_hash=fingerprint["hash"])
+            try:
+                text=engine.run()
+            except Exception as e:
+                # a corrupt file must not abort the rest of the build, in a worker process or not
+                logger.warning(f"Could not extract text from file {filename}: {e}. Skipping this file.")
+                continue
             if not text.strip():
                 logger.warning(f"No text extracted from file: {filename}. Skipping this file.")
                 continue
-            
-            # Clustering original text
-            self.doc_texts[docID]=text
-            
-            # Preprocessing
+
+            self._collect_postings(docID, text, fingerprint["hash"], postings, positions)
+            documents.append((docID, filename, text))
+
+        if self.extraction_cache:
+            self.extraction_cache.flush()
+        return documents, postings, fingerprints, positions
+
+    def _collect_postings(self, docID: int, text: str, content_hash: str, postings: dict, positions: dict)->None:
+        """
+        Preprocesses a document, reusing cached token streams, and appends its postings and encoded positions
+
+        Args:
+            docID: Document id, greater than those already in postings
+            text: Extracted text
+            content_hash: SHA-256 of the document content, the token cache key
+            postings: term --> list of (document id, term frequency), extended in place
+            positions: term --> list of encoded positions aligned with postings, extended in place
+        """
+        # Preprocessing
+        terms=self.extraction_cache.get_tokens(content_hash, PREPROCESS_VERSION) if self.extraction_cache else None
+        if terms is None:
             terms=self.preprocess(text)
-            
-            #docID file name mapping
-            self.doc_index[docID]=filename
+            if self.extraction_cache:
+                self.extraction_cache.put_tokens(content_hash, PREPROCESS_VERSION, terms)
 
-            #term freq count
-            tf=Counter(terms)
-            
-            for term, frequency in tf.items():
-                if "_" in term: #indicates phrase
-                    phrase_postings[term].append((docID, frequency))
-                else:
-                    postings[term].append((docID, frequency))
-            
-            self.N+=1
+        #term positions, the term frequency is the number of positions
+        term_positions=defaultdict(list)
+        for position, term in enumerate(terms):
+            term_positions[term].append(position)
+
+        for term, occurrences in term_positions.items():
+            postings[term].append((docID, len(occurrences)))
+            positions[term].append(encode_positions(occurrences))
+
+    def index_documents(self, documents: list)->tuple:
+        """
+        Extracts, preprocesses and builds partial postings for a chunk of in-memory documents, the counterpart of
+        index_chunk for ingest_documents. File contents are extracted from memory, never written to disk.
+
+        Args:
+            documents: list of (document id, IngestDocument, content hash), in ascending document id order
+
+        Returns:
+            tuple: (list of (document id, name, text) for indexed documents, partial postings term --> list of (document id, term frequency),
+                partial positions term --> list of encoded positions aligned with the partial postings)
+        """
+        indexed=[]
+        postings=defaultdict(list)
+        positions=defaultdict(list)
+
+        for docID, document, document_hash in documents:
+            if isinstance(document.data, str):
+                text=document.data
+            else:
+                engine=TextExtractionEngine(document.name, cache=self.extraction_cache, content_hash=document_hash, data=document.data, file_type=document.file_type)
+                try:
+                    text=engine.run()
+                except Exception as e:
+                    # a malformed upstream document must not abort the rest of the stream
+                    logger.warning(f"Could not extract text from document {document.name}: {e}. Skipping this document.")
+                    continue
+            if not text.strip():
+                logger.warning(f"No text extracted from document: {document.name}. Skipping this document.")
+                continue
+
+            self._collect_postings(docID, text, document_hash, postings, positions)
+            indexed.append((docID, document.name, text))
+
+        if self.extraction_cache:
+            self.extraction_cache.flush()
+        return indexed, postings, positions
+
+    def _ingest_parallel(self, files: list, n_workers: int):
+        """
+        Runs index_chunk over contiguous chunks of document ids in a process pool.
+        Chunk results are yielded back in order, so merged postings stay sorted by document id exactly as in the serial build.
+
+        Args:
+            files: list of (document id, file name) pairs
+            n_workers: number of worker processes
+
+        Yields:
+            tuple: index_chunk result for each chunk
+        """
+        chunk_size=max(1, min(SERIAL_CHUNK_SIZE, math.ceil(len(files) / (n_workers * 4))))
+        chunks=[files[i:i+chunk_size] for i in range(0, len(files), chunk_size)]
+
+        pool=ProcessPoolExecutor(max_workers=n_workers, initializer=_init_ingest_worker, initargs=(self.corpus_dir, self.ngram_range, self.cache_dir, self.cache_max_bytes, self.stem_cache_size))
+        try:
+            for result, worker_metrics in pool.map(_index_chunk, chunks):
+                # extraction metrics recorded in the worker process
+                metrics.REGISTRY.merge(worker_metrics)
+                yield result
+        finally:
+            # pending chunks are dropped if the consumer stops early, e.g. on cancellation
+            pool.shutdown(wait=True, cancel_futures=True)
+
+    def _ingest(self, files: list, n_workers: int):
+        """
+        Runs index_chunk over the files in chunks, serially or in a process pool
+
+        Args:
+            files: list of (document id, file name) pairs
+            n_workers: number of worker processes, 1 for serial ingestion
+
+        Yields:
+            tuple: index_chunk result for each chunk, in document id order
+        """
+        if n_workers>1 and len(files)>1:
+            logger.info(f"Ingesting {len(files)} files with {n_workers} worker processes")
+            yield from self._ingest_parallel(files, n_workers)
+        else:
+            for i in range(0, len(files), SERIAL_CHUNK_SIZE):
+                yield self.index_chunk(files[i:i+SERIAL_CHUNK_SIZE])
+
+    def in_shard(self, filename: str)->bool:
+        """
+        Args:
+            filename: File name in the corpus directory
+
+        Returns:
+            bool: whether the file belongs to this index, always True when not sharded
+        """
+        if self.shard is None:
+            return True
+        shard_id, n_shards=self.shard
+        # stable across processes and runs, unlike hash()
+        return zlib.crc32(filename.encode("utf-8")) % n_shards==shard_id
+
+    def build_index(self, n_workers=None, progress=None) -> None:
+        """
+        Building VSM index for search
+
+        Args:
+            n_workers: Overrides the number of ingestion processes set at initialisation
+            progress: Optional callback progress(phase, done, total), called as extraction advances and when
+                each later phase starts; it may raise BuildCancelled to abort the build
+        """
+        n_workers=n_workers or self.n_workers
+        report=progress or (lambda phase, done, total: None)
+        self.N=0
+        postings=defaultdict(list)  # term --> list of (document id, term frequency)
+        positions=defaultdict(list)  # term --> list of encoded positions
+
+        # document ids follow the full directory listing, so shards of a corpus share one id space
+        files=list(enumerate(os.listdir(self.corpus_dir), start=1))
+        self.next_doc_id=len(files) + 1
+        files=[(docID, filename) for docID, filename in files if self.in_shard(filename)]
+        report("extracting", 0, len(files))
+        phase_start=time.perf_counter()
+
+        # Merging partial postings in document id order
+        fingerprints={}
+        for documents, partial_postings, chunk_fingerprints, partial_positions in self._ingest(files, n_workers):
+            fingerprints.update(chunk_fingerprints)
+            report("extracting", len(fingerprints), len(files))
+            for docID, filename, text in documents:
+                # original text, for snippets
+                self.doc_store.add(docID, text)
+
+                #docID file name mapping
+                self.doc_index[docID]=filename
+                self.doc_terms[docID]=[]
+                self.N+=1
+
+            for term, posting_list in partial_postings.items():
+                postings[term].extend(posting_list)
+                positions[term].extend(partial_positions[term])
+                for docID, _ in posting_list:
+                    self.doc_terms[docID].append(term)
+
+        for docID, filename in files:
+            self.file_stats[filename]=dict(fingerprints[filename], doc_id=docID if docID in self.doc_index else None)
         
-        # Building term, soundex and phrase dictionaries
+        # Building term, positional and soundex dictionaries
+        phase_start=_observe_phase(BUILD_PHASE_SECONDS, "extracting", phase_start)
+        report("indexing", len(files), len(files))
         for term, posting_list in postings.items():
-            self.dictionary[term]=(len(posting_list), posting_list)
-        
-        for phrase, posting_list in phrase_postings.items():
-            self.phrase_dict[phrase]=(len(posting_list), posting_list)
+            self.dictionary[term]=(len(posting_list), PostingsList.from_pairs(posting_list, self.postings_encoding))
+        self.positions=dict(positions)
         
         for term in self.dictionary:
             soundex_code = jellyfish.soundex(term)
             self.soundex_dict[soundex_code].append(term)
 
+        self.fuzzy_index=FuzzyTermIndex(self.dictionary.keys())
+        with self.fuzzy_lock:
+            self.fuzzy_cache.clear()
+
         self.compute_doc_length()
+        self.compute_term_upper_bounds()
         
         #performing k means clustering
+        phase_start=_observe_phase(BUILD_PHASE_SECONDS, "indexing", phase_start)
+        report("clustering", len(files), len(files))
         self.perform_clustering()
+        phase_start=_observe_phase(BUILD_PHASE_SECONDS, "clustering", phase_start)
+
+        # the CSR arrays hold the postings grouped by cluster used by cluster-pruned scoring and cluster selection
+        report("csr", len(files), len(files))
+        self.csr_scorer=None
+        self.get_csr_scorer()
+        _observe_phase(BUILD_PHASE_SECONDS, "csr", phase_start)
+        self.generation+=1
+        DOCUMENTS_INDEXED.inc(self.N)
         
-        logger.info(f"Built enhanced index for {self.N} documents with {len(self.dictionary)} terms and {len(self.phrase_dict)} phrases")
+        logger.info(f"Built enhanced index for {self.N} documents with {len(self.dictionary)} terms and {sum(map(len, self.positions.values()))} positional postings")
     
-    def get_relevant_clusters(self, query_terms: list, top_clusters=3) -> list:
+    @reads_index
+    def save(self, index_dir: str)->None:
         """
-        Identify relevant clusters
-        
+        Saves the built index to disk in the versioned binary format of utils.index_store
+
         Args:
-            query_terms: Preprocessed query terms
-            top_clusters: Number of top clusters to consider
-            
+            index_dir: Directory to write the index into
+        """
+        save_index(self, index_dir)
+
+    @classmethod
+    def load(cls, index_dir: str, **kwargs):
+        """
+        Loads a saved index without re-extracting or re-stemming the corpus.
+        Postings, positions, the CSR scoring arrays and the compressed document texts are memory-mapped, so processes
+        loading the same index share them through the page cache.
+
+        Args:
+            index_dir: Directory written by VSM.save
+            kwargs: Runtime settings passed to VSM.__init__, such as n_workers or cache_dir
+
         Returns:
-            list: List of relevant cluster via cluster ID
+            VSM: Instance ready for querying
         """
-        if not self.doc_clusters:
-            return list(range(self.n_clusters)) if self.n_clusters else []
-        
-        cluster_scores=defaultdict(float)
-        
-        for term in query_terms:
-            matched_term=self.fuzzy_matcher(term)
-            if matched_term in self.dictionary:
-                df, posting_list=self.dictionary[matched_term]
+        vsm=cls(corpus_dir="", **kwargs)
+        load_index(vsm, index_dir)
+        vsm.csr_scorer=CSRScorer.from_arrays(vsm.dictionary.term_ids, *read_csr(index_dir))
+
+        for term in vsm.dictionary:
+            soundex_code=jellyfish.soundex(term)
+            vsm.soundex_dict[soundex_code].append(term)
+        vsm.generation+=1
+        return vsm
+
+    @staticmethod
+    def _mapping_bytes(mapping)->int:
+        """
+        Shallow size of a mapping with its keys and values, objects shared with other structures are counted again
+        """
+        return sys.getsizeof(mapping) + sum(sys.getsizeof(key) + sys.getsizeof(value) for key, value in mapping.items())
+
+    @reads_index
+    def memory_usage(self)->dict:
+        """
+        Estimates the memory held by the index, per component, to budget how many indexes a process keeps resident.
+        Arrays count in full even while memory-mapped, as queries page them in; Python objects are measured with
+        sys.getsizeof, so the figures are an approximation rather than an exact account.
+
+        Returns:
+            dict: component --> bytes, and their total
+        """
+        if isinstance(self.dictionary, dict):
+            terms=self._mapping_bytes(self.dictionary)
+            postings=sum(posting_list.nbytes() + DICTIONARY_ENTRY_BYTES for df, posting_list in self.dictionary.values()
+                         if isinstance(posting_list, PostingsList))
+        else:
+            terms=sys.getsizeof(self.dictionary.terms) + self._mapping_bytes(self.dictionary.term_ids)
+            postings=self.dictionary.offsets.nbytes + self.dictionary.docs.nbytes + self.dictionary.tfs.nbytes
+
+        if isinstance(self.positions, dict):
+            positions=sys.getsizeof(self.positions) + sum(map(sys.getsizeof, self.positions.values()))
+            positions+=sum(len(encoded) + BYTES_OBJECT_OVERHEAD for encoded in chain.from_iterable(self.positions.values()))
+        else:
+            positions=self.positions.offsets.nbytes + self.positions.data.nbytes
+
+        with self.fuzzy_lock:
+            fuzzy_cache=self._mapping_bytes(self.fuzzy_cache)
+        documents=sum(self._mapping_bytes(mapping) for mapping in (self.doc_index, self.doc_lengths, self.doc_clusters, self.file_stats, self.ingested_docs, self.doc_terms))
+        usage={
+            "terms": terms + self._mapping_bytes(self.soundex_dict),
+            "postings": postings,
+            "positions": positions,
+            "documents": documents,
+            "texts": self.doc_store.nbytes(),
+            "clusters": sum(center.nbytes for center in self.cluster_centers.values()) + self._mapping_bytes(self.cluster_vocab) + self.cluster_idf.nbytes,
+            "csr": self.csr_scorer.nbytes() if self.csr_scorer is not None else 0,
+            "similarity": self.similarity_index.nbytes() if self.similarity_index is not None else 0,
+            "fuzzy": (self.fuzzy_index.nbytes() if self.fuzzy_index is not None else 0) + fuzzy_cache,
+            "query_cache": self.query_cache.size,
+        }
+        usage["total"]=sum(usage.values())
+        return usage
+
+    def _materialize(self)->None:
+        """
+        Converts memory-mapped dictionaries of a loaded index into in-memory ones so they can be updated,
+        and rebuilds the document --> terms mapping which is not part of the saved index
+        """
+        if not isinstance(self.dictionary, dict):
+            # copied out of the mapped files, so the index directory can be rewritten
+            self.dictionary={
+                term: (df, PostingsList.from_arrays(*posting_list.arrays(), self.postings_encoding))
+                for term, (df, posting_list) in self.dictionary.items()
+            }
+        if not isinstance(self.positions, dict):
+            self.positions={term: self.positions[term] for term in self.positions}
+
+        if len(self.doc_terms)<len(self.doc_index):
+            self.doc_terms={docID: [] for docID in self.doc_index}
+            for term, (df, posting_list) in self.dictionary.items():
                 for docID, tf in posting_list:
-                    if docID in self.doc_clusters:
-                        cluster_id=self.doc_clusters[docID]
-                        cluster_scores[cluster_id]+=math.log10(1 + tf)
-        
-        sorted_clusters=sorted(cluster_scores.items(), key=lambda x: x[1], reverse=True)
-        relevant_clusters=[cluster_id for cluster_id, score in sorted_clusters[:top_clusters]]
+                    self.doc_terms[docID].append(term)
 
-        if not relevant_clusters:
-            relevant_clusters=list(range(self.n_clusters))
-        
-        logger.info(f"Selected clusters {relevant_clusters} for query processing")
-        return relevant_clusters
+    def _remove_document(self, docID: int)->None:
+        """
+        Removes a document from postings, document frequencies, soundex and per-document tables
+
+        Args:
+            docID: Document id to remove
+        """
+        for term in self.doc_terms.pop(docID, []):
+            self.term_upper_bounds.pop(term, None)
+            df, posting_list=self.dictionary[term]
+            doc_ids, tfs=posting_list.arrays()
+            i=int(np.searchsorted(doc_ids, docID))
+            term_positions=self.positions[term]
+            term_positions=term_positions[:i] + term_positions[i+1:]
+
+            if df > 1:
+                self.dictionary[term]=(df - 1, PostingsList.from_arrays(np.delete(doc_ids, i), np.delete(tfs, i), self.postings_encoding))
+                self.positions[term]=term_positions
+                continue
+
+            del self.dictionary[term]
+            del self.positions[term]
+            if self.fuzzy_index is not None:
+                self.fuzzy_index.remove(term)
+            soundex_code=jellyfish.soundex(term)
+            self.soundex_dict[soundex_code].remove(term)
+            if not self.soundex_dict[soundex_code]:
+                del self.soundex_dict[soundex_code]
+
+        self.doc_index.pop(docID, None)
+        self.doc_store.remove(docID)
+        self.doc_lengths.pop(docID, None)
+        self.doc_clusters.pop(docID, None)
 
-    def query(self, qtext):
+    def _add_documents(self, documents: list, partial_postings: dict, partial_positions: dict)->dict:
         """
-        Query processing with fuzzy matching, clustering, and phrase support
-        
+        Merges the output of index_chunk into the index
+
         Args:
-            qtext: Query text
-        
+            documents: list of (document id, file name, text)
+            partial_postings: term --> list of (document id, term frequency)
+            partial_positions: term --> list of encoded positions aligned with partial_postings
+
         Returns:
-            tuple: (list of (filename, score) pairs, elapsed_time)
+            dict: document id --> term frequency Counter of the added documents
         """
-        start_time=time.perf_counter()
-
-        qtokens=self.preprocess(qtext)
-        qtf=Counter(qtokens)
+        doc_tfs={}
+        for docID, filename, text in documents:
+            self.doc_store.add(docID, text)
+            self.doc_index[docID]=filename
+            self.doc_terms[docID]=[]
+            doc_tfs[docID]=Counter()
 
-        qvec={}
+        for term, new_postings in partial_postings.items():
+            self.term_upper_bounds.pop(term, None)
+            new_positions=partial_positions[term]
 
-        for term, tf in qtf.items():
-            matched_term=term
-            #matched phrases
-            if "_" in term and term in self.phrase_dict:
-                df, _=self.phrase_dict[term]
-                dict_to_use=self.phrase_dict
-            
-            #match regular terms
-            elif term in self.dictionary:
-                df, _=self.dictionary[term]
-                dict_to_use=self.dictionary
+            new_doc_ids=np.asarray([docID for docID, _ in new_postings], dtype=np.int64)
+            new_tfs=np.asarray([tf for _, tf in new_postings], dtype=np.int64)
+            if np.any(new_doc_ids[1:] < new_doc_ids[:-1]):
+                # postings merged from several chunks, e.g. re-ingested documents keeping their old ids
+                order=np.argsort(new_doc_ids, kind="stable")
+                new_doc_ids=new_doc_ids[order]
+                new_tfs=new_tfs[order]
+                new_postings=[new_postings[i] for i in order.tolist()]
+                new_positions=[new_positions[i] for i in order.tolist()]
 
+            if term in self.dictionary:
+                df, posting_list=self.dictionary[term]
+                doc_ids, tfs=posting_list.arrays()
+                term_positions=self.positions[term]
+                insert_at=np.searchsorted(doc_ids, new_doc_ids)
+                doc_ids=np.insert(doc_ids, insert_at, new_doc_ids)
+                tfs=np.insert(tfs, insert_at, new_tfs)
+                # inserting from the back keeps the earlier insertion points valid
+                for i, encoded in reversed(list(zip(insert_at.tolist(), new_positions))):
+                    term_positions.insert(i, encoded)
             else:
-                #Apply fuzzy matching and fallback soundex processing
-                matched_term=self.fuzzy_matcher(term)
-                if matched_term!=term and matched_term in self.dictionary:
-                    df, _=self.dictionary[matched_term]
-                    dict_to_use=self.dictionary
-                else:
-                    continue
-            
-            if matched_term in dict_to_use:
-                df, _=dict_to_use[matched_term]
-                w=(1 + math.log10(tf)) * math.log10(self.N / df)
-                qvec[matched_term]=w
+                doc_ids, tfs=new_doc_ids, new_tfs
+                term_positions=list(new_positions)
+                self.soundex_dict[jellyfish.soundex(term)].append(term)
+                if self.fuzzy_index is not None:
+                    self.fuzzy_index.add(term)
+            self.dictionary[term]=(len(doc_ids), PostingsList.from_arrays(doc_ids, tfs, self.postings_encoding))
+            self.positions[term]=term_positions
 
-        #normalize query vector as per provided requirements
-        norm=math.sqrt(sum(w * w for w in qvec.values()))
-        if norm>0:
-            for term in qvec:
-                qvec[term]/=norm
+            for docID, tf in new_postings:
+                self.doc_terms[docID].append(term)
+                doc_tfs[docID][term]=tf
 
-        relevant_clusters=self.get_relevant_clusters(list(qtf.keys()))
+        # lnc document weights do not depend on idf, so lengths of untouched documents stay valid
+        self.doc_lengths.update(self.lnc_lengths(
+            [docID for docID, tf in doc_tfs.items() for _ in tf],
+            [f for tf in doc_tfs.values() for f in tf.values()]
+        ))
+        return doc_tfs
 
-        scores=defaultdict(float)
+    def assign_clusters(self, doc_tfs: dict)->dict:
+        """
+        Assigns documents to the nearest existing cluster center in the tf-idf space used for clustering
+
+        Args:
+            doc_tfs: document id --> term frequency Counter
+
+        Returns:
+            dict: document id --> cluster id, empty if no clustering is available
+        """
+        if not self.cluster_centers or not self.cluster_vocab or not doc_tfs:
+            return {}
+
+        doc_ids=list(doc_tfs)
+        indptr=[0]
+        indices=[]
+        data=[]
+        for docID in doc_ids:
+            for term, freq in doc_tfs[docID].items():
+                j=self.cluster_vocab.get(term)
+                if j is not None:
+                    indices.append(j)
+                    data.append((1 + math.log10(freq)) * self.cluster_idf[j])
+            indptr.append(len(indices))
+
+        X=SparseRows(np.asarray(indptr, dtype=np.int64), np.asarray(indices, dtype=np.int64), np.asarray(data, dtype=np.float64), (len(doc_ids), len(self.cluster_idf)))
+        centers=np.array([self.cluster_centers[i] for i in sorted(self.cluster_centers)])
+        labels=np.argmin(self.squared_distances(X, centers), axis=1)
+        return {docID: int(label) for docID, label in zip(doc_ids, labels)}
+
+    def update_index(self, recluster=False)->dict:
+        """
+        Incrementally brings the index in line with the corpus directory without a full rebuild.
+        Files are compared by mtime and size first, then by content hash; only new and changed files are extracted.
+        New and changed documents join the nearest existing cluster, and a full re-clustering runs once the
+        fraction of changed documents since the last clustering exceeds recluster_threshold.
+        Updates and ingestions of the index run one at a time, a concurrent call waits for the running one.
+
+        Args:
+            recluster: Force a full re-clustering after the update
+
+        Returns:
+            dict: names of added, modified and deleted files, and whether clustering was redone
+        """
+        start_time=time.perf_counter()
+        with self.update_lock:
+            with self.index_lock.write():
+                self._materialize()
+
+            # an index fed only through ingest_documents has no corpus directory
+            listing=[filename for filename in os.listdir(self.corpus_dir) if self.in_shard(filename)] if self.corpus_dir else []
+            current=set(listing)
+            deleted=[filename for filename in self.file_stats if filename not in current]
+            added=[]
+            modified=[]
+
+            for filename in listing:
+                stats=self.file_stats.get(filename)
+                if stats is None:
+                    added.append(filename)
+                    continue
+
+                stat=os.stat(os.path.join(self.corpus_dir, filename))
+                if stat.st_mtime==stats["mtime"] and stat.st_size==stats["size"]:
+                    continue
+
+                fingerprint=file_fingerprint(os.path.join(self.corpus_dir, filename))
+                if fingerprint["hash"]==stats["hash"]:
+                    stats.update(mtime=fingerprint["mtime"], size=fingerprint["size"])
+                else:
+                    modified.append(filename)
+
+            # changed files keep their document id, new files get fresh ones
+            files=[]
+            replaced=set() # ids of changed files, their old version is removed when the new one is merged
+            for filename in modified + added:
+                docID=self.file_stats.get(filename, {}).get("doc_id")
+                if docID is None:
+                    docID=self.next_doc_id
+                    self.next_doc_id+=1
+                else:
+                    replaced.add(docID)
+                files.append((docID, filename))
+            files.sort()
+            file_ids={filename: docID for docID, filename in files}
+
+            # extraction runs outside the write lock, queries are only held while a batch is merged
+            buffered=([], defaultdict(list), defaultdict(list), []) # extracted documents, postings, positions and fingerprints awaiting the merge
+            def merge_buffered():
+                documents, postings, positions, fingerprints=buffered
+                self._merge_batch([file_ids[filename] for filename, _ in fingerprints if file_ids[filename] in replaced], documents, postings, positions)
+                for filename, fingerprint in fingerprints:
+                    docID=file_ids[filename]
+                    self.file_stats[filename]=dict(fingerprint, doc_id=docID if docID in self.doc_index else None)
+                for part in buffered:
+                    part.clear()
+
+            if files:
+                for documents, partial_postings, fingerprints, partial_positions in self._ingest(files, self.n_workers):
+                    buffered[0].extend(documents)
+                    for term, posting_list in partial_postings.items():
+                        buffered[1][term].extend(posting_list)
+                        buffered[2][term].extend(partial_positions[term])
+                    buffered[3].extend(fingerprints)
+                    if len(buffered[0]) >= INGEST_MERGE_DOCUMENTS:
+                        with self.index_lock.write():
+                            merge_buffered()
+                            self._refresh_scoring()
+
+            with self.index_lock.write():
+                merge_buffered()
+                for filename in deleted:
+                    docID=self.file_stats.pop(filename)["doc_id"]
+                    if docID is not None:
+                        self._remove_document(docID)
+                reclustered=self._finish_update(len(added) + len(modified) + len(deleted), {}, recluster)
+        DOCUMENTS_INDEXED.inc(len(files))
+        BUILD_PHASE_SECONDS.observe(time.perf_counter() - start_time, "update")
+
+        logger.info(f"Updated index: {len(added)} added, {len(modified)} modified, {len(deleted)} deleted, reclustered={reclustered}")
+        return {"added": added, "modified": modified, "deleted": deleted, "reclustered": reclustered}
+
+    def _finish_update(self, n_changes: int, doc_tfs: dict, recluster=False)->bool:
+        """
+        Brings clustering and the CSR arrays in line with documents added or removed by an incremental update,
+        and invalidates cached query results
+
+        Args:
+            n_changes: Number of documents added, modified or deleted
+            doc_tfs: document id --> term frequency Counter of added documents not yet assigned to a cluster
+            recluster: Force a full re-clustering
+
+        Returns:
+            bool: whether clustering was redone
+        """
+        self.N=len(self.doc_index)
+        self.changes_since_clustering+=n_changes
+
+        reclustered=False
+        if recluster or (self.N and self.changes_since_clustering / self.N > self.recluster_threshold):
+            reclustered=self.perform_clustering()
+        if not reclustered:
+            self.doc_clusters.update(self.assign_clusters(doc_tfs))
+
+        self._refresh_scoring()
+        return reclustered
+
+    def _merge_batch(self, replaced: list, documents: list, partial_postings: dict, partial_positions: dict)->None:
+        """
+        Merges a batch of new and changed documents: removes the old versions of the changed ones, adds the output of
+        index_chunk and assigns the added documents to their nearest clusters. Called under the write lock, followed
+        by _refresh_scoring or _finish_update before it is released, so queries see either none or all of the batch.
+
+        Args:
+            replaced: Document ids whose earlier version is replaced by the batch
+            documents: list of (document id, file name, text)
+            partial_postings: term --> list of (document id, term frequency)
+            partial_positions: term --> list of encoded positions aligned with partial_postings
+        """
+        for docID in replaced:
+            self._remove_document(docID)
+        doc_tfs=self._add_documents(documents, partial_postings, partial_positions)
+        self.doc_clusters.update(self.assign_clusters(doc_tfs))
+
+    def _refresh_scoring(self)->None:
+        """
+        Rebuilds the CSR arrays from the changed postings, and invalidates cached fuzzy corrections and query results
+        """
+        self.N=len(self.doc_index)
+        self.csr_scorer=None
+        self.get_csr_scorer()
+        with self.fuzzy_lock:
+            self.fuzzy_cache.clear()
+        self.generation+=1
+
+    def ingest_documents(self, documents, n_workers=None, recluster=False)->dict:
+        """
+        Streams documents from any source into the index through the incremental indexing path, without staging
+        them on disk. Documents are extracted and preprocessed in chunks, in a process pool when n_workers > 1, and
+        at most INGEST_PENDING_PER_WORKER chunks per worker are in flight: the iterable is only advanced once a chunk
+        completes, so a producer feeding it from a bounded queue is held back while indexing catches up.
+        A document whose id was ingested before replaces the earlier version, unless its content is unchanged.
+        New documents join the nearest existing cluster. Every INGEST_MERGE_DOCUMENTS documents are merged under the
+        write lock and become searchable together, the rest when the call returns; queries keep running meanwhile.
+        Ingestions and updates of the index run one at a time, a concurrent call waits for the running one.
+
+        Args:
+            documents: Iterable of IngestDocument, or (id, data) / (id, data, file type) tuples, where data is the
+                bytes of a PDF, DOCX or TXT file or already extracted text
+            n_workers: Overrides the number of ingestion processes set at initialisation
+            recluster: Force a full re-clustering after the ingestion
+
+        Returns:
+            dict: numbers of documents added, modified, unchanged and skipped (no text, or outside this shard), and whether clustering was redone
+        """
+        start_time=time.perf_counter()
+        with self.update_lock:
+            with self.index_lock.write():
+                self._materialize()
+            n_workers=n_workers or self.n_workers
+            counts={"added": 0, "modified": 0, "unchanged": 0, "skipped": 0}
+
+            pool=ProcessPoolExecutor(max_workers=n_workers, initializer=_init_ingest_worker, initargs=(self.corpus_dir, self.ngram_range, self.cache_dir, self.cache_max_bytes, self.stem_cache_size)) if n_workers > 1 else None
+            max_pending=n_workers * INGEST_PENDING_PER_WORKER if pool else 1
+            pending=deque() # (chunk, future or index_documents result) in submission order
+            in_flight={} # external id --> size and hash of a version not merged yet
+            replaced=set() # ids of changed documents, their old version is removed when the new one is merged
+            buffered=([], defaultdict(list), defaultdict(list), []) # indexed documents, postings, positions and chunks awaiting the merge
+
+            def merge_buffered():
+                indexed, postings, positions, chunks=buffered
+                chunk_replaced=[docID for chunk in chunks for docID, _, _ in chunk if docID in replaced]
+                replaced.difference_update(chunk_replaced)
+                self._merge_batch(chunk_replaced, indexed, postings, positions)
+                for chunk in chunks:
+                    for docID, document, document_hash in chunk:
+                        stats=in_flight.pop(document.name)
+                        stats["doc_id"]=docID if docID in self.doc_index else None
+                        self.ingested_docs[document.name]=stats
+                        if stats["doc_id"] is None:
+                            counts["skipped"]+=1
+                for part in buffered:
+                    part.clear()
+
+            def complete_next():
+                chunk, result=pending.popleft()
+                if pool:
+                    result, worker_metrics=result.result()
+                    metrics.REGISTRY.merge(worker_metrics)
+                indexed, postings, positions=result
+                buffered[0].extend(indexed)
+                for term, posting_list in postings.items():
+                    buffered[1][term].extend(posting_list)
+                    buffered[2][term].extend(positions[term])
+                buffered[3].append(chunk)
+                if len(buffered[0]) >= INGEST_MERGE_DOCUMENTS:
+                    with self.index_lock.write():
+                        merge_buffered()
+                        self._refresh_scoring()
+
+            def submit(chunk):
+                pending.append((chunk, pool.submit(_index_documents, chunk) if pool else self.index_documents(chunk)))
+                while len(pending) >= max_pending:
+                    complete_next()
+
+            chunk=[]
+            try:
+                for document in documents:
+                    document=IngestDocument(*document)
+                    if not self.in_shard(document.name):
+                        counts["skipped"]+=1
+                        continue
+                    if document.name in in_flight:
+                        # an earlier version is still being indexed, let it land before replacing it
+                        if chunk:
+                            submit(chunk)
+                            chunk=[]
+                        while pending:
+                            complete_next()
+                        with self.index_lock.write():
+                            merge_buffered()
+                            self._refresh_scoring()
+
+                    data=document.data.encode("utf-8") if isinstance(document.data, str) else bytes(document.data)
+                    stats={"size": len(data), "hash": content_hash(data)}
+                    previous=self.ingested_docs.get(document.name)
+                    if previous is None:
+                        docID=self.next_doc_id
+                        self.next_doc_id+=1
+                        counts["added"]+=1
+                    elif previous["hash"]==stats["hash"]:
+                        counts["unchanged"]+=1
+                        continue
+                    else:
+                        # changed documents keep their document id
+                        docID=previous["doc_id"]
+                        if docID is None:
+                            docID=self.next_doc_id
+                            self.next_doc_id+=1
+                        else:
+                            replaced.add(docID)
+                        counts["modified"]+=1
+
+                    in_flight[document.name]=stats
+                    chunk.append((docID, document, stats["hash"]))
+                    if len(chunk) >= SERIAL_CHUNK_SIZE:
+                        chunk.sort(key=lambda item: item[0])
+                        submit(chunk)
+                        chunk=[]
+            finally:
+                # documents read before a failing source are still indexed, and the CSR arrays always match the postings
+                try:
+                    if chunk:
+                        chunk.sort(key=lambda item: item[0])
+                        pending.append((chunk, pool.submit(_index_documents, chunk) if pool else self.index_documents(chunk)))
+                    while pending:
+                        complete_next()
+                finally:
+                    if pool:
+                        pool.shutdown(wait=True, cancel_futures=True)
+                    n_indexed=counts["added"] + counts["modified"]
+                    with self.index_lock.write():
+                        merge_buffered()
+                        reclustered=self._finish_update(n_indexed, {}, recluster)
+                    DOCUMENTS_INDEXED.inc(n_indexed)
+                    BUILD_PHASE_SECONDS.observe(time.perf_counter() - start_time, "ingest")
+
+        counts["reclustered"]=reclustered
+        logger.info(f"Ingested documents: {counts['added']} added, {counts['modified']} modified, {counts['unchanged']} unchanged, {counts['skipped']} skipped, reclustered={reclustered}")
+        return counts
+
+    def term_cluster_scores(self, term: str)->dict:
+        """
+        Per-cluster relevance of a single term, the sum of log10(1 + tf) over the term's documents in each cluster,
+        read from the cluster statistics precomputed with the CSR arrays instead of walking the postings
+
+        Args:
+            term: Matched query term
+
+        Returns:
+            dict: cluster id --> score, in order of first occurrence in the postings
+        """
+        return self.get_csr_scorer().cluster_scores(term)
+
+    def get_relevant_clusters(self, query_terms: list, top_clusters=None, term_scores=None) -> list:
+        """
+        Identify relevant clusters, in O(query terms x clusters) from the precomputed cluster statistics
         
-        for term, qw in qvec.items():
-            # Check both regular dictionary and phrase dictionary
-            dict_to_use=self.dictionary if term in self.dictionary else self.phrase_dict
+        Args:
+            query_terms: Preprocessed query terms
+            top_clusters: Number of top clusters to consider, defaults to n_probe
+            term_scores: Optional cache of term_cluster_scores results shared across queries
             
-            if term in dict_to_use:
-                df, posting_list=dict_to_use[term]
-                for docID, tf in posting_list:
-                    if (docID in self.doc_clusters and self.doc_clusters[docID] not in relevant_clusters):
+        Returns:
+            list: List of relevant cluster via cluster ID
+        """
+        if not self.doc_clusters:
+            return list(range(self.n_clusters)) if self.n_clusters else []
+        
+        cluster_scores=defaultdict(float)
+        
+        for term in query_terms:
+            matched_term=self.fuzzy_matcher(term)
+            if term_scores is None:
+                scores=self.term_cluster_scores(matched_term)
+            else:
+                if matched_term not in term_scores:
+                    term_scores[matched_term]=self.term_cluster_scores(matched_term)
+                scores=term_scores[matched_term]
+            for cluster_id, score in scores.items():
+                cluster_scores[cluster_id]+=score
+        
+        sorted_clusters=sorted(cluster_scores.items(), key=lambda x: x[1], reverse=True)
+        relevant_clusters=[cluster_id for cluster_id, score in sorted_clusters[:top_clusters or self.n_probe]]
+
+        if not relevant_clusters:
+            relevant_clusters=list(range(self.n_clusters))
+        
+        if log_sampled():
+            logger.info(f"Selected clusters {relevant_clusters} for query processing")
+        return relevant_clusters
+
+    def get_csr_scorer(self)->CSRScorer:
+        """
+        Returns the CSR scoring backend, building it from the current postings if needed
+        """
+        if self.csr_scorer is None:
+            self.csr_scorer=CSRScorer([self.dictionary], self.doc_lengths, self.doc_clusters)
+        return self.csr_scorer
+
+    def get_similarity_index(self)->SimilarityIndex:
+        """
+        Returns the document rows and LSH index of similar, building them from the current CSR arrays if needed
+        """
+        scorer=self.get_csr_scorer()
+        index=self.similarity_index
+        if index is None or index.scorer is not scorer:
+            index=SimilarityIndex(scorer, self.lsh_tables, self.lsh_bits)
+            # term row --> feature column of cluster_centers, -1 for terms outside the clustering vocabulary
+            index.cluster_columns=np.array([self.cluster_vocab.get(term, -1) for term in index.row_terms], dtype=np.int64)
+            self.similarity_index=index
+        return index
+
+    def doc_id_of(self, name: str):
+        """
+        Args:
+            name: File name of a corpus document, or id of an ingested document
+
+        Returns:
+            int: Its document id, None if it is not indexed
+        """
+        entry=self.file_stats.get(name) or self.ingested_docs.get(name)
+        return entry.get("doc_id") if entry else None
+
+    def nearest_clusters(self, doc_id: int, n_probe: int):
+        """
+        Clusters whose centers are nearest to a document in the tf-idf space used for clustering.
+        The tf-idf vector is recovered from the normalized lnc weights and the document's vector length.
+
+        Args:
+            doc_id: Indexed document
+            n_probe: Number of clusters
+
+        Returns:
+            list: cluster ids by increasing distance, None if no clustering is available
+        """
+        if not self.cluster_centers or not self.cluster_vocab:
+            return None
+        index=self.get_similarity_index()
+        rows, weights=index.vector(doc_id)
+        columns=index.cluster_columns[rows]
+        known=columns >= 0
+        columns=columns[known]
+        values=weights[known] * self.doc_lengths.get(doc_id, 0) * np.asarray(self.cluster_idf)[columns]
+
+        X=SparseRows(np.array([0, len(columns)], dtype=np.int64), columns, values, (1, len(self.cluster_idf)))
+        centers=np.array([self.cluster_centers[i] for i in sorted(self.cluster_centers)])
+        return np.argsort(self.squared_distances(X, centers)[0], kind="stable")[:n_probe].tolist()
+
+    @reads_index
+    def similar(self, doc_id: int, k=10, method="exact", n_probe=None):
+        """
+        "More like this": the documents most similar to an indexed document, by cosine similarity of their lnc
+        document vectors. No query text is preprocessed or fuzzy matched.
+
+        Args:
+            doc_id: Document id of an indexed document, see doc_id_of
+            k: Number of results to return
+            method: "exact" scores every document sharing a term with it; "lsh" re-scores only the documents sharing
+                an LSH bucket with it and "cluster" the documents of the n_probe clusters with the nearest centers,
+                both approximate and for large corpora whose neighbours are close, check their recall against exact
+            n_probe: Number of clusters scored by the cluster method, defaults to the n_probe chosen at initialisation
+
+        Returns:
+            tuple: (list of (filename, similarity) pairs, elapsed_time), the document itself excluded
+        """
+        start_time=time.perf_counter()
+        if doc_id not in self.doc_index:
+            raise ValueError(f"Unknown document id: {doc_id}")
+
+        index=self.get_similarity_index()
+        if method=="lsh":
+            candidates=index.candidates(doc_id)
+            ranked=index.top_k(candidates, index.cosine(doc_id, candidates), k)
+        elif method=="cluster":
+            ranked=index.top_k(*index.exact_scores(doc_id, self.nearest_clusters(doc_id, n_probe or self.n_probe)), k)
+        elif method=="exact":
+            ranked=index.top_k(*index.exact_scores(doc_id), k)
+        else:
+            raise ValueError(f"Unknown similarity method: {method}")
+
+        elapsed=time.perf_counter() - start_time
+        SIMILAR_SECONDS.observe(elapsed, method)
+        if log_sampled():
+            logger.info(f"Found {len(ranked)} documents similar to {self.doc_index[doc_id]} with {method} in {elapsed:.6f} seconds")
+        return [(self.doc_index[docID], score) for docID, score in ranked], elapsed
+
+    def match_query_term(self, term: str):
+        """
+        Resolves a preprocessed query term against the index, applying fuzzy matching to unknown terms
+
+        Args:
+            term: Preprocessed query term
+
+        Returns:
+            tuple: (matched term, document frequency), or None if the term cannot be matched
+        """
+        #match regular terms
+        if term in self.dictionary:
+            df, _=self.dictionary[term]
+            return term, df
+
+        #Apply fuzzy matching and fallback soundex processing
+        matched_term=self.fuzzy_matcher(term)
+        if matched_term!=term and matched_term in self.dictionary:
+            df, _=self.dictionary[matched_term]
+            return matched_term, df
+        return None
+
+    def parse_phrases(self, qtext: str)->list:
+        """
+        Extracts phrase constraints from a query: "a b c" requires the terms to occur consecutively and in order,
+        "a b c"~N requires them to occur within N words of each other in any order.
+        Words are counted after stop word removal, as in the positional index.
+
+        Args:
+            qtext: Query text
+
+        Returns:
+            list: (preprocessed phrase terms, proximity or None for an exact phrase) per quoted phrase
+        """
+        phrases=[]
+        for match in PHRASE_PATTERN.finditer(qtext):
+            terms=self.preprocess(match.group(1))
+            if terms:
+                phrases.append((tuple(terms), int(match.group(2)) if match.group(2) else None))
+        return phrases
+
+    def phrase_docs(self, terms: tuple, slop=None)->set:
+        """
+        Finds the documents containing a phrase, by galloping intersection of the postings lists of its terms
+        followed by a positional check in each common document
+
+        Args:
+            terms: Preprocessed phrase terms, unknown terms are fuzzy matched as in scoring
+            slop: Maximum distance in words between the first and last term, None for an exact phrase
+
+        Returns:
+            set: Matching document ids
+        """
+        matches=[self.match_query_term(term) for term in terms]
+        if any(match is None for match in matches):
+            return set()
+        terms=[matched_term for matched_term, df in matches]
+        unique_terms=list(dict.fromkeys(terms))
+
+        docs=set()
+        posting_lists=[self.dictionary[term][1] for term in unique_terms]
+        term_positions=[self.positions[term] for term in unique_terms]
+        for docID, indexes in intersect_postings(posting_lists):
+            positions={term: decode_positions(term_positions[i][index]) for i, (term, index) in enumerate(zip(unique_terms, indexes))}
+            if slop is None:
+                found=contains_phrase([positions[term] for term in terms])
+            else:
+                found=within_window(list(positions.values()), slop)
+            if found:
+                docs.add(docID)
+        return docs
+
+    def phrase_filter(self, phrases: list):
+        """
+        Args:
+            phrases: Output of parse_phrases
+
+        Returns:
+            set: Document ids matching every phrase, or None if the query has no phrases
+        """
+        if not phrases:
+            return None
+        allowed=None
+        for terms, slop in phrases:
+            docs=self.phrase_docs(terms, slop)
+            allowed=docs if allowed is None else allowed & docs
+            if not allowed:
+                break
+        return allowed
+
+    def build_query_vector(self, qtf: Counter, matches=None)->dict:
+        """
+        Builds the normalized ltc query vector, applying fuzzy matching to unknown terms
+
+        Args:
+            qtf: term frequency Counter of the preprocessed query
+            matches: Optional cache of match_query_term results shared across queries
+
+        Returns:
+            dict: matched term --> normalized query weight
+        """
+        qvec={}
+
+        for term, tf in qtf.items():
+            if matches is None:
+                match=self.match_query_term(term)
+            else:
+                if term not in matches:
+                    matches[term]=self.match_query_term(term)
+                match=matches[term]
+            if match is None:
+                continue
+
+            matched_term, df=match
+            w=(1 + math.log10(tf)) * math.log10(self.N / df)
+            qvec[matched_term]=w
+
+        #normalize query vector as per provided requirements
+        norm=math.sqrt(sum(w * w for w in qvec.values()))
+        if norm>0:
+            for term in qvec:
+                qvec[term]/=norm
+        return qvec
+
+    def score_python(self, qvec: dict, relevant_clusters: list, allowed=None)->list:
+        """
+        Scores documents by walking the postings of the query terms in the relevant clusters only,
+        as laid out by cluster in the CSR arrays, whose weights are the normalized lnc weights (1 + log10(tf)) / length
+
+        Args:
+            qvec: matched term --> normalized query weight
+            relevant_clusters: cluster ids to restrict scoring to
+            allowed: Optional set of document ids to restrict scoring to, e.g. phrase matches
+
+        Returns:
+            list: (document id, score) pairs ranked by descending score, then ascending document id
+        """
+        scores=defaultdict(float)
+        scanned=0
+        
+        for term, qw in qvec.items():
+            for docs, weights in self.get_csr_scorer().segments(term, relevant_clusters):
+                scanned+=len(docs)
+                for docID, dw in zip(docs.tolist(), weights.tolist()):
+                    if allowed is not None and docID not in allowed:
                         continue
-                    
-                    dw=1 + math.log10(tf)
-                    if docID in self.doc_lengths and self.doc_lengths[docID] > 0:
-                        dw/=self.doc_lengths[docID]
-                        scores[docID]+=qw * dw
+                    scores[docID]+=qw * dw
+        POSTINGS_SCANNED.inc(scanned, "python")
 
+        sort_start=time.perf_counter()
         ranked=sorted(scores.items(), key=lambda x: (-x[1], x[0]))
-        end_time=time.perf_counter()
-        elapsed=end_time - start_time
+        _observe_phase(QUERY_PHASE_SECONDS, "sort", sort_start)
+        return ranked
+
+    def score_postings(self, qvec: dict, relevant_clusters: list, allowed=None)->list:
+        """
+        Reference scorer computing the normalized lnc weights (1 + log10(tf)) / length straight from the postings
+        lists, independently of the CSR arrays. Not used to answer queries, the python, numpy and maxscore backends
+        are checked against it.
+
+        Args:
+            qvec: matched term --> normalized query weight
+            relevant_clusters: cluster ids to restrict scoring to, None for all documents
+            allowed: Optional set of document ids to restrict scoring to, e.g. phrase matches
+
+        Returns:
+            list: (document id, score) pairs ranked by descending score, then ascending document id
+        """
+        scores=defaultdict(float)
+
+        for term, qw in qvec.items():
+            if term not in self.dictionary:
+                continue
+            df, posting_list=self.dictionary[term]
+            for docID, tf in posting_list:
+                if relevant_clusters is not None and docID in self.doc_clusters and self.doc_clusters[docID] not in relevant_clusters:
+                    continue
+                if allowed is not None and docID not in allowed:
+                    continue
+                if self.doc_lengths.get(docID, 0) > 0:
+                    scores[docID]+=qw * (1 + math.log10(tf)) / self.doc_lengths[docID]
+
+        return sorted(scores.items(), key=lambda x: (-x[1], x[0]))
+
+    def score_maxscore(self, qvec: dict, relevant_clusters: list, k: int, allowed=None)->list:
+        """
+        Top-k scoring with MaxScore dynamic pruning.
+        Query terms are ordered by their score upper bound; terms whose combined bounds cannot lift a document
+        above the current k-th best score become non-essential and are only probed for candidates that are
+        found in the essential postings lists. Ranking and scores are identical to score_python truncated to k.
+
+        Args:
+            qvec: matched term --> normalized query weight
+            relevant_clusters: cluster ids to restrict scoring to
+            k: number of results to return
+            allowed: Optional set of document ids to restrict scoring to, e.g. phrase matches
+
+        Returns:
+            list: top k (document id, score) pairs ranked by descending score, then ascending document id
+        """
+        query_terms=[]
+        for position, (term, qw) in enumerate(qvec.items()):
+            if term in self.dictionary:
+                df, posting_list=self.dictionary[term]
+                query_terms.append((qw * self.term_upper_bound(term), position, qw, posting_list))
+        query_terms.sort(key=lambda t: t[0])
+
+        n=len(query_terms)
+        bounds=[0.0] # bounds[i] = sum of upper bounds of the i lowest-bound terms
+        for upper_bound, _, _, _ in query_terms:
+            bounds.append(bounds[-1] + upper_bound)
+
+        cursors=[posting_list.cursor() for _, _, _, posting_list in query_terms]
+        heap=[] # min-heap of (score, -document id): the root is the current k-th best result
+        threshold=float("-inf")
+        first_essential=0
+        slack=1 - 1e-9 # guards the bound comparisons against floating point rounding
+        scanned=0
+
+        while True:
+            docID=min((cursors[i].doc for i in range(first_essential, n) if cursors[i].doc is not None), default=None)
+            if docID is None:
+                break
+
+            contributions={}
+            for i in range(first_essential, n):
+                if cursors[i].doc==docID:
+                    contributions[i]=cursors[i].tf
+                    cursors[i].next()
+            scanned+=len(contributions)
+
+            if docID in self.doc_clusters and self.doc_clusters[docID] not in relevant_clusters:
+                continue
+            if allowed is not None and docID not in allowed:
+                continue
+            doc_length=self.doc_lengths.get(docID, 0)
+            if doc_length <= 0:
+                continue
+
+            partial=sum(query_terms[i][2] * ((1 + math.log10(tf)) / doc_length) for i, tf in contributions.items())
+            pruned=False
+            for i in range(first_essential - 1, -1, -1):
+                if partial + bounds[i+1] < threshold * slack:
+                    pruned=True
+                    break
+                # skip data lets the cursor jump straight to the block that may hold docID
+                scanned+=1
+                if cursors[i].advance(docID)==docID:
+                    contributions[i]=cursors[i].tf
+                    partial+=query_terms[i][2] * ((1 + math.log10(contributions[i])) / doc_length)
+            if pruned:
+                continue
+
+            # exact score accumulated in query vector order, as in score_python
+            score=0.0
+            for i in sorted(contributions, key=lambda i: query_terms[i][1]):
+                dw=1 + math.log10(contributions[i])
+                dw/=doc_length
+                score+=query_terms[i][2] * dw
+
+            entry=(score, -docID)
+            if len(heap) < k:
+                heapq.heappush(heap, entry)
+            elif entry > heap[0]:
+                heapq.heapreplace(heap, entry)
+            else:
+                continue
+
+            if len(heap)==k:
+                threshold=heap[0][0]
+                while first_essential < n and bounds[first_essential+1] < threshold * slack:
+                    first_essential+=1
+
+        POSTINGS_SCANNED.inc(scanned, "maxscore")
+        return [(-neg_doc, score) for score, neg_doc in sorted(heap, reverse=True)]
+
+    def rank(self, qvec: dict, relevant_clusters: list, allowed, scoring: str, k: int)->list:
+        """
+        Scores documents with the chosen backend
+
+        Args:
+            qvec: matched term --> normalized query weight
+            relevant_clusters: cluster ids to restrict scoring to
+            allowed: Optional set of document ids to restrict scoring to
+            scoring: Scoring backend, "python", "numpy" or "maxscore"
+            k: Number of results needed; only maxscore stops early, the other backends rank every match
+
+        Returns:
+            list: (document id, score) pairs ranked by descending score, then ascending document id
+        """
+        if scoring=="numpy":
+            ranked, scanned=self.get_csr_scorer().score(qvec, relevant_clusters, allowed)
+            POSTINGS_SCANNED.inc(scanned, scoring)
+            return ranked
+        elif scoring=="python":
+            return self.score_python(qvec, relevant_clusters, allowed)
+        elif scoring=="maxscore":
+            return self.score_maxscore(qvec, relevant_clusters, k, allowed)
+        raise ValueError(f"Unknown scoring backend: {scoring}")
+
+    @reads_index
+    def term_statistics(self)->dict:
+        """
+        Returns:
+            dict: number of documents and term --> document frequency, aggregated by a sharded coordinator
+        """
+        return {"N": self.N, "terms": {term: self.dictionary[term][0] for term in self.dictionary}}
+
+    @reads_index
+    def search_shard(self, qvec: dict, phrases: list, k: int, scoring=None, n_probe=None)->list:
+        """
+        Scores this shard against a query vector weighted with global statistics by a sharded coordinator.
+        Query and phrase terms are already matched against the global vocabulary, so no fuzzy matching happens here.
+
+        Args:
+            qvec: matched term --> normalized query weight
+            phrases: (matched phrase terms, proximity or None) per phrase of the query
+            k: Number of results to return
+            scoring: Scoring backend, defaults to the backend chosen at initialisation
+            n_probe: Number of clusters to score, defaults to the n_probe chosen at initialisation
+
+        Returns:
+            list: top k (document id, file name, score) triples ranked by descending score, then ascending document id
+        """
+        local_terms=[term for term in qvec if term in self.dictionary]
+        relevant_clusters=self.get_relevant_clusters(local_terms, n_probe)
+
+        allowed=None
+        for terms, slop in phrases:
+            docs=self.phrase_docs(terms, slop) if all(term in self.dictionary for term in terms) else set()
+            allowed=docs if allowed is None else allowed & docs
+
+        ranked=self.rank(qvec, relevant_clusters, allowed, scoring or self.scoring, k)
+        return [(docID, self.doc_index[docID], score) for docID, score in ranked[:k]]
+
+    @reads_index
+    def query_batch(self, qtexts: list, k=10, n_probe=None)->tuple:
+        """
+        Processes many queries together. Query terms are preprocessed, matched and fuzzy corrected once per
+        distinct term across the batch, cluster statistics and postings are read once per term, and all queries
+        are scored in one pass over the CSR document matrix.
+
+        Args:
+            qtexts: Query texts
+            k: Number of results per query
+            n_probe: Number of clusters each query is scored against, defaults to the n_probe chosen at initialisation
+
+        Returns:
+            tuple: (list of per-query lists of (filename, score) pairs, list of per-query elapsed times, total elapsed time)
+        """
+        start_time=time.perf_counter()
+        generation=self.generation
+
+        matches={}
+        term_scores={}
+        results=[None] * len(qtexts)
+        query_times=[0.0] * len(qtexts)
+        misses=[] # (position in batch, cache key)
+        qvecs=[]
+        relevant_clusters=[]
+        allowed=[]
+
+        for i, qtext in enumerate(qtexts):
+            query_start=time.perf_counter()
+            qtf=Counter(self.preprocess(qtext))
+            phrases=self.parse_phrases(qtext)
+            # batches are always scored by the CSR backend
+            cache_key=(tuple(sorted(qtf.items())), tuple(phrases), k, n_probe or self.n_probe, "numpy")
+            cached=self.query_cache.get(generation, cache_key)
+            if cached is not None:
+                results[i]=list(cached)
+            else:
+                misses.append((i, cache_key))
+                qvecs.append(self.build_query_vector(qtf, matches))
+                relevant_clusters.append(self.get_relevant_clusters(list(qtf.keys()), n_probe, term_scores) if self.doc_clusters else None)
+                allowed.append(self.phrase_filter(phrases))
+            query_times[i]=time.perf_counter() - query_start
+
+        if misses:
+            scoring_start=time.perf_counter()
+            ranked=self.get_csr_scorer().score_batch(qvecs, relevant_clusters, k, allowed)
+            # the shared scoring pass is attributed evenly to the queries scored in it
+            shared=(time.perf_counter() - scoring_start) / len(misses)
+
+            for (i, cache_key), query_ranked in zip(misses, ranked):
+                query_results=[(self.doc_index[docID], score) for docID, score in query_ranked]
+                self.query_cache.put(generation, cache_key, query_results)
+                results[i]=list(query_results)
+                query_times[i]+=shared
+
+        elapsed=time.perf_counter() - start_time
+        QUERY_BATCH_SECONDS.observe(elapsed)
+        if log_sampled():
+            logger.info(f"Processed batch of {len(qtexts)} queries ({len(qtexts) - len(misses)} from cache) in {elapsed:.6f} seconds")
+        return results, query_times, elapsed
+
+    @reads_index
+    def query(self, qtext, scoring=None, k=10, n_probe=None):
+        """
+        Query processing with fuzzy matching, clustering, and phrase support
         
-        result_info=f"Processed enhanced query in {elapsed:.6f} seconds. Found {len(ranked)} matching documents"
-        result_info+=f" across {len(relevant_clusters)} clusters"
+        Args:
+            qtext: Query text, may contain "exact phrases" and "proximity terms"~N
+            scoring: Scoring backend, "python", "numpy" or "maxscore"; defaults to the backend chosen at initialisation
+            k: Number of results to return
+            n_probe: Number of clusters to score, defaults to the n_probe chosen at initialisation
         
-        logger.info(result_info)
+        Returns:
+            tuple: (list of (filename, score) pairs, elapsed_time)
+        """
+        start_time=time.perf_counter()
+        scoring=scoring or self.scoring
+
+        qtokens=self.preprocess(qtext)
+        qtf=Counter(qtokens)
+
+        phrases=self.parse_phrases(qtext)
+        phase_start=_observe_phase(QUERY_PHASE_SECONDS, "preprocess", start_time)
+
+        # results only depend on the stemmed term multiset, the phrase constraints, k, n_probe, the scoring backend
+        # and the index contents; backends are kept apart so they can be compared against each other
+        cache_key=(tuple(sorted(qtf.items())), tuple(phrases), k, n_probe or self.n_probe, scoring)
+        generation=self.generation
+        cached=self.query_cache.get(generation, cache_key)
+        if cached is not None:
+            elapsed=time.perf_counter() - start_time
+            QUERY_SECONDS.observe(elapsed, scoring, "hit")
+            if log_sampled():
+                logger.info(f"Served query from cache in {elapsed:.6f} seconds")
+            return list(cached), elapsed
+
+        # fuzzy matching of unknown terms happens here
+        qvec=self.build_query_vector(qtf)
+        phase_start=_observe_phase(QUERY_PHASE_SECONDS, "query_vector", phase_start)
+
+        relevant_clusters=self.get_relevant_clusters(list(qtf.keys()), n_probe)
+        phase_start=_observe_phase(QUERY_PHASE_SECONDS, "clusters", phase_start)
+        allowed=self.phrase_filter(phrases)
+        phase_start=_observe_phase(QUERY_PHASE_SECONDS, "phrases", phase_start)
+
+        ranked=self.rank(qvec, relevant_clusters, allowed, scoring, k)
+        _observe_phase(QUERY_PHASE_SECONDS, "scoring", phase_start)
+
+        end_time=time.perf_counter()
+        elapsed=end_time - start_time
+        QUERY_SECONDS.observe(elapsed, scoring, "miss")
         
-        return [(self.doc_index[docID], score) for docID, score in ranked[:10]], elapsed
\ No newline at end of file
+        if log_sampled():
+            result_info=f"Processed enhanced query in {elapsed:.6f} seconds. Found {len(ranked)} matching documents"
+            result_info+=f" across {len(relevant_clusters)} clusters"
+            
+            logger.info(result_info)
+
+        results=[(self.doc_index[docID], score) for docID, score in ranked[:k]]
+        self.query_cache.put(generation, cache_key, results)
+        return list(results), elapsed
+
+    @reads_index
+    def highlight_terms(self, qtext: str)->set:
+        """
+        Args:
+            qtext: Query text
+
+        Returns:
+            set: Dictionary terms the query's terms resolve to, after fuzzy matching, as highlighted in snippets
+        """
+        matches=map(self.match_query_term, set(self.preprocess(qtext)))
+        return {match[0] for match in matches if match is not None}
+
+    def snippet(self, doc_id: int, terms: set, n_words=SNIPPET_WORDS):
+        """
+        Passage of a document to show with a search result: the n_words words holding the most distinct terms, then
+        the most term occurrences, earliest first; the start of the document if no term occurs. Only the first
+        SNIPPET_SCAN_BYTES of the text are read from the document store, so its other blocks stay compressed.
+
+        Args:
+            doc_id: Document id
+            terms: Stemmed terms to highlight, see highlight_terms
+            n_words: Words of the passage
+
+        Returns:
+            dict: "text", the passage with whitespace collapsed and "..." where the document goes on, and "highlights",
+                [start, end) character offsets of the words matching a term; None if no text is stored for the document
+        """
+        text=self.doc_store.get(doc_id, SNIPPET_SCAN_BYTES)
+        if text is None:
+            return None
+        words=text.split()
+
+        hits=[] # (word index, term) of every occurrence of a term, in document order
+        normalize=self.normalize_token
+        for i, word in enumerate(words):
+            for token in word.lower().translate(PUNCTUATION_TABLE).split():
+                term=normalize(token)
+                if term in terms:
+                    hits.append((i, term))
+
+        # best window of hits spanning fewer than n_words words
+        start=0
+        best=(0, 0)
+        counts=Counter()
+        end_hit=0
+        for first_hit, (first_word, term) in enumerate(hits):
+            while end_hit < len(hits) and hits[end_hit][0] < first_word + n_words:
+                counts[hits[end_hit][1]]+=1
+                end_hit+=1
+            if (len(counts), end_hit - first_hit) > best:
+                best=(len(counts), end_hit - first_hit)
+                # the passage is centered on the hits of the window
+                span=hits[end_hit-1][0] - first_word + 1
+                start=max(0, min(first_word - (n_words - span) // 2, len(words) - n_words))
+            counts[term]-=1
+            if not counts[term]:
+                del counts[term]
+        end=min(len(words), start + n_words)
+
+        matched={i for i, _ in hits if start <= i < end}
+        pieces=["..."] if start > 0 else []
+        highlights=[]
+        offset=4 if start > 0 else 0
+        for i in range(start, end):
+            word=words[i]
+            if i in matched:
+                # punctuation around the word is not highlighted
+                lead=len(word) - len(word.lstrip(string.punctuation))
+                highlights.append([offset + lead, offset + len(word.rstrip(string.punctuation))])
+            pieces.append(word)
+            offset+=len(word) + 1
+        if end < len(words) or self.doc_store.length(doc_id) > SNIPPET_SCAN_BYTES:
+            pieces.append("...")
+        return {"text": " ".join(pieces), "highlights": highlights}
+
+    @reads_index
+    def snippets(self, names: list, terms: set)->list:
+        """
+        Args:
+            names: File names of corpus documents or ids of ingested documents, such as those query returns
+            terms: Stemmed terms to highlight, see highlight_terms
+
+        Returns:
+            list: snippet of each document, None for a document without stored text or not in this index
+        """
+        doc_ids=map(self.doc_id_of, names)
+        return [self.snippet(doc_id, terms) if doc_id is not None else None for doc_id in doc_ids]
+
+# Per-process state for parallel ingestion workers
+_worker_vsm=None
+
+def _init_ingest_worker(corpus_dir: str, ngram_range: tuple, cache_dir, cache_max_bytes: int, stem_cache_size: int)->None:
+    """
+    Initialises a VSM instance in each ingestion worker, used only for its preprocessing tools and extraction cache
+    """
+    global _worker_vsm
+    _worker_vsm=VSM(corpus_dir, ngram_range=ngram_range, cache_dir=cache_dir, cache_max_bytes=cache_max_bytes, stem_cache_size=stem_cache_size)
+
+def _index_chunk(files: list)->tuple:
+    """
+    Runs VSM.index_chunk inside a worker process
+
+    Returns:
+        tuple: (index_chunk result, metrics recorded for the chunk)
+    """
+    return _worker_vsm.index_chunk(files), metrics.REGISTRY.drain()
+
+def _index_documents(documents: list)->tuple:
+    """
+    Runs VSM.index_documents inside a worker process
+
+    Returns:
+        tuple: (index_documents result, metrics recorded for the chunk)
+    """
+    return _worker_vsm.index_documents(documents), metrics.REGISTRY.drain()
@@ -0,0 +1,42 @@
+import pytest
+from src.vsm_basic import VSM
+
+WORDS=["alpha", "bravo", "charlie", "delta", "echo", "foxtrot", "golf", "hotel", "india", "juliet", "kilo", "lima"]
+
+def document_text(i: int)->str:
+    """
+    Returns:
+        str: Text of the i-th synthetic document, documents differ in length and term mix so clusters and rankings are not trivial
+    """
+    return " ".join(WORDS[(i * 7 + j * j) % len(WORDS)] for j in range(8 + i % 11))
+
+@pytest.fixture
+def words()->list:
+    return WORDS
+
+@pytest.fixture
+def write_corpus(tmp_path):
+    """
+    Writes synthetic documents {prefix}{i:02d}.txt for i in offset .. offset + n_docs - 1, followed by the
+    file name --> text pairs of docs, into tmp_path by default
+    """
+    def write(n_docs: int, corpus_dir=None, offset=0, prefix="d", extra="", docs=None):
+        corpus_dir=corpus_dir or tmp_path
+        corpus_dir.mkdir(parents=True, exist_ok=True)
+        for i in range(offset, offset + n_docs):
+            (corpus_dir / f"{prefix}{i:02d}.txt").write_text(f"{document_text(i)} {extra}".strip())
+        for name, text in (docs or {}).items():
+            (corpus_dir / name).write_text(text)
+        return corpus_dir
+    return write
+
+@pytest.fixture
+def build_vsm(write_corpus):
+    """
+    Writes a synthetic corpus of n_docs documents and builds a VSM over it with the given keyword arguments
+    """
+    def build(n_docs: int, corpus_dir=None, offset=0, docs=None, **kwargs)->VSM:
+        vsm=VSM(str(write_corpus(n_docs, corpus_dir, offset, docs=docs)), **kwargs)
+        vsm.build_index()
+        return vsm
+    return build
@@ -0,0 +1,50 @@
+import json
+from fastapi.testclient import TestClient
+from api.app import app, registry
+from src.vsm_basic import VSM
+from src.sharded_vsm import ShardedVSM
+
+client=TestClient(app)
+
+def ndjson(prefix: str, n: int)->bytes:
+    return b"\n".join(json.dumps({"id": f"{prefix}{i}", "text": f"vector space model {prefix} {i}"}).encode("utf-8") for i in range(n))
+
+def test_ingestion_into_one_index_does_not_block_another():
+    with registry.in_use("busy-index") as entry:
+        entry.ingest_lock.acquire()
+        try:
+            refused=client.post("/documents", params={"index": "busy-index"}, content=ndjson("a", 2))
+            accepted=client.post("/documents", params={"index": "other-index"}, content=ndjson("b", 3))
+        finally:
+            entry.ingest_lock.release()
+
+    assert refused.status_code==429
+    assert accepted.status_code==200
+    assert accepted.json()["added"]==3
+    assert registry.remove("other-index")
+
+def test_reading_an_unknown_index_is_404():
+    for path, params in [
+        ("/search", {"query": "vector"}),
+        ("/similar", {"doc": "a0"}),
+        ("/search/cache", {}),
+    ]:
+        response=client.get(path, params={**params, "index": "missing-index"})
+        assert response.status_code==404, path
+        assert "missing-index" in response.json()["detail"]
+
+def test_similar_reports_unsupported_and_invalid_requests_as_errors():
+    registry.put("sharded-index", ShardedVSM(shard_urls=["http://127.0.0.1:9"]), pinned=True)
+    engine=VSM(corpus_dir="", n_clusters=1, lsh_bits=65)
+    engine.ingest_documents([(f"doc{i}", f"vector space model {i}") for i in range(3)])
+    registry.put("invalid-index", engine)
+    try:
+        sharded=client.get("/similar", params={"doc": "doc0", "index": "sharded-index"})
+        invalid=client.get("/similar", params={"doc": "doc0", "method": "lsh", "index": "invalid-index"})
+    finally:
+        registry.remove("sharded-index")
+        registry.remove("invalid-index")
+
+    assert sharded.status_code==501
+    assert invalid.status_code==400
+    assert "n_bits" in invalid.json()["detail"]
@@ -0,0 +1,51 @@
+import numpy as np
+from collections import Counter
+
+QUERIES=["alpha bravo", "charlie golf lima", "delta", "echo kilo kilo foxtrot", "hotel india"]
+
+def test_batch_matches_single_queries_with_pruning(build_vsm):
+    vsm=build_vsm(40, n_clusters=4, n_probe=1, query_cache_size=0)
+    for n_probe in (1, 2, 4):
+        batch, _, _=vsm.query_batch(QUERIES, k=40, n_probe=n_probe)
+        for query, results in zip(QUERIES, batch):
+            expected, _=vsm.query(query, scoring="numpy", k=40, n_probe=n_probe)
+            assert [name for name, _ in results]==[name for name, _ in expected]
+            assert np.allclose([score for _, score in results], [score for _, score in expected])
+
+class RecordingArray(np.ndarray):
+    """
+    Records the slices read from it
+    """
+    reads=[]
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            RecordingArray.reads.append((int(key.start), int(key.stop)))
+        return np.asarray(self)[key]
+
+def test_batch_never_reads_unprobed_clusters(build_vsm):
+    vsm=build_vsm(40, n_clusters=4, n_probe=1, query_cache_size=0)
+    scorer=vsm.get_csr_scorer()
+    qvecs=[vsm.build_query_vector(Counter(vsm.preprocess(query))) for query in QUERIES]
+    probed=[[q % 2] for q in range(len(QUERIES))]
+    expected=scorer.score_batch(qvecs, probed, k=40)
+
+    scorer.data=scorer.data.view(RecordingArray)
+    RecordingArray.reads.clear()
+    assert scorer.score_batch(qvecs, probed, k=40)==expected
+
+    # every slice lies within a group of cluster 0, cluster 1 or the documents without a cluster
+    allowed=[(scorer.group_ptr[row, g], scorer.group_ptr[row, g+1]) for row in range(len(scorer.group_ptr)) for g in (0, 1, scorer.n_clusters)]
+    assert RecordingArray.reads
+    for start, stop in RecordingArray.reads:
+        assert any(lo <= start and stop <= hi for lo, hi in allowed)
+
+def test_score_counts_postings_of_probed_clusters(build_vsm):
+    vsm=build_vsm(40, n_clusters=4, n_probe=1, query_cache_size=0)
+    scorer=vsm.get_csr_scorer()
+    qvec=vsm.build_query_vector(Counter(vsm.preprocess("alpha bravo charlie")))
+
+    for clusters in ([0], [1, 2], None):
+        _, scanned=scorer.score(qvec, clusters)
+        assert scanned==sum(len(docs) for term in qvec for docs, _ in scorer.segments(term, clusters))
+    assert scorer.score(qvec, [0])[1] < scorer.score(qvec, None)[1]
@@ -0,0 +1,73 @@
+import time
+import threading
+from collections import Counter
+from src.vsm_basic import VSM
+
+class SlowIdVSM(VSM):
+    """
+    Pauses whenever next_doc_id is read, so callers that are not serialized interleave between reading and bumping it
+    """
+    @property
+    def next_doc_id(self)->int:
+        value=self._next_doc_id
+        time.sleep(0.001)
+        return value
+
+    @next_doc_id.setter
+    def next_doc_id(self, value: int)->None:
+        self._next_doc_id=value
+
+def run_together(*calls)->None:
+    """
+    Runs the calls in threads released at the same moment, re-raising the first failure
+    """
+    barrier=threading.Barrier(len(calls))
+    errors=[]
+
+    def run(call):
+        barrier.wait()
+        try:
+            call()
+        except Exception as e:
+            errors.append(e)
+
+    threads=[threading.Thread(target=run, args=(call,)) for call in calls]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+
+def assert_consistent(vsm: VSM)->None:
+    names=Counter(vsm.doc_index.values())
+    assert [name for name, count in names.items() if count > 1]==[]
+    assert vsm.N==len(vsm.doc_index)
+    ids=[stats["doc_id"] for stats in list(vsm.file_stats.values()) + list(vsm.ingested_docs.values())]
+    assert len(ids)==len(set(ids))
+
+def test_concurrent_updates_index_new_files_once(tmp_path, write_corpus):
+    write_corpus(41)
+    vsm=VSM(str(tmp_path), n_clusters=2)
+    vsm.build_index()
+    write_corpus(5, prefix="n", extra="quokka")
+
+    run_together(vsm.update_index, vsm.update_index)
+
+    assert_consistent(vsm)
+    assert vsm.N==46
+    assert vsm.dictionary["quokka"][0]==5
+
+def test_ingestion_during_update_assigns_distinct_ids(tmp_path, write_corpus, words):
+    write_corpus(20)
+    vsm=SlowIdVSM(str(tmp_path), n_clusters=2)
+    vsm.build_index()
+    write_corpus(20, prefix="n", extra="quokka")
+    documents=[(f"ext{i}", f"{' '.join(words)} wombat") for i in range(20)]
+
+    run_together(vsm.update_index, lambda: vsm.ingest_documents(documents))
+
+    assert_consistent(vsm)
+    assert vsm.N==60
+    assert vsm.dictionary["quokka"][0]==20
+    assert vsm.dictionary["wombat"][0]==20
@@ -0,0 +1,47 @@
+import random
+from utils.document_store import DocumentStore
+
+def random_texts(rng, n: int)->dict:
+    words=["vector", "space", "modèle", "检索", "retrieval", "cosine", "ranking"]
+    return {doc_id: " ".join(rng.choice(words) for _ in range(rng.randint(0, 400))) for doc_id in rng.sample(range(1, 3 * n), n)}
+
+def test_round_trip_across_blocks_save_and_open(tmp_path):
+    rng=random.Random(11)
+    texts=random_texts(rng, 60)
+    store=DocumentStore(block_bytes=1024, cache_bytes=4096)
+    for doc_id, text in texts.items():
+        store.add(doc_id, text)
+    assert all(store.get(doc_id)==text for doc_id, text in texts.items())
+
+    settings=store.save(str(tmp_path))
+    reopened=DocumentStore.open(str(tmp_path), settings, cache_bytes=4096)
+    assert all(reopened.get(doc_id)==text for doc_id, text in texts.items())
+    assert reopened.get(0) is None
+
+    # documents added after opening are appended to the partly filled last block
+    more=random_texts(random.Random(12), 10)
+    more={doc_id + 1000: text for doc_id, text in more.items()}
+    for doc_id, text in more.items():
+        reopened.add(doc_id, text)
+    assert all(reopened.get(doc_id)==text for doc_id, text in {**texts, **more}.items())
+
+def test_removed_documents_are_dropped_and_compacted_on_save(tmp_path):
+    rng=random.Random(13)
+    texts=random_texts(rng, 40)
+    store=DocumentStore(block_bytes=512)
+    for doc_id, text in texts.items():
+        store.add(doc_id, text)
+    removed=list(texts)[:30]
+    for doc_id in removed:
+        store.remove(doc_id)
+
+    settings=store.save(str(tmp_path))
+    reopened=DocumentStore.open(str(tmp_path), settings)
+    assert all(reopened.get(doc_id) is None for doc_id in removed)
+    assert all(reopened.get(doc_id)==texts[doc_id] for doc_id in list(texts)[30:])
+    assert reopened.stats()["stored_bytes"]==reopened.live_bytes()
+
+def test_get_truncates_to_max_bytes_without_splitting_characters():
+    store=DocumentStore()
+    store.add(1, "é" * 10)
+    assert store.get(1, max_bytes=5)=="éé"
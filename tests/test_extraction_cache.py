@@ -0,0 +1,26 @@
+from utils.extraction_cache import ExtractionCache
+
+def test_put_keeps_running_total(tmp_path):
+    cache=ExtractionCache(str(tmp_path))
+    cache.put_text("a", "alpha " * 100)
+    cache.put_text("b", "bravo " * 100)
+    cache.put_text("a", "alpha")
+
+    stats=cache.stats()
+    assert stats["entries"]==2
+    assert stats["bytes"]==ExtractionCache(str(tmp_path)).stats()["bytes"]
+    assert cache.get_text("a")=="alpha"
+
+def test_evicts_least_recently_read_entries(tmp_path):
+    cache=ExtractionCache(str(tmp_path))
+    for key in "abc":
+        cache.put_text(key, key * 1000)
+    entry_bytes=cache.stats()["bytes"] // 3
+    cache.max_bytes=entry_bytes * 3
+    assert cache.get_text("a")=="a" * 1000
+
+    cache.put_text("d", "d" * 1000)
+
+    assert cache.get_text("b") is None
+    assert cache.get_text("a")=="a" * 1000
+    assert cache.stats()["bytes"]<=cache.max_bytes
@@ -0,0 +1,22 @@
+from src.vsm_basic import VSM
+
+def write_corpus(corpus_dir)->None:
+    for i in range(6):
+        (corpus_dir / f"d{i}.txt").write_text(f"vector space retrieval document {i}")
+    (corpus_dir / "broken.pdf").write_bytes(b"%PDF-1.4 not really a pdf")
+
+def test_corrupt_pdf_is_skipped_in_serial_build(tmp_path):
+    write_corpus(tmp_path)
+    vsm=VSM(str(tmp_path), n_clusters=2)
+    vsm.build_index()
+
+    assert sorted(vsm.doc_index.values())==[f"d{i}.txt" for i in range(6)]
+
+def test_corrupt_pdf_is_skipped_in_parallel_build(tmp_path):
+    write_corpus(tmp_path)
+    vsm=VSM(str(tmp_path), n_clusters=2, n_workers=2)
+    vsm.build_index()
+
+    assert sorted(vsm.doc_index.values())==[f"d{i}.txt" for i in range(6)]
+    # the file is fingerprinted, so updates retry it only once it changes
+    assert vsm.update_index()["added"]==[]
@@ -0,0 +1,31 @@
+import random
+import string
+import jellyfish
+from utils.fuzzy_index import FuzzyTermIndex
+
+def random_terms(rng, n: int)->list:
+    return sorted({"".join(rng.choice(string.ascii_lowercase[:8]) for _ in range(rng.randint(1, 9))) for _ in range(n)})
+
+def linear_scan(terms: list, term: str, threshold: float)->list:
+    return [t for t in terms if jellyfish.jaro_winkler_similarity(term, t)>=threshold]
+
+def test_candidates_contain_every_linear_scan_match():
+    rng=random.Random(7)
+    terms=random_terms(rng, 2000)
+    index=FuzzyTermIndex(terms)
+
+    for query in random_terms(rng, 200):
+        for threshold in (0.7, 0.8, 0.9):
+            candidates=index.candidates(query, threshold)
+            matches=[t for t in candidates if jellyfish.jaro_winkler_similarity(query, t)>=threshold]
+            assert matches==linear_scan(terms, query, threshold)
+
+def test_removed_terms_are_not_candidates():
+    terms=["retrieval", "retrieve", "retriever", "vector", "vectors"]
+    index=FuzzyTermIndex(terms)
+    index.remove("retrieve")
+    index.remove("vectors")
+    index.remove("vector")
+
+    assert index.candidates("retreival", 0.8)==["retrieval", "retriever"]
+    assert index.candidates("vectr", 0.8)==[]
@@ -0,0 +1,36 @@
+import os
+from src.vsm_basic import VSM
+
+def term_frequencies(vsm: VSM)->dict:
+    """
+    Returns:
+        dict: term --> {file name: term frequency}, independent of the document ids assigned
+    """
+    return {term: {vsm.doc_index[docID]: tf for docID, tf in postings} for term, (_, postings) in vsm.dictionary.items()}
+
+def test_update_matches_full_rebuild(tmp_path, write_corpus, build_vsm):
+    corpus=tmp_path / "corpus"
+    vsm=build_vsm(12, corpus, n_clusters=2, n_probe=2)
+
+    write_corpus(1, corpus, offset=3, prefix="n", extra="quokka")
+    write_corpus(1, corpus, offset=7, prefix="n", extra="quokka wombat")
+    write_corpus(1, corpus, offset=2, extra="wombat")
+    stat=os.stat(corpus / "d02.txt")
+    os.utime(corpus / "d02.txt", (stat.st_atime, stat.st_mtime + 10))
+    os.remove(corpus / "d04.txt")
+    changes=vsm.update_index()
+
+    assert sorted(changes["added"])==["n03.txt", "n07.txt"]
+    assert changes["modified"]==["d02.txt"]
+    assert changes["deleted"]==["d04.txt"]
+
+    rebuilt=VSM(str(corpus), n_clusters=2, n_probe=2)
+    rebuilt.build_index()
+
+    assert vsm.N==rebuilt.N==13
+    assert term_frequencies(vsm)==term_frequencies(rebuilt)
+    for query in ["alpha quokka", "wombat delta", "\"bravo charlie\""]:
+        results, _=vsm.query(query, k=20)
+        expected, _=rebuilt.query(query, k=20)
+        # ties are broken by document id, which differ between the two indexes
+        assert {name: round(score, 9) for name, score in results}=={name: round(score, 9) for name, score in expected}
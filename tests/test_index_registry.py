@@ -0,0 +1,38 @@
+from api.index_registry import IndexRegistry
+from src.vsm_basic import VSM
+
+def test_least_recently_used_index_is_evicted_and_reloaded(tmp_path, build_vsm):
+    first=build_vsm(8, tmp_path / "a", offset=0, n_clusters=2)
+    second=build_vsm(8, tmp_path / "b", offset=3, n_clusters=2)
+    expected, _=first.query("alpha bravo")
+    budget=max(first.memory_usage()["total"], second.memory_usage()["total"]) * 3 // 2
+    registry=IndexRegistry(VSM.load, memory_budget=budget, index_root=str(tmp_path / "indexes"))
+
+    registry.put("a", first)
+    registry.put("b", second)
+    assert registry.peek("a") is None
+    assert registry.peek("b") is second
+    assert registry.resident_bytes() <= budget
+
+    reloaded=registry.get("a")
+    assert reloaded is not first
+    results, _=reloaded.query("alpha bravo")
+    assert results==expected
+
+    stats=registry.stats()["indexes"]
+    assert (stats["a"]["evictions"], stats["a"]["loads"], stats["a"]["misses"])==(1, 1, 1)
+    assert registry.resident_bytes() <= budget
+
+def test_busy_and_pinned_indexes_are_not_evicted(tmp_path, build_vsm):
+    first=build_vsm(8, tmp_path / "a", offset=0, n_clusters=2)
+    second=build_vsm(8, tmp_path / "b", offset=3, n_clusters=2)
+    third=build_vsm(8, tmp_path / "c", offset=5, n_clusters=2)
+    registry=IndexRegistry(VSM.load, memory_budget=1)
+
+    registry.put("a", first, pinned=True)
+    with registry.in_use("b"):
+        registry.put("b", second)
+        registry.put("c", third)
+        assert registry.peek("a") is first
+        assert registry.peek("b") is second
+    assert registry.peek("c") is third
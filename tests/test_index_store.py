@@ -0,0 +1,41 @@
+import json
+import pytest
+from src.vsm_basic import VSM
+from utils.index_store import INDEX_FORMAT_VERSION
+
+QUERIES=["alpha bravo", "charlie golf", "\"delta echo\"", "hotl"]
+
+def test_loaded_index_answers_like_the_saved_one(tmp_path, build_vsm):
+    vsm=build_vsm(16, tmp_path / "corpus", n_clusters=2)
+    vsm.save(str(tmp_path / "index"))
+    loaded=VSM.load(str(tmp_path / "index"))
+
+    assert loaded.doc_index==vsm.doc_index
+    assert loaded.N==vsm.N
+    for scoring in ("python", "numpy", "maxscore"):
+        for query in QUERIES:
+            assert loaded.query(query, scoring=scoring)[0]==vsm.query(query, scoring=scoring)[0]
+    assert all(loaded.doc_store.get(docID)==vsm.doc_store.get(docID) for docID in vsm.doc_index)
+
+def test_loaded_index_can_be_updated_and_saved_again(tmp_path, build_vsm):
+    corpus=tmp_path / "corpus"
+    build_vsm(16, corpus, n_clusters=2).save(str(tmp_path / "index"))
+    loaded=VSM.load(str(tmp_path / "index"))
+    (corpus / "new.txt").write_text("alpha quokka")
+
+    assert loaded.update_index()["added"]==["new.txt"]
+    loaded.save(str(tmp_path / "index"))
+    reloaded=VSM.load(str(tmp_path / "index"))
+    assert [name for name, _ in reloaded.query("quokka")[0]]==["new.txt"]
+
+def test_other_format_version_is_rejected(tmp_path, build_vsm):
+    corpus=tmp_path / "corpus"
+    build_vsm(16, corpus, n_clusters=2).save(str(tmp_path / "index"))
+    meta_path=tmp_path / "index" / "meta.json"
+    meta=json.loads(meta_path.read_text())
+    assert meta["format_version"]==INDEX_FORMAT_VERSION==5
+
+    meta["format_version"]=4
+    meta_path.write_text(json.dumps(meta))
+    with pytest.raises(ValueError, match="Unsupported index format version 4"):
+        VSM.load(str(tmp_path / "index"))
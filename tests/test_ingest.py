@@ -0,0 +1,41 @@
+import json
+import base64
+import asyncio
+import pytest
+from api.ingest import parse_document_line, ingest_stream
+from src.vsm_basic import VSM
+
+def test_parse_document_line_reports_line_number():
+    for line, message in [
+        (b"{not json", "Line 7 is not valid JSON"),
+        (b"[1, 2]", "Line 7 has no document id"),
+        (b'{"id": "", "text": "x"}', "Line 7 has no document id"),
+        (b'{"id": "a.pdf", "content": "not base64!"}', "Line 7 has invalid base64 content"),
+        (b'{"id": "a.txt"}', "Line 7 has neither text nor content"),
+    ]:
+        with pytest.raises(ValueError, match=message):
+            parse_document_line(line, 7)
+
+def test_parse_document_line_decodes_text_and_content():
+    document=parse_document_line(b'{"id": "a", "text": "vector space"}', 1)
+    assert (document.name, document.data, document.file_type)==("a", "vector space", None)
+
+    content=base64.b64encode(b"raw bytes").decode("ascii")
+    document=parse_document_line(json.dumps({"id": "b", "content": content, "file_type": "txt"}).encode("utf-8"), 2)
+    assert (document.name, document.data, document.file_type)==("b", b"raw bytes", "txt")
+
+async def body(chunks):
+    for chunk in chunks:
+        yield chunk
+
+def test_invalid_line_stops_stream_after_indexing_earlier_documents():
+    lines=[json.dumps({"id": f"doc{i}", "text": f"vector space model retrieval {i}"}).encode("utf-8") for i in range(2)]
+    lines+=[b"{broken", json.dumps({"id": "doc3", "text": "never indexed"}).encode("utf-8")]
+    data=b"\n".join(lines) + b"\n"
+    vsm=VSM(corpus_dir="", n_clusters=1)
+
+    # body chunks split lines, as a chunked request body does
+    with pytest.raises(ValueError, match="Line 3 is not valid JSON"):
+        asyncio.run(ingest_stream(body([data[i:i+7] for i in range(0, len(data), 7)]), vsm))
+
+    assert sorted(vsm.doc_index.values())==["doc0", "doc1"]
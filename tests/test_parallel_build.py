@@ -0,0 +1,38 @@
+from src import vsm_basic
+from src.vsm_basic import VSM
+
+def postings_by_name(vsm: VSM)->dict:
+    return {term: [(vsm.doc_index[docID], tf) for docID, tf in postings] for term, (_, postings) in vsm.dictionary.items()}
+
+def test_parallel_build_matches_serial_build(tmp_path, write_corpus):
+    write_corpus(40)
+    serial=VSM(str(tmp_path), n_clusters=3)
+    serial.build_index()
+    parallel=VSM(str(tmp_path), n_clusters=3, n_workers=3)
+    parallel.build_index()
+
+    assert parallel.doc_index==serial.doc_index
+    assert postings_by_name(parallel)==postings_by_name(serial)
+    assert parallel.doc_lengths==serial.doc_lengths
+    assert parallel.doc_clusters==serial.doc_clusters
+    assert parallel.query("alpha golf")[0]==serial.query("alpha golf")[0]
+
+def test_workers_use_the_configured_stem_cache_size(tmp_path, write_corpus, monkeypatch):
+    write_corpus(8)
+    pools=[]
+
+    class RecordingPool(vsm_basic.ProcessPoolExecutor):
+        def __init__(self, **kwargs):
+            pools.append(kwargs)
+            super().__init__(**kwargs)
+
+    monkeypatch.setattr(vsm_basic, "ProcessPoolExecutor", RecordingPool)
+    monkeypatch.setattr(vsm_basic, "_worker_vsm", None)
+    vsm=VSM(str(tmp_path), n_clusters=2, n_workers=2, stem_cache_size=5)
+    vsm.build_index()
+    vsm.ingest_documents([(f"ext{i}", f"quokka wombat {i}") for i in range(4)])
+
+    assert len(pools)==2
+    for kwargs in pools:
+        kwargs["initializer"](*kwargs["initargs"])
+        assert vsm_basic._worker_vsm.normalize_token.cache_info().maxsize==5
@@ -0,0 +1,30 @@
+DOCS={
+    "exact.txt": "the vector space model ranks documents by cosine similarity",
+    "reversed.txt": "a space vector is not a model of ranking",
+    "apart.txt": "vector quantities live in a metric space and a model can use them",
+    "unrelated.txt": "boolean retrieval answers queries with set operations",
+}
+
+def names(results)->set:
+    return {name for name, _ in results}
+
+def test_exact_phrase_requires_consecutive_terms_in_order(build_vsm):
+    vsm=build_vsm(0, docs=DOCS, n_clusters=2, n_probe=2)
+    results, _=vsm.query("\"vector space model\"")
+    assert names(results)=={"exact.txt"}
+
+    results, _=vsm.query("\"space vector\" ranking")
+    assert names(results)=={"reversed.txt"}
+
+def test_proximity_matches_terms_within_window_in_any_order(build_vsm):
+    vsm=build_vsm(0, docs=DOCS, n_clusters=2, n_probe=2)
+    results, _=vsm.query("\"model vector\"~2")
+    assert names(results)=={"exact.txt", "reversed.txt"}
+
+    results, _=vsm.query("\"vector model\"~5")
+    assert names(results)=={"exact.txt", "reversed.txt", "apart.txt"}
+
+def test_phrase_with_unknown_term_matches_nothing(build_vsm):
+    vsm=build_vsm(0, docs=DOCS, n_clusters=2, n_probe=2)
+    results, _=vsm.query("\"vector xylophone\"")
+    assert results==[]
@@ -0,0 +1,44 @@
+import random
+import numpy as np
+from utils.postings import BLOCK_SIZE, PostingsList, varbyte_encode, varbyte_decode
+
+def random_postings(rng, n: int)->list:
+    doc_ids=sorted(rng.sample(range(1, 50 * n + 2), n))
+    return [(docID, rng.choice([1, 2, 3, 200, 70000])) for docID in doc_ids]
+
+def test_varbyte_round_trip():
+    values=np.array([0, 1, 127, 128, 16383, 16384, 2**21, 2**28 - 1, 2**28, 2**32 - 1], dtype=np.int64)
+    assert varbyte_decode(varbyte_encode(values)).tolist()==values.tolist()
+    assert varbyte_decode(b"").tolist()==[]
+
+def test_postings_round_trip_across_blocks():
+    rng=random.Random(3)
+    for encoding in ("raw", "varbyte"):
+        for n in (1, BLOCK_SIZE - 1, BLOCK_SIZE, BLOCK_SIZE + 1, 5 * BLOCK_SIZE + 17):
+            pairs=random_postings(rng, n)
+            postings=PostingsList.from_pairs(pairs, encoding)
+            assert len(postings)==n
+            assert list(postings)==pairs
+
+            cursor=postings.cursor()
+            walked=[]
+            while cursor.doc is not None:
+                walked.append((cursor.doc, cursor.tf))
+                cursor.next()
+            assert walked==pairs
+
+def test_cursor_advance_skips_to_first_posting_at_or_after_target():
+    rng=random.Random(5)
+    for encoding in ("raw", "varbyte"):
+        pairs=random_postings(rng, 4 * BLOCK_SIZE + 9)
+        doc_ids=[docID for docID, _ in pairs]
+        postings=PostingsList.from_pairs(pairs, encoding)
+
+        cursor=postings.cursor()
+        for target in sorted(rng.sample(range(doc_ids[-1] + 10), 60)):
+            expected=next((i for i, docID in enumerate(doc_ids) if docID >= max(target, cursor.doc or 0)), None)
+            doc=cursor.advance(target)
+            if expected is None:
+                assert doc is None
+                break
+            assert (doc, cursor.tf, cursor.index)==(doc_ids[expected], pairs[expected][1], expected)
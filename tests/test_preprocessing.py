@@ -0,0 +1,32 @@
+import string
+from src.vsm_basic import VSM, PREPROCESS_CHUNK_SIZE
+
+TEXT="The Vector-Space models, ranked 42 documents; retrieval   of RANKING\nmodels and\tranked\ndocuments! "
+
+def baseline_preprocess(vsm: VSM, text: str)->list:
+    # the pipeline preprocess replaced, with the punctuation table and stems recomputed for every call
+    text=text.lower().replace("-", " ").replace("_", " ")
+    tokens=text.translate(str.maketrans("", "", string.punctuation)).split()
+    return [vsm.stemmer.stem(t) for t in tokens if t not in vsm.stop_words and not t.isdigit()]
+
+def test_preprocess_matches_baseline_pipeline():
+    vsm=VSM("", stem_cache_size=8)
+    texts=[TEXT, "e-mail_address isn't (U.S.A.) 3rd\r\n\x0bdon't 2024 -- __init__", TEXT * (PREPROCESS_CHUNK_SIZE // len(TEXT) + 2)]
+    for text in texts:
+        assert vsm.preprocess(text)==baseline_preprocess(vsm, text)
+
+def test_chunked_tokens_match_whole_text_tokens():
+    vsm=VSM("")
+    text=TEXT * 50
+    expected=vsm._tokenize(text)
+    assert expected[:6]==["vector", "space", "model", "rank", "document", "retriev"]
+    for chunk_size in (1, 3, 7, 64, len(text) + 1):
+        assert list(vsm.iter_tokens(text, chunk_size))==expected
+    assert list(vsm.iter_tokens(iter([text[:10], text[10:25], text[25:]])))==expected
+
+def test_stem_cache_is_bounded():
+    vsm=VSM("", stem_cache_size=4)
+    vsm.preprocess(TEXT)
+    assert vsm.preprocess(TEXT)==vsm._tokenize(TEXT)
+    info=vsm.normalize_token.cache_info()
+    assert info.currsize==4 and info.maxsize==4
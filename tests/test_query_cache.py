@@ -0,0 +1,20 @@
+def test_switched_backend_is_not_served_cached_results(build_vsm, monkeypatch):
+    vsm=build_vsm(12, n_clusters=2)
+    vsm.query("alpha bravo", scoring="python")
+    doc_id=min(vsm.doc_index)
+    marker=[(doc_id, 42.0)]
+    monkeypatch.setattr(vsm, "score_maxscore", lambda *args, **kwargs: marker)
+    monkeypatch.setattr(vsm.get_csr_scorer(), "score", lambda *args, **kwargs: (marker, 1))
+
+    for scoring in ("numpy", "maxscore"):
+        results, _=vsm.query("alpha bravo", scoring=scoring)
+        assert results==[(vsm.doc_index[doc_id], 42.0)]
+    assert vsm.query_cache.stats()["hits"]==0
+
+def test_repeated_query_on_same_backend_is_cached(build_vsm):
+    vsm=build_vsm(12, n_clusters=2)
+    first, _=vsm.query("alpha bravo", scoring="numpy")
+    second, _=vsm.query("alpha bravo", scoring="numpy")
+
+    assert first==second
+    assert vsm.query_cache.stats()["hits"]==1
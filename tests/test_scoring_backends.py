@@ -0,0 +1,40 @@
+from collections import Counter
+
+QUERIES=["alpha bravo", "charlie golf lima", "delta", "echo kilo kilo foxtrot", "\"india juliet\""]
+
+def reference(vsm, query, k, n_probe=None)->list:
+    # mirrors VSM.query, but scores from the postings lists instead of the CSR weights every backend shares
+    qtf=Counter(vsm.preprocess(query))
+    qvec=vsm.build_query_vector(qtf)
+    relevant_clusters=vsm.get_relevant_clusters(list(qtf.keys()), n_probe)
+    allowed=vsm.phrase_filter(vsm.parse_phrases(query))
+    return [(vsm.doc_index[docID], score) for docID, score in vsm.score_postings(qvec, relevant_clusters, allowed)[:k]]
+
+def assert_same_ranking(results, expected)->None:
+    assert [name for name, _ in results]==[name for name, _ in expected]
+    for (_, score), (_, expected_score) in zip(results, expected):
+        assert abs(score - expected_score) < 1e-9
+
+def test_python_scoring_matches_postings_reference(build_vsm):
+    vsm=build_vsm(30, n_clusters=3, query_cache_size=0)
+    matched=0
+    for query in QUERIES:
+        for n_probe in (1, 3):
+            results, _=vsm.query(query, scoring="python", k=30, n_probe=n_probe)
+            assert_same_ranking(results, reference(vsm, query, 30, n_probe))
+            matched+=len(results)
+    assert matched > 0
+
+def test_numpy_scoring_matches_postings_reference(build_vsm):
+    vsm=build_vsm(30, n_clusters=3, query_cache_size=0)
+    for query in QUERIES:
+        for n_probe in (1, 3):
+            results, _=vsm.query(query, scoring="numpy", k=30, n_probe=n_probe)
+            assert_same_ranking(results, reference(vsm, query, 30, n_probe))
+
+def test_maxscore_top_k_matches_postings_reference(build_vsm):
+    vsm=build_vsm(30, n_clusters=3, query_cache_size=0, postings_encoding="varbyte")
+    for query in QUERIES:
+        for k in (1, 3, 10):
+            results, _=vsm.query(query, scoring="maxscore", k=k)
+            assert_same_ranking(results, reference(vsm, query, k))
@@ -0,0 +1,25 @@
+from src.vsm_basic import VSM
+from src.sharded_vsm import ShardedVSM
+
+QUERIES=["alpha bravo", "charlie golf lima", "delta", "\"india juliet\"", "echo kilp"]
+
+def scores(results)->dict:
+    return {name: round(score, 9) for name, score in results}
+
+def test_sharded_results_match_single_index(tmp_path, write_corpus):
+    write_corpus(24)
+    single=VSM(str(tmp_path), n_clusters=2, n_probe=2)
+    single.build_index()
+    sharded=ShardedVSM(str(tmp_path), n_shards=3, n_clusters=2, n_probe=2)
+    try:
+        sharded.build_index()
+        assert sharded.N==single.N
+        for query in QUERIES:
+            for k in (3, 30):
+                results, _=sharded.query(query, k=k)
+                expected, _=single.query(query, k=30)
+                assert len(results)==min(k, len(expected))
+                assert [round(score, 9) for _, score in results]==[round(score, 9) for _, score in expected[:k]]
+                assert scores(results).items() <= scores(expected).items()
+    finally:
+        sharded.close()
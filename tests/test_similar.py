@@ -0,0 +1,42 @@
+import numpy as np
+from src.vsm_basic import VSM
+
+def build(write_corpus)->VSM:
+    corpus_dir=write_corpus(30)
+    (corpus_dir / "copy.txt").write_text((corpus_dir / "d07.txt").read_text())
+    vsm=VSM(str(corpus_dir), n_clusters=3)
+    vsm.build_index()
+    return vsm
+
+def document_vectors(vsm: VSM)->dict:
+    """
+    Returns:
+        dict: file name --> dense normalized lnc vector, from the CSR scorer rows
+    """
+    scorer=vsm.get_csr_scorer()
+    vectors={name: np.zeros(len(scorer.term_rows)) for name in vsm.doc_index.values()}
+    for row in range(len(scorer.term_rows)):
+        for docID, weight in zip(scorer.indices[scorer.indptr[row]:scorer.indptr[row+1]], scorer.data[scorer.indptr[row]:scorer.indptr[row+1]]):
+            vectors[vsm.doc_index[int(docID)]][row]=weight
+    return vectors
+
+def test_exact_similar_matches_brute_force_cosine(write_corpus):
+    vsm=build(write_corpus)
+    vectors=document_vectors(vsm)
+    results, _=vsm.similar(vsm.doc_id_of("d07.txt"), k=50)
+
+    assert results[0][0]=="copy.txt"
+    assert abs(results[0][1] - 1.0) < 1e-9
+    assert "d07.txt" not in [name for name, _ in results]
+    for name, score in results:
+        assert abs(score - vectors["d07.txt"] @ vectors[name]) < 1e-9
+    expected=sorted((name for name in vectors if name!="d07.txt" and vectors["d07.txt"] @ vectors[name] > 0))
+    assert sorted(name for name, _ in results)==expected
+
+def test_approximate_methods_score_exactly(write_corpus):
+    vsm=build(write_corpus)
+    exact=dict(vsm.similar(vsm.doc_id_of("d07.txt"), k=50)[0])
+    for method in ("lsh", "cluster"):
+        results, _=vsm.similar(vsm.doc_id_of("d07.txt"), k=50, method=method)
+        assert results[0][0]=="copy.txt"
+        assert all(abs(score - exact[name]) < 1e-9 for name, score in results)
@@ -1,14 +1,55 @@
-import tempfile
-from pdf2image import convert_from_path
-import pytesseract
-from io import StringIO
-import fitz
-import docx
+from io import StringIO, BytesIO
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import os
-from utils.logger import get_logger
+import hashlib
+import time
+from utils.logger import get_logger, log_sampled
+from utils import metrics
 
 logger=get_logger(__name__)
 
+# Extractor backends (PyMuPDF, python-docx, pytesseract, Pillow) are imported on first use of their file type,
+# so query-only processes never load them
+
+# Resolution pages are rasterized at for OCR
+OCR_DPI=300
+# Pages with fewer extractable characters than this and at least one image are treated as scans and OCRed
+MIN_TEXT_LAYER_CHARS=16
+# Rasterized pages held at once per OCR worker, bounds memory regardless of page count
+OCR_PAGES_PER_WORKER=2
+
+PDF_PAGES=metrics.counter("vsm_pdf_pages_total", "PDF pages extracted, by text_layer or ocr", ("source",))
+OCR_PAGE_SECONDS=metrics.histogram("vsm_ocr_page_seconds", "OCR time per rasterized page", buckets=metrics.BUILD_BUCKETS)
+EXTRACTION_SECONDS=metrics.histogram("vsm_extraction_seconds", "Text extraction time per file by file type, ocr for image-based PDFs and cache for extraction cache hits", ("file_type",), metrics.BUILD_BUCKETS)
+
+def content_hash(data: bytes)->str:
+    """
+    Args:
+        data: Document content
+
+    Returns:
+        str: SHA-256 hex digest, the same as file_fingerprint gives for a file with this content
+    """
+    return hashlib.sha256(data).hexdigest()
+
+def file_fingerprint(file_path: str)->dict:
+    """
+    Computes the change-detection fingerprint of a file
+
+    Args:
+        file_path: Path to the file
+
+    Returns:
+        dict: modification time, size in bytes and SHA-256 content hash
+    """
+    digest=hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    stat=os.stat(file_path)
+    return {"mtime": stat.st_mtime, "size": stat.st_size, "hash": digest.hexdigest()}
+
 class TextExtractionEngine:
     """
     A class to handle text extractions.
@@ -16,121 +57,208 @@ class TextExtractionEngine:
     - PDF (text-based and image-based)
     - DOCX
     - TXT
+    Documents are read from a file path, or from in-memory bytes without touching the disk.
     """
-    def __init__(self, file_path: str)->None:
+    def __init__(self, file_path: str, cache=None, content_hash=None, ocr_workers=None, data=None, file_type=None)->None:
         """
         Initializes the TextExtractionEngine with the given file path.
         
         Args:
-            file_path: Path to the file from which text needs to be extracted.
+            file_path: Path to the file from which text needs to be extracted, or the name of the document given as data
+            cache: Optional ExtractionCache consulted before parsing the file
+            content_hash: SHA-256 of the file content, computed on demand when a cache is given
+            ocr_workers: Number of pages OCRed in parallel, defaults to the number of CPUs
+            data: Content of the document as bytes, read instead of file_path
+            file_type: pdf, docx or txt, defaults to the extension of file_path
         
         Returns:
             None
         """
         self.file_path = file_path
-        self.file_extension = os.path.splitext(file_path)[1].lower()
-        logger.info(f"Initialized TextExtractionEngine for file: {file_path}")
+        self.data = data
+        self.ocr_workers = ocr_workers or os.cpu_count() or 1
+        self.file_extension = "." + file_type.lower().lstrip(".") if file_type else os.path.splitext(file_path)[1].lower()
+        self.cache = cache
+        self.content_hash = content_hash
+        # how the text was obtained: pdf, ocr, docx, txt or cache
+        self.extraction_type = self.file_extension.lstrip(".")
+        if log_sampled():
+            logger.info(f"Initialized TextExtractionEngine for file: {file_path}")
+
+    @staticmethod
+    def _open_pdf(source):
+        import fitz
+        if isinstance(source, (bytes, bytearray)):
+            return fitz.open(stream=source, filetype="pdf")
+        return fitz.open(source)
 
-    def read_img_pdfs(self, file_path):
+    @staticmethod
+    def _ocr_page(image):
+        import pytesseract
+        start_time = time.perf_counter()
+        try:
+            return pytesseract.image_to_string(image)
+        finally:
+            image.close()
+            OCR_PAGE_SECONDS.observe(time.perf_counter() - start_time)
+
+    def read_img_pdfs(self, file_path, pages=None):
         """
-        Convert PDF to text using OCR
+        Convert PDF pages to text using OCR.
+        Pages are rasterized one at a time and OCRed by a pool of workers, with at most OCR_PAGES_PER_WORKER
+        rasterized pages per worker held at once, so memory stays flat however many pages the PDF has.
+        Each worker runs its own tesseract process, which starts a thread per core unless OMP_THREAD_LIMIT=1 is set
+        in the environment of the service (as the Dockerfile does).
         
         Args:
-            file_path: Path to the PDF file
+            file_path: Path to the PDF file, or its content as bytes
+            pages: Page numbers (0-based) to OCR, all pages if None
         
-        Returns:
-            str: Extracted text from the PDF
+        Yields:
+            tuple: (page number, extracted text) in page order
         """
-        
-        # Create a temporary file to save the uploaded PDF
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp_file:
-            tmp_file.write(file_path.read())
-            tmp_file_path = tmp_file.name
-        
-        try:
-            # Convert PDF pages to images
-            pages = convert_from_path(tmp_file_path)
-            
-            # OCR each page and collect text
-            full_text = []
-            
-            for i, page in enumerate(pages, start=1):         
-                text = pytesseract.image_to_string(page)
-                full_text.append(text)
-            
-            if full_text:
-                logger.info(f"Extracted text from image-based PDF: {self.file_path}")
-
-            return "\n".join(full_text)
-        
-        finally:
-            # Clean up temporary file
-            os.unlink(tmp_file_path)
+        import fitz
+        from PIL import Image
+        self.extraction_type = "ocr"
+        max_pending = self.ocr_workers * OCR_PAGES_PER_WORKER
+
+        with self._open_pdf(file_path) as doc, ThreadPoolExecutor(max_workers=self.ocr_workers) as pool:
+            pending = deque()
+            for page_number in (range(len(doc)) if pages is None else pages):
+                # grayscale needs a third of the memory of RGB and OCRs the same
+                pixmap = doc[page_number].get_pixmap(dpi=OCR_DPI, colorspace=fitz.csGRAY)
+                image = Image.frombytes("L", (pixmap.width, pixmap.height), pixmap.samples)
+                del pixmap
+                pending.append((page_number, pool.submit(self._ocr_page, image)))
+                del image
+                if len(pending) >= max_pending:
+                    page, future = pending.popleft()
+                    yield page, future.result()
+            while pending:
+                page, future = pending.popleft()
+                yield page, future.result()
 
     def read_docx(self, file_path):
         """
         Read text from a DOCX file
         
         Args:
-            file_path: Path to the DOCX file
+            file_path: Path to the DOCX file, or its content as bytes
         
         Returns:
             str: Extracted text from the DOCX file
         """
-        doc = docx.Document(file_path)
+        import docx
+        doc = docx.Document(BytesIO(file_path) if isinstance(file_path, (bytes, bytearray)) else file_path)
         full_text = []
         
         for para in doc.paragraphs:
             full_text.append(para.text)
         
-        if full_text:
+        if full_text and log_sampled():
             logger.info(f"Extracted text from DOCX: {self.file_path}")
 
         return "\n".join(full_text)
 
     def read_pdf(self, file_path):
         """
-        Read text from a PDF file
+        Read text from a PDF file, using the text layer of each page and OCR for pages without one
         
         Args:
-            file_path: Path to the PDF file
+            file_path: Path to the PDF file, or its content as bytes
         
         Returns:
             str: Extracted text from the PDF file
         """
-        text = ""
-        with fitz.open(file_path) as doc:
+        page_texts = {}
+        scanned_pages = {} # page number --> whatever little text layer the page has
+        with self._open_pdf(file_path) as doc:
             for page in doc:
-                text += page.get_text()
-        if text:
-            logger.info(f"Extracted text from PDF: {self.file_path}")
+                text = page.get_text()
+                if len(text.strip()) < MIN_TEXT_LAYER_CHARS and page.get_images():
+                    scanned_pages[page.number] = text
+                else:
+                    page_texts[page.number] = text
+            n_pages = len(doc)
+        PDF_PAGES.inc(len(page_texts), "text_layer")
+
+        # pages are written out in order as soon as every page before them is done
+        out = StringIO()
+        next_page = 0
+        def flush():
+            nonlocal next_page
+            while next_page in page_texts:
+                out.write(page_texts.pop(next_page))
+                next_page += 1
+
+        if scanned_pages:
+            # only scanned pages need the OCR backend, text-only PDFs are read without it
+            import pytesseract
+            try:
+                for page_number, text in self.read_img_pdfs(file_path, list(scanned_pages)):
+                    page_texts[page_number] = text + "\n"
+                    flush()
+                PDF_PAGES.inc(len(scanned_pages), "ocr")
+            except pytesseract.TesseractNotFoundError as e:
+                logger.error(f"OCR unavailable, indexing only the text layer of {self.file_path}: {e}")
+                for page_number, text in scanned_pages.items():
+                    page_texts.setdefault(page_number, text)
+        flush()
+
+        text = out.getvalue()
+        if text and log_sampled():
+            logger.info(f"Extracted text from PDF: {self.file_path} ({n_pages} pages, {len(scanned_pages)} OCRed)")
         return text
 
     def read_txt(self, file_path):
-        with open(file_path, "r", encoding="utf-8", errors="ignore") as f:
-            full_text = f.read()
-            if full_text:
-                logger.info(f"Extracted text from TXT: {self.file_path}")
-            return full_text
+        if isinstance(file_path, (bytes, bytearray)):
+            full_text = bytes(file_path).decode("utf-8", errors="ignore")
+        else:
+            with open(file_path, "r", encoding="utf-8", errors="ignore") as f:
+                full_text = f.read()
+        if full_text and log_sampled():
+            logger.info(f"Extracted text from TXT: {self.file_path}")
+        return full_text
 
     def run(self):
+        """
+        Extract text, served from the extraction cache when the file content was seen before
+
+        Returns:
+            str: Extracted text from the file
+        """
+        start_time = time.perf_counter()
+        if self.cache is None:
+            text = self.extract()
+        else:
+            if self.content_hash is None:
+                self.content_hash = content_hash(self.data) if self.data is not None else file_fingerprint(self.file_path)["hash"]
+
+            text = self.cache.get_text(self.content_hash)
+            if text is None:
+                text = self.extract()
+                self.cache.put_text(self.content_hash, text)
+            else:
+                self.extraction_type = "cache"
+        EXTRACTION_SECONDS.observe(time.perf_counter() - start_time, self.extraction_type)
+        return text
+
+    def extract(self):
         """
         Extract text based on file type
 
         Returns:
             str: Extracted text from the file
         """
+        source = self.data if self.data is not None else self.file_path
         if self.file_extension == ".pdf":
-            try:
-                return self.read_pdf(self.file_path)
-            except:
-                return self.read_img_pdfs(self.file_path)
+            return self.read_pdf(source)
         
         elif self.file_extension == ".docx":
-            return self.read_docx(self.file_path)
+            return self.read_docx(source)
 
         elif self.file_extension == ".txt":
-            return self.read_txt(self.file_path)
+            return self.read_txt(source)
         
         else:
             logger.error(f"Unsupported file type: {self.file_extension} for file: {self.file_path}")
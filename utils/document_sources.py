@@ -0,0 +1,112 @@
+import os
+import tarfile
+import zipfile
+from collections import namedtuple
+from utils.logger import get_logger
+
+logger=get_logger(__name__)
+
+# Document streamed into VSM.ingest_documents: an external id, the document content as bytes of a PDF, DOCX or TXT
+# file or as already extracted text, and the file type when the id has no extension
+IngestDocument=namedtuple("IngestDocument", ["name", "data", "file_type"], defaults=[None])
+
+SUPPORTED_EXTENSIONS=(".pdf", ".docx", ".txt")
+ARCHIVE_EXTENSIONS=(".zip", ".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tbz2", ".tar.xz", ".txz")
+
+def is_supported(name: str)->bool:
+    return name.lower().endswith(SUPPORTED_EXTENSIONS)
+
+def is_archive(name: str)->bool:
+    return name.lower().endswith(ARCHIVE_EXTENSIONS)
+
+def iter_zip(path: str, prefix=""):
+    """
+    Streams the supported documents of a zip archive, one member in memory at a time
+
+    Args:
+        path: Path to the zip file
+        prefix: Prepended to member names to form document ids
+
+    Yields:
+        IngestDocument: One per supported member, in archive order
+    """
+    with zipfile.ZipFile(path) as archive:
+        for member in archive.infolist():
+            if member.is_dir():
+                continue
+            if not is_supported(member.filename):
+                logger.debug(f"Skipping unsupported archive member {member.filename} in {path}")
+                continue
+            yield IngestDocument(prefix + member.filename, archive.read(member))
+
+def iter_tar(path: str, prefix=""):
+    """
+    Streams the supported documents of a tar archive, compressed or not. The archive is read sequentially,
+    one member in memory at a time.
+
+    Args:
+        path: Path to the tar file
+        prefix: Prepended to member names to form document ids
+
+    Yields:
+        IngestDocument: One per supported member, in archive order
+    """
+    with tarfile.open(path, "r|*") as archive:
+        for member in archive:
+            if not member.isfile():
+                continue
+            if not is_supported(member.name):
+                logger.debug(f"Skipping unsupported archive member {member.name} in {path}")
+                continue
+            with archive.extractfile(member) as f:
+                yield IngestDocument(prefix + member.name, f.read())
+
+def iter_archive(path: str, prefix=""):
+    if path.lower().endswith(".zip"):
+        return iter_zip(path, prefix)
+    return iter_tar(path, prefix)
+
+def iter_directory(root: str):
+    """
+    Walks a directory tree, streaming its supported documents and the contents of archives found in it.
+    Directories and files are visited in sorted order, so document ids are stable across runs.
+
+    Args:
+        root: Directory to walk
+
+    Yields:
+        IngestDocument: Document named by its path relative to root, with "/" separators; archive members are
+            named by the archive path followed by the member name
+    """
+    for directory, subdirectories, filenames in os.walk(root):
+        subdirectories.sort()
+        for filename in sorted(filenames):
+            path=os.path.join(directory, filename)
+            name=os.path.relpath(path, root).replace(os.sep, "/")
+            if is_archive(filename):
+                yield from iter_archive(path, name + "/")
+            elif is_supported(filename):
+                with open(path, "rb") as f:
+                    yield IngestDocument(name, f.read())
+            else:
+                logger.debug(f"Skipping unsupported file {path}")
+
+def iter_source(path: str):
+    """
+    Args:
+        path: Directory, zip or tar archive, or a single document
+
+    Returns:
+        iterator: IngestDocument per document of the source
+    """
+    if os.path.isdir(path):
+        return iter_directory(path)
+    if is_archive(path):
+        return iter_archive(path)
+    if not is_supported(path):
+        raise ValueError(f"Unsupported source: {path}")
+
+    def single():
+        with open(path, "rb") as f:
+            yield IngestDocument(os.path.basename(path), f.read())
+    return single()
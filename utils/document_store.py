@@ -0,0 +1,307 @@
+import os
+import mmap
+import zlib
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+import numpy as np
+from utils.logger import get_logger
+
+logger=get_logger(__name__)
+
+# Uncompressed bytes per block, the unit of compression and of random access
+BLOCK_BYTES=1 << 16
+# Default bound on the decompressed blocks kept in memory
+CACHE_BYTES=8 << 20
+# zlib level of the blocks, low levels compress text nearly as well at a fraction of the build time
+COMPRESSION_LEVEL=3
+# Fraction of the stored text that may belong to deleted or replaced documents before save rewrites the store
+COMPACT_RATIO=0.5
+# Bytes copied at once when a store is written out
+COPY_BYTES=1 << 20
+
+# Files of a saved store, inside an index directory:
+#   docs.bin          zlib-compressed blocks, concatenated
+#   docs_blocks.npy   int64 offset of each block in docs.bin, plus a sentinel
+#   docs_locs.npy     int64 (max doc id + 1, 2) offset and length of each document's UTF-8 text in the uncompressed
+#                     stream of blocks, offset -1 for ids without a document
+
+class DocumentStore:
+    """
+    Raw text of the indexed documents, kept on disk instead of in memory.
+    Texts are appended to one byte stream, cut into blocks of block_bytes that are compressed one at a time, so only
+    the block being filled is held uncompressed. Reading a document decompresses just the blocks its text spans,
+    through a cache of decompressed blocks bounded by cache_bytes. A loaded store memory-maps the saved blocks, and
+    documents added afterwards go to a temporary file, so updates never copy the saved text. Deleting a document
+    only forgets its location; save rewrites the store once most of its text is dead.
+    """
+    def __init__(self, block_bytes=BLOCK_BYTES, cache_bytes=CACHE_BYTES, level=COMPRESSION_LEVEL)->None:
+        """
+        Args:
+            block_bytes: Uncompressed bytes per block, larger blocks compress better and cost more per random read
+            cache_bytes: Upper bound on the decompressed blocks kept in memory, 0 disables the cache
+            level: zlib compression level of new blocks
+        """
+        self.block_bytes=block_bytes
+        self.cache_bytes=cache_bytes
+        self.level=level
+
+        self.locations=np.full((0, 2), -1, dtype=np.int64) # document id --> (offset, length) in the stream
+        self.base=None # mapped docs.bin of the saved store this one was opened from
+        self.base_offsets=np.zeros(1, dtype=np.int64) # block offsets in base, with a sentinel
+        self.spill=None # temporary file of the blocks written since, created on first use
+        self.spill_offsets=[0] # block offsets in spill, with a sentinel
+        self.tail=bytearray() # uncompressed block being filled
+        self.size=0 # bytes in the stream, including those of deleted documents
+        self.compactions=0 # bumped when compact renumbers the stream, so reads in progress restart
+
+        self.cache=OrderedDict() # block number --> decompressed block, least recently used first
+        self.cache_size=0
+        self.hits=0
+        self.misses=0
+        self._lock=threading.Lock()
+
+    @classmethod
+    def open(cls, directory: str, settings: dict, cache_bytes=CACHE_BYTES):
+        """
+        Opens a store written by save, memory-mapping its blocks
+
+        Args:
+            directory: Directory the store was saved into
+            settings: Dictionary returned by save
+            cache_bytes: Upper bound on the decompressed blocks kept in memory
+
+        Returns:
+            DocumentStore: Store reading the saved blocks, to which documents can be added
+        """
+        store=cls(settings["block_bytes"], cache_bytes, settings.get("level", COMPRESSION_LEVEL))
+        store.locations=np.load(os.path.join(directory, "docs_locs.npy"), mmap_mode="r")
+        offsets=np.load(os.path.join(directory, "docs_blocks.npy"), mmap_mode="r")
+        store.size=settings["size"]
+        if len(offsets) > 1:
+            with open(os.path.join(directory, "docs.bin"), "rb") as f:
+                store.base=mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            n_full=store.size // store.block_bytes
+            if n_full < len(offsets) - 1:
+                # the last block is partly filled, further documents are appended to it
+                store.tail=bytearray(zlib.decompress(store.base[int(offsets[n_full]):int(offsets[n_full+1])]))
+            store.base_offsets=offsets[:n_full+1]
+        return store
+
+    def __contains__(self, doc_id: int)->bool:
+        return 0 <= doc_id < len(self.locations) and self.locations[doc_id, 0] >= 0
+
+    def length(self, doc_id: int)->int:
+        """
+        Returns:
+            int: Bytes of a document's UTF-8 text, 0 if none is stored
+        """
+        return int(self.locations[doc_id, 1]) if doc_id in self else 0
+
+    def _writable_locations(self)->None:
+        if not self.locations.flags.writeable:
+            # copied out of the mapped file, so the index directory can be rewritten
+            self.locations=np.array(self.locations)
+
+    def _spill_file(self):
+        if self.spill is None:
+            self.spill=tempfile.TemporaryFile(prefix="vsm-docs-")
+        return self.spill
+
+    def _flush_tail(self)->None:
+        data=zlib.compress(bytes(self.tail[:self.block_bytes]), self.level)
+        spill=self._spill_file()
+        spill.seek(self.spill_offsets[-1])
+        spill.write(data)
+        spill.flush()
+        self.spill_offsets.append(self.spill_offsets[-1] + len(data))
+        del self.tail[:self.block_bytes]
+
+    def _append(self, doc_id: int, data: bytes)->None:
+        self._writable_locations()
+        if doc_id >= len(self.locations):
+            grown=np.full((max(doc_id + 1, 2 * len(self.locations)), 2), -1, dtype=np.int64)
+            grown[:len(self.locations)]=self.locations
+            self.locations=grown
+        self.locations[doc_id]=(self.size, len(data))
+        self.tail+=data
+        self.size+=len(data)
+        while len(self.tail) >= self.block_bytes:
+            self._flush_tail()
+
+    def add(self, doc_id: int, text: str)->None:
+        """
+        Stores the text of a document, replacing any text stored for its id
+
+        Args:
+            doc_id: Document id
+            text: Document text
+        """
+        data=text.encode("utf-8", errors="replace")
+        with self._lock:
+            self._append(doc_id, data)
+
+    def remove(self, doc_id: int)->None:
+        """
+        Forgets the text of a document, its bytes are reclaimed when save compacts the store
+        """
+        with self._lock:
+            if doc_id in self:
+                self._writable_locations()
+                self.locations[doc_id]=-1
+
+    def _block(self, block: int)->bytes:
+        """
+        Returns:
+            bytes: Decompressed block, from the cache or read and decompressed; the tail block is returned as is
+        """
+        with self._lock:
+            n_base=len(self.base_offsets) - 1
+            n_blocks=n_base + len(self.spill_offsets) - 1
+            if block >= n_blocks:
+                return bytes(self.tail)
+            cached=self.cache.get(block)
+            if cached is not None:
+                self.cache.move_to_end(block)
+                self.hits+=1
+                return cached
+            self.misses+=1
+            compactions=self.compactions
+            if block < n_base:
+                compressed=self.base[int(self.base_offsets[block]):int(self.base_offsets[block+1])]
+            else:
+                start, end=self.spill_offsets[block - n_base], self.spill_offsets[block - n_base + 1]
+                compressed=os.pread(self.spill.fileno(), end - start, start)
+
+        data=zlib.decompress(compressed)
+        if len(data) <= self.cache_bytes:
+            with self._lock:
+                if block not in self.cache and compactions==self.compactions:
+                    self.cache[block]=data
+                    self.cache_size+=len(data)
+                    while self.cache_size > self.cache_bytes:
+                        _, evicted=self.cache.popitem(last=False)
+                        self.cache_size-=len(evicted)
+        return data
+
+    def _read(self, doc_id: int, max_bytes=None):
+        while True:
+            with self._lock:
+                if doc_id not in self:
+                    return None
+                offset, length=(int(value) for value in self.locations[doc_id])
+                compactions=self.compactions
+            if max_bytes is not None:
+                length=min(length, max_bytes)
+            pieces=[]
+            end=offset + length
+            while offset < end:
+                block, start=divmod(offset, self.block_bytes)
+                data=self._block(block)
+                pieces.append(data[start:start + end - offset])
+                offset+=len(pieces[-1])
+            if compactions==self.compactions:
+                return b"".join(pieces)
+
+    def get(self, doc_id: int, max_bytes=None):
+        """
+        Text of a document, decompressing only the blocks it spans
+
+        Args:
+            doc_id: Document id
+            max_bytes: Read at most this many bytes of its UTF-8 text, a character cut at the end is dropped
+
+        Returns:
+            str: The text, None if no text is stored for the id
+        """
+        data=self._read(doc_id, max_bytes)
+        return data.decode("utf-8", errors="ignore") if data is not None else None
+
+    def live_bytes(self)->int:
+        """
+        Returns:
+            int: Uncompressed bytes of the stored documents, excluding deleted and replaced ones
+        """
+        with self._lock:
+            locations=np.asarray(self.locations)
+            return int(locations[locations[:, 0] >= 0, 1].sum())
+
+    def compact(self)->None:
+        """
+        Rewrites the stream with only the texts of current documents, in stream order
+        """
+        locations=np.asarray(self.locations)
+        doc_ids=np.flatnonzero(locations[:, 0] >= 0)
+        doc_ids=doc_ids[np.argsort(locations[doc_ids, 0], kind="stable")]
+        compacted=DocumentStore(self.block_bytes, self.cache_bytes, self.level)
+        for doc_id in doc_ids.tolist():
+            compacted._append(doc_id, self._read(doc_id))
+        logger.info(f"Compacted document store from {self.size} to {compacted.size} bytes")
+
+        with self._lock:
+            if self.spill is not None:
+                self.spill.close()
+            for name in ("locations", "base", "base_offsets", "spill", "spill_offsets", "tail", "size"):
+                setattr(self, name, getattr(compacted, name))
+            self.cache.clear()
+            self.cache_size=0
+            self.compactions+=1
+
+    def save(self, directory: str)->dict:
+        """
+        Writes the store into a directory, as the files listed above; the partly filled last block is compressed
+        as it is and reopened by open
+
+        Args:
+            directory: Target directory, existing
+
+        Returns:
+            dict: Settings needed by open, to be kept with the index metadata
+        """
+        if self.size and self.live_bytes() < (1 - COMPACT_RATIO) * self.size:
+            self.compact()
+
+        with self._lock:
+            base_end=int(self.base_offsets[-1])
+            offsets=[np.asarray(self.base_offsets[:-1]), base_end + np.asarray(self.spill_offsets, dtype=np.int64)]
+            with open(os.path.join(directory, "docs.bin"), "wb") as f:
+                for start in range(0, base_end, COPY_BYTES):
+                    f.write(self.base[start:min(start + COPY_BYTES, base_end)])
+                if self.spill is not None:
+                    self.spill.seek(0)
+                    shutil.copyfileobj(self.spill, f, COPY_BYTES)
+                if self.tail:
+                    tail=zlib.compress(bytes(self.tail), self.level)
+                    f.write(tail)
+                    offsets.append([offsets[-1][-1] + len(tail)])
+            np.save(os.path.join(directory, "docs_blocks.npy"), np.concatenate(offsets).astype(np.int64))
+            np.save(os.path.join(directory, "docs_locs.npy"), np.asarray(self.locations, dtype=np.int64))
+        return {"block_bytes": self.block_bytes, "level": self.level, "size": self.size}
+
+    def nbytes(self)->int:
+        """
+        Returns:
+            int: Memory of the location table, block offsets, block being filled and decompressed block cache;
+                the compressed blocks stay on disk
+        """
+        return (self.locations.nbytes + self.base_offsets.nbytes + 8 * len(self.spill_offsets) + len(self.tail)
+                + self.cache_size)
+
+    def stats(self)->dict:
+        """
+        Returns:
+            dict: stored and live uncompressed bytes, compressed bytes, blocks, and block cache statistics
+        """
+        lookups=self.hits + self.misses
+        return {
+            "stored_bytes": self.size,
+            "live_bytes": self.live_bytes(),
+            "compressed_bytes": int(self.base_offsets[-1]) + self.spill_offsets[-1],
+            "blocks": len(self.base_offsets) + len(self.spill_offsets) - 2,
+            "cache_bytes": self.cache_size,
+            "cache_blocks": len(self.cache),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,178 @@
+import os
+import time
+import zlib
+import sqlite3
+import threading
+from utils.logger import get_logger
+
+logger=get_logger(__name__)
+
+# Bump when TextExtractionEngine output changes, so stale cached text is never served
+EXTRACTOR_VERSION="2"
+
+# Number of cache hits whose last_access update is buffered before it is written back
+TOUCH_BATCH=256
+
+class ExtractionCache:
+    """
+    Persistent, size-bounded cache of extracted text and preprocessed token streams.
+    Entries are keyed by file content hash plus extractor (and preprocessing) version and
+    stored zlib-compressed in a SQLite database; least recently used entries are evicted
+    once the total stored size exceeds max_bytes.
+
+    Entry sizes and access times live in their own table, apart from the compressed blobs,
+    and the running total of stored bytes is kept in a one-row meta table, so a put never
+    scans the cache. Hits only record their access time in memory and are written back in
+    batches of TOUCH_BATCH, or before an eviction.
+    """
+    def __init__(self, cache_dir: str, max_bytes=1 << 30)->None:
+        """
+        Opens (or creates) the cache
+
+        Args:
+            cache_dir: Directory holding the cache database
+            max_bytes: Upper bound on the total compressed size of cached entries
+
+        Returns:
+            None
+        """
+        os.makedirs(cache_dir, exist_ok=True)
+        self.cache_dir=cache_dir
+        self.max_bytes=max_bytes
+        self.hits=0
+        self.misses=0
+
+        self._lock=threading.Lock()
+        self._touched={}
+        self._conn=sqlite3.connect(os.path.join(cache_dir, "extraction_cache.db"), timeout=30, check_same_thread=False)
+        # Caches written before sizes were split from the blobs are discarded rather than migrated
+        self._conn.execute("DROP TABLE IF EXISTS entries")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS blobs (key TEXT PRIMARY KEY, data BLOB NOT NULL)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS entry_meta (key TEXT PRIMARY KEY, size INTEGER NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS entry_meta_last_access ON entry_meta (last_access)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS totals (id INTEGER PRIMARY KEY CHECK (id=0), bytes INTEGER NOT NULL)")
+        self._conn.execute("INSERT OR IGNORE INTO totals (id, bytes) SELECT 0, COALESCE(SUM(size), 0) FROM entry_meta")
+        self._conn.commit()
+        logger.info(f"Opened extraction cache at {cache_dir}")
+
+    def _get(self, key: str):
+        with self._lock:
+            row=self._conn.execute("SELECT data FROM blobs WHERE key=?", (key,)).fetchone()
+            if row is None:
+                self.misses+=1
+                return None
+            self.hits+=1
+            self._touched[key]=time.time()
+            if len(self._touched)>=TOUCH_BATCH:
+                self._flush_touches()
+                self._conn.commit()
+        return zlib.decompress(row[0]).decode("utf-8")
+
+    def _put(self, key: str, value: str)->None:
+        data=zlib.compress(value.encode("utf-8"))
+        with self._lock:
+            row=self._conn.execute("SELECT size FROM entry_meta WHERE key=?", (key,)).fetchone()
+            delta=len(data) - (row[0] if row else 0)
+            self._conn.execute("INSERT OR REPLACE INTO blobs (key, data) VALUES (?, ?)", (key, data))
+            self._conn.execute(
+                "INSERT OR REPLACE INTO entry_meta (key, size, last_access) VALUES (?, ?, ?)",
+                (key, len(data), time.time())
+            )
+            self._conn.execute("UPDATE totals SET bytes=bytes+? WHERE id=0", (delta,))
+            self._touched.pop(key, None)
+            self._flush_touches()
+            if self._total()>self.max_bytes:
+                self._evict()
+            self._conn.commit()
+
+    def _total(self)->int:
+        return self._conn.execute("SELECT bytes FROM totals WHERE id=0").fetchone()[0]
+
+    def _flush_touches(self)->None:
+        """
+        Writes buffered last_access updates back to the database
+        """
+        if self._touched:
+            self._conn.executemany(
+                "UPDATE entry_meta SET last_access=? WHERE key=?",
+                [(accessed, key) for key, accessed in self._touched.items()]
+            )
+            self._touched.clear()
+
+    def _evict(self)->None:
+        """
+        Deletes least recently used entries until the cache fits in max_bytes
+        """
+        total=self._total()
+        evicted=0
+        freed=0
+        for key, size in self._conn.execute("SELECT key, size FROM entry_meta ORDER BY last_access").fetchall():
+            if total - freed<=self.max_bytes:
+                break
+            self._conn.execute("DELETE FROM blobs WHERE key=?", (key,))
+            self._conn.execute("DELETE FROM entry_meta WHERE key=?", (key,))
+            freed+=size
+            evicted+=1
+        self._conn.execute("UPDATE totals SET bytes=bytes-? WHERE id=0", (freed,))
+        logger.info(f"Evicted {evicted} entries from extraction cache")
+
+    def flush(self)->None:
+        """
+        Writes buffered access times, so recently read entries keep their place in the eviction order
+        """
+        with self._lock:
+            self._flush_touches()
+            self._conn.commit()
+
+    def get_text(self, content_hash: str):
+        """
+        Args:
+            content_hash: SHA-256 of the file content
+
+        Returns:
+            str: Cached extracted text, or None on a miss
+        """
+        return self._get(f"text:{EXTRACTOR_VERSION}:{content_hash}")
+
+    def put_text(self, content_hash: str, text: str)->None:
+        """
+        Args:
+            content_hash: SHA-256 of the file content
+            text: Extracted text
+        """
+        self._put(f"text:{EXTRACTOR_VERSION}:{content_hash}", text)
+
+    def get_tokens(self, content_hash: str, pipeline: str):
+        """
+        Args:
+            content_hash: SHA-256 of the file content
+            pipeline: Identifier of the preprocessing pipeline that produced the tokens
+
+        Returns:
+            list: Cached token stream, or None on a miss
+        """
+        value=self._get(f"tokens:{EXTRACTOR_VERSION}:{pipeline}:{content_hash}")
+        if value is None:
+            return None
+        return value.split("\n") if value else []
+
+    def put_tokens(self, content_hash: str, pipeline: str, tokens: list)->None:
+        """
+        Args:
+            content_hash: SHA-256 of the file content
+            pipeline: Identifier of the preprocessing pipeline that produced the tokens
+            tokens: Token stream
+        """
+        self._put(f"tokens:{EXTRACTOR_VERSION}:{pipeline}:{content_hash}", "\n".join(tokens))
+
+    def stats(self)->dict:
+        """
+        Returns:
+            dict: entry count, stored bytes, hits and misses
+        """
+        with self._lock:
+            entries=self._conn.execute("SELECT COUNT(*) FROM entry_meta").fetchone()[0]
+            size=self._total()
+        return {"entries": entries, "bytes": size, "max_bytes": self.max_bytes, "hits": self.hits, "misses": self.misses}
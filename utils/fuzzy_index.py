@@ -0,0 +1,152 @@
+import sys
+import math
+import numpy as np
+from array import array
+from collections import defaultdict, Counter
+from utils.logger import get_logger
+
+logger=get_logger(__name__)
+
+# Jaro-Winkler rewards a common prefix of up to this many characters
+MAX_PREFIX=4
+# Terms are additionally grouped by their first 1 .. PREFIX_TIERS-1 characters
+PREFIX_TIERS=3
+
+def min_jaro(threshold: float, prefix: int)->float:
+    """
+    Smallest Jaro similarity that can reach a Jaro-Winkler threshold with a given common prefix length.
+    The prefix bonus 0.1 * prefix * (1 - jaro) only applies when jaro > 0.7.
+
+    Args:
+        threshold: Jaro-Winkler threshold
+        prefix: Common prefix length (at most MAX_PREFIX)
+
+    Returns:
+        float: Lower bound on the Jaro similarity
+    """
+    boost=0.1 * min(prefix, MAX_PREFIX)
+    return min(threshold, max(0.7, (threshold - boost) / (1 - boost)))
+
+class FuzzyTermIndex:
+    """
+    Candidate index for Jaro-Winkler fuzzy term lookup.
+
+    A Jaro similarity of at least j requires m >= (3j - 1) * |a| * |b| / (|a| + |b|) matching characters,
+    and matches are bounded by the multiset character overlap of both terms. Terms are indexed per length by
+    (character, occurrence) tokens, so the overlap with the query is a count over the query tokens' postings.
+    The index exists once overall and once per 1 and 2 character prefix, so the looser bound that a shared
+    prefix allows is only applied to terms that actually share it. Only the resulting candidate set needs to
+    be verified with Jaro-Winkler.
+    """
+    def __init__(self, terms=())->None:
+        """
+        Args:
+            terms: Initial vocabulary, in dictionary order
+        """
+        self.terms=[] # term id --> term, None once removed; ids follow insertion order
+        self.term_ids={}
+        self.buckets=defaultdict(lambda: defaultdict(lambda: defaultdict(lambda: array("I")))) # (tier, prefix) --> term length --> token --> term ids
+        self.removed=0
+
+        for term in terms:
+            self.add(term)
+
+    @staticmethod
+    def _tokens(term: str)->list:
+        """
+        Splits a term into (character, occurrence number) tokens, so set overlap equals multiset character overlap
+        """
+        seen=Counter()
+        tokens=[]
+        for ch in term:
+            seen[ch]+=1
+            tokens.append((ch, seen[ch]))
+        return tokens
+
+    def add(self, term: str)->None:
+        """
+        Adds a term at the end of the index order
+
+        Args:
+            term: Term to add
+        """
+        if term in self.term_ids:
+            return
+        term_id=len(self.terms)
+        self.terms.append(term)
+        self.term_ids[term]=term_id
+
+        tokens=self._tokens(term)
+        for tier in range(min(PREFIX_TIERS, len(term) + 1)):
+            bucket=self.buckets[(tier, term[:tier])][len(term)]
+            for token in tokens:
+                bucket[token].append(term_id)
+
+    def remove(self, term: str)->None:
+        """
+        Removes a term, compacting the index once half of the ids are dead
+
+        Args:
+            term: Term to remove
+        """
+        term_id=self.term_ids.pop(term, None)
+        if term_id is None:
+            return
+        self.terms[term_id]=None
+        self.removed+=1
+
+        if self.removed * 2 > len(self.terms):
+            live_terms=[t for t in self.terms if t is not None]
+            self.__init__(live_terms)
+
+    def nbytes(self)->int:
+        """
+        Returns:
+            int: Approximate size of the term list and buckets, term strings are shared with the dictionary
+        """
+        size=sys.getsizeof(self.terms) + sys.getsizeof(self.term_ids) + sys.getsizeof(self.buckets)
+        for lengths in self.buckets.values():
+            size+=sys.getsizeof(lengths)
+            for tokens in lengths.values():
+                size+=sys.getsizeof(tokens) + sum(map(sys.getsizeof, tokens.values()))
+        return size
+
+    def candidates(self, term: str, threshold: float)->list:
+        """
+        Returns every indexed term that can reach the Jaro-Winkler threshold against term
+
+        Args:
+            term: Query term
+            threshold: Minimum Jaro-Winkler similarity
+
+        Returns:
+            list: Candidate terms, in index order
+        """
+        a=len(term)
+        if a==0 or 3 * min_jaro(threshold, MAX_PREFIX) - 1 <= 0:
+            return [t for t in self.terms if t is not None]
+
+        tokens=self._tokens(term)
+        candidate_ids=set()
+
+        for tier in range(min(PREFIX_TIERS, a + 1)):
+            group=self.buckets.get((tier, term[:tier]))
+            if group is None:
+                continue
+
+            for b, bucket in group.items():
+                # the top tier holds every longer common prefix too
+                common_prefix=tier if tier < PREFIX_TIERS - 1 else min(MAX_PREFIX, a, b)
+                factor=3 * min_jaro(threshold, common_prefix) - 1
+                required=max(math.ceil(factor * a * b / (a + b) - 1e-9), 1)
+                if required > min(a, b):
+                    continue
+
+                postings=[bucket[token] for token in tokens if token in bucket]
+                if len(postings) < required:
+                    continue
+
+                term_ids, overlap=np.unique(np.concatenate([np.frombuffer(p, dtype=np.uint32) for p in postings]), return_counts=True)
+                candidate_ids.update(term_ids[overlap >= required].tolist())
+
+        return [self.terms[i] for i in sorted(candidate_ids) if self.terms[i] is not None]
@@ -0,0 +1,386 @@
+import os
+import json
+import shutil
+import numpy as np
+from collections.abc import Mapping
+from utils.postings import PostingsList
+from utils.document_store import DocumentStore
+from utils.logger import get_logger
+
+logger=get_logger(__name__)
+
+INDEX_FORMAT_VERSION=5
+
+# Layout of an index directory:
+#   meta.json               format version, corpus settings and shard, doc id --> file name mapping, file fingerprints,
+#                           document store settings
+#   terms.txt               term lexicon, one term per line, in dictionary order
+#   terms_offsets.npy       int64 offsets into the postings arrays, one per term plus a sentinel
+#   terms_docs.npy          uint32 delta-encoded document ids of all postings lists, concatenated
+#   terms_tfs.npy           uint32 term frequencies aligned with terms_docs.npy
+#   positions_offsets.npy   int64 offsets into positions.npy, one per posting (in terms_docs.npy order) plus a sentinel
+#   positions.npy           uint8 variable-byte encoded token position gaps of all postings, concatenated
+#   doc_lengths.npy         float64 vector length indexed by document id (0 = no terms)
+#   doc_clusters.npy        int32 cluster id indexed by document id (-1 = unassigned)
+#   cluster_centers.npy     float64 (n_clusters, num_features) centroid matrix
+#   cluster_vocab.txt       term of each centroid feature column, one per line
+#   cluster_idf.npy         float64 idf of each centroid feature column
+#   csr_indices.npy         int32 document ids of the CSR scorer rows, one row per term in lexicon order
+#   csr_data.npy            float64 normalized lnc weights aligned with csr_indices.npy
+#   csr_group_ptr.npy       int64 (n_terms, n_clusters + 2) offsets of each row's cluster groups
+#   csr_cluster_stats.npy   float64 (n_terms, n_clusters) per term and cluster statistics of cluster selection
+#   csr_first_doc.npy       int64 (n_terms, n_clusters) first document of each term in each cluster
+#   csr_doc_clusters.npy    int64 cluster id per document of the scorer's document space (-1 = none)
+#   docs.bin, docs_*.npy    block-compressed raw document texts, see utils.document_store
+#
+# Published indexes (publish_index) live in generation directories under a root, gen-000001, gen-000002, ...,
+# with the file CURRENT naming the one being served. CURRENT is replaced atomically, so readers always see
+# a complete generation, and older generations stay readable by processes that still have them mapped.
+
+
+class MappedPostings(Mapping):
+    """
+    Read-only term dictionary backed by memory-mapped postings arrays.
+    Behaves like VSM.dictionary: term --> (document frequency, PostingsList), the postings lists are raw
+    PostingsList views of the mapped arrays, so nothing is copied or decoded until a term is scored.
+    """
+    def __init__(self, terms: list, offsets, docs, tfs)->None:
+        """
+        Args:
+            terms: Lexicon in dictionary order
+            offsets: Postings offsets per term, with a trailing sentinel
+            docs: Delta-encoded document ids
+            tfs: Term frequencies
+        """
+        self.terms=terms
+        self.term_ids={term: i for i, term in enumerate(terms)}
+        self.offsets=offsets
+        self.docs=docs
+        self.tfs=tfs
+
+    def __getitem__(self, term):
+        i=self.term_ids[term]
+        start, end=int(self.offsets[i]), int(self.offsets[i+1])
+        return end - start, PostingsList(end - start, "raw", self.docs[start:end], self.tfs[start:end])
+
+    def __contains__(self, term):
+        return term in self.term_ids
+
+    def __iter__(self):
+        return iter(self.terms)
+
+    def __len__(self):
+        return len(self.terms)
+
+
+class MappedPositions(Mapping):
+    """
+    Read-only positional index backed by memory-mapped arrays.
+    Behaves like VSM.positions: term --> encoded token positions per posting, aligned with the term's postings list.
+    """
+    def __init__(self, postings: MappedPostings, offsets, data)->None:
+        """
+        Args:
+            postings: Term dictionary the positions are aligned with
+            offsets: Positions offsets per posting, with a trailing sentinel
+            data: Encoded positions
+        """
+        self.postings=postings
+        self.offsets=offsets
+        self.data=data
+
+    def __getitem__(self, term):
+        i=self.postings.term_ids[term]
+        start, end=int(self.postings.offsets[i]), int(self.postings.offsets[i+1])
+        bounds=self.offsets[start:end+1].tolist()
+        return [self.data[a:b].tobytes() for a, b in zip(bounds, bounds[1:])]
+
+    def __contains__(self, term):
+        return term in self.postings
+
+    def __iter__(self):
+        return iter(self.postings)
+
+    def __len__(self):
+        return len(self.postings)
+
+
+def _write_postings(index_dir: str, prefix: str, dictionary)->None:
+    """
+    Writes a term dictionary as a lexicon plus delta-encoded postings arrays
+
+    Args:
+        index_dir: Target directory
+        prefix: File name prefix
+        dictionary: term --> (document frequency, postings list)
+    """
+    terms=list(dictionary.keys())
+    offsets=np.zeros(len(terms) + 1, dtype=np.int64)
+    docs=[]
+    tfs=[]
+
+    for i, term in enumerate(terms):
+        df, posting_list=dictionary[term]
+        doc_ids, term_tfs=posting_list.arrays()
+        docs.append(np.diff(doc_ids, prepend=0))
+        tfs.append(term_tfs)
+        offsets[i+1]=offsets[i] + df
+
+    with open(os.path.join(index_dir, f"{prefix}.txt"), "w", encoding="utf-8") as f:
+        f.write("\n".join(terms))
+    np.save(os.path.join(index_dir, f"{prefix}_offsets.npy"), offsets)
+    np.save(os.path.join(index_dir, f"{prefix}_docs.npy"), np.concatenate(docs).astype(np.uint32) if docs else np.zeros(0, dtype=np.uint32))
+    np.save(os.path.join(index_dir, f"{prefix}_tfs.npy"), np.concatenate(tfs).astype(np.uint32) if tfs else np.zeros(0, dtype=np.uint32))
+
+
+def _read_postings(index_dir: str, prefix: str)->MappedPostings:
+    """
+    Opens a lexicon and its postings arrays through memory maps
+
+    Args:
+        index_dir: Index directory
+        prefix: File name prefix
+
+    Returns:
+        MappedPostings: Lazily decoded term dictionary
+    """
+    with open(os.path.join(index_dir, f"{prefix}.txt"), encoding="utf-8") as f:
+        content=f.read()
+    terms=content.split("\n") if content else []
+
+    offsets=np.load(os.path.join(index_dir, f"{prefix}_offsets.npy"), mmap_mode="r")
+    docs=np.load(os.path.join(index_dir, f"{prefix}_docs.npy"), mmap_mode="r")
+    tfs=np.load(os.path.join(index_dir, f"{prefix}_tfs.npy"), mmap_mode="r")
+    return MappedPostings(terms, offsets, docs, tfs)
+
+
+def _write_positions(index_dir: str, dictionary, positions)->None:
+    """
+    Writes the encoded positions of all postings, in the postings order of _write_postings
+
+    Args:
+        index_dir: Target directory
+        dictionary: term --> (document frequency, postings list)
+        positions: term --> encoded positions per posting
+    """
+    encoded=[data for term in dictionary for data in positions[term]]
+    offsets=np.zeros(len(encoded) + 1, dtype=np.int64)
+    offsets[1:]=np.cumsum([len(data) for data in encoded], dtype=np.int64)
+
+    np.save(os.path.join(index_dir, "positions_offsets.npy"), offsets)
+    np.save(os.path.join(index_dir, "positions.npy"), np.frombuffer(b"".join(encoded), dtype=np.uint8))
+
+
+def _write_csr(index_dir: str, scorer)->None:
+    """
+    Writes the arrays of a CSRScorer whose rows follow the lexicon order of _write_postings
+    """
+    np.save(os.path.join(index_dir, "csr_indices.npy"), scorer.indices)
+    np.save(os.path.join(index_dir, "csr_data.npy"), scorer.data)
+    np.save(os.path.join(index_dir, "csr_group_ptr.npy"), scorer.group_ptr)
+    np.save(os.path.join(index_dir, "csr_cluster_stats.npy"), scorer.cluster_stats)
+    np.save(os.path.join(index_dir, "csr_first_doc.npy"), scorer.cluster_first_doc)
+    np.save(os.path.join(index_dir, "csr_doc_clusters.npy"), scorer.doc_clusters)
+
+
+def read_csr(index_dir: str)->tuple:
+    """
+    Opens the CSR scorer arrays through memory maps, so every process serving the index shares one copy of them
+
+    Args:
+        index_dir: Index directory
+
+    Returns:
+        tuple: indices, data, group_ptr, cluster_stats, cluster_first_doc and doc_clusters arrays, as taken by
+            CSRScorer.from_arrays
+    """
+    return tuple(np.load(os.path.join(index_dir, f"csr_{name}.npy"), mmap_mode="r")
+                 for name in ("indices", "data", "group_ptr", "cluster_stats", "first_doc", "doc_clusters"))
+
+
+def save_index(vsm, index_dir: str)->None:
+    """
+    Saves a built VSM index to a directory.
+    The index is written to a temporary sibling directory first and then swapped in, so readers never see a partial index.
+
+    Args:
+        vsm: VSM instance with a built index
+        index_dir: Target directory
+    """
+    index_dir=os.path.abspath(index_dir)
+    tmp_dir=index_dir + ".tmp"
+    if os.path.exists(tmp_dir):
+        shutil.rmtree(tmp_dir)
+    os.makedirs(tmp_dir)
+
+    _write_postings(tmp_dir, "terms", vsm.dictionary)
+    _write_positions(tmp_dir, vsm.dictionary, vsm.positions)
+
+    scorer=vsm.get_csr_scorer()
+    if list(scorer.term_rows)!=list(vsm.dictionary):
+        # rows are stored in lexicon order, rebuild a scorer that predates changes of the dictionary
+        vsm.csr_scorer=None
+        scorer=vsm.get_csr_scorer()
+    _write_csr(tmp_dir, scorer)
+
+    max_doc_id=max(vsm.doc_index, default=0)
+    doc_lengths=np.zeros(max_doc_id + 1, dtype=np.float64)
+    for docID, length in vsm.doc_lengths.items():
+        doc_lengths[docID]=length
+    np.save(os.path.join(tmp_dir, "doc_lengths.npy"), doc_lengths)
+
+    doc_clusters=np.full(max_doc_id + 1, -1, dtype=np.int32)
+    for docID, cluster_id in vsm.doc_clusters.items():
+        doc_clusters[docID]=cluster_id
+    np.save(os.path.join(tmp_dir, "doc_clusters.npy"), doc_clusters)
+
+    centers=[vsm.cluster_centers[i] for i in sorted(vsm.cluster_centers)]
+    np.save(os.path.join(tmp_dir, "cluster_centers.npy"), np.asarray(centers, dtype=np.float64))
+
+    with open(os.path.join(tmp_dir, "cluster_vocab.txt"), "w", encoding="utf-8") as f:
+        f.write("\n".join(sorted(vsm.cluster_vocab, key=vsm.cluster_vocab.get)))
+    np.save(os.path.join(tmp_dir, "cluster_idf.npy"), np.asarray(vsm.cluster_idf, dtype=np.float64))
+    doc_store=vsm.doc_store.save(tmp_dir)
+
+    meta={
+        "format_version": INDEX_FORMAT_VERSION,
+        "corpus_dir": vsm.corpus_dir,
+        "n_clusters": vsm.n_clusters,
+        "ngram_range": list(vsm.ngram_range),
+        "N": vsm.N,
+        "doc_index": {str(docID): filename for docID, filename in vsm.doc_index.items()},
+        "file_stats": vsm.file_stats,
+        "ingested_docs": vsm.ingested_docs,
+        "next_doc_id": vsm.next_doc_id,
+        "changes_since_clustering": vsm.changes_since_clustering,
+        "shard": list(vsm.shard) if vsm.shard else None,
+        "doc_store": doc_store,
+    }
+    with open(os.path.join(tmp_dir, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+
+    if os.path.exists(index_dir):
+        old_dir=index_dir + ".old"
+        if os.path.exists(old_dir):
+            shutil.rmtree(old_dir)
+        os.rename(index_dir, old_dir)
+        os.rename(tmp_dir, index_dir)
+        shutil.rmtree(old_dir)
+    else:
+        os.rename(tmp_dir, index_dir)
+
+    logger.info(f"Saved index with {len(vsm.dictionary)} terms and {vsm.N} documents to {index_dir}")
+
+
+def load_index(vsm, index_dir: str)->None:
+    """
+    Loads a saved index into a VSM instance, memory-mapping the postings arrays
+
+    Args:
+        vsm: VSM instance to populate
+        index_dir: Index directory written by save_index
+    """
+    with open(os.path.join(index_dir, "meta.json"), encoding="utf-8") as f:
+        meta=json.load(f)
+
+    if meta.get("format_version")!=INDEX_FORMAT_VERSION:
+        raise ValueError(f"Unsupported index format version {meta.get('format_version')} in {index_dir}, expected {INDEX_FORMAT_VERSION}")
+
+    vsm.corpus_dir=meta["corpus_dir"]
+    vsm.n_clusters=meta["n_clusters"]
+    vsm.ngram_range=tuple(meta["ngram_range"])
+    vsm.N=meta["N"]
+    vsm.doc_index={int(docID): filename for docID, filename in meta["doc_index"].items()}
+    vsm.file_stats=meta["file_stats"]
+    vsm.ingested_docs=meta.get("ingested_docs", {})
+    vsm.next_doc_id=meta["next_doc_id"]
+    vsm.changes_since_clustering=meta["changes_since_clustering"]
+    vsm.shard=tuple(meta["shard"]) if meta.get("shard") else None
+
+    vsm.dictionary=_read_postings(index_dir, "terms")
+    vsm.positions=MappedPositions(
+        vsm.dictionary,
+        np.load(os.path.join(index_dir, "positions_offsets.npy"), mmap_mode="r"),
+        np.load(os.path.join(index_dir, "positions.npy"), mmap_mode="r")
+    )
+
+    doc_lengths=np.load(os.path.join(index_dir, "doc_lengths.npy"), mmap_mode="r")
+    vsm.doc_lengths={docID: float(doc_lengths[docID]) for docID in vsm.doc_index if doc_lengths[docID] > 0}
+
+    doc_clusters=np.load(os.path.join(index_dir, "doc_clusters.npy"), mmap_mode="r")
+    vsm.doc_clusters={docID: int(doc_clusters[docID]) for docID in vsm.doc_index if doc_clusters[docID] >= 0}
+
+    centers=np.load(os.path.join(index_dir, "cluster_centers.npy"), mmap_mode="r")
+    vsm.cluster_centers={i: centers[i] for i in range(len(centers))}
+
+    with open(os.path.join(index_dir, "cluster_vocab.txt"), encoding="utf-8") as f:
+        content=f.read()
+    vsm.cluster_vocab={term: j for j, term in enumerate(content.split("\n"))} if content else {}
+    vsm.cluster_idf=np.load(os.path.join(index_dir, "cluster_idf.npy"), mmap_mode="r")
+    vsm.doc_store=DocumentStore.open(index_dir, meta["doc_store"], vsm.doc_store.cache_bytes)
+
+    logger.info(f"Loaded index with {len(vsm.dictionary)} terms and {vsm.N} documents from {index_dir}")
+
+
+GENERATION_POINTER="CURRENT"
+GENERATION_PREFIX="gen-"
+
+def generation_dirs(root: str)->list:
+    """
+    Returns:
+        list: Names of the generation directories under a publishing root, oldest first
+    """
+    if not os.path.isdir(root):
+        return []
+    return sorted(name for name in os.listdir(root) if name.startswith(GENERATION_PREFIX) and name[len(GENERATION_PREFIX):].isdigit())
+
+
+def current_generation(root: str):
+    """
+    Args:
+        root: Publishing root of an index
+
+    Returns:
+        str: Directory of the generation CURRENT points to, None if nothing was published
+    """
+    try:
+        with open(os.path.join(root, GENERATION_POINTER), encoding="utf-8") as f:
+            name=f.read().strip()
+    except FileNotFoundError:
+        return None
+    return os.path.join(root, name) if name else None
+
+
+def publish_index(vsm, root: str, keep=2)->str:
+    """
+    Saves an index as the next generation under a publishing root and atomically points CURRENT to it.
+    Readers resolving CURRENT get either the previous or the new generation, never a partial one. Callers
+    serialize publishers of the same root.
+
+    Args:
+        vsm: Built VSM or ShardedVSM
+        root: Publishing root of the index
+        keep: Number of most recent generations kept, older ones are deleted; processes still mapping a deleted
+            generation keep reading it until they switch
+
+    Returns:
+        str: Directory of the new generation
+    """
+    os.makedirs(root, exist_ok=True)
+    existing=generation_dirs(root)
+    number=int(existing[-1][len(GENERATION_PREFIX):]) + 1 if existing else 1
+    name=f"{GENERATION_PREFIX}{number:06d}"
+    generation_dir=os.path.join(root, name)
+    vsm.save(generation_dir)
+
+    pointer=os.path.join(root, GENERATION_POINTER)
+    with open(pointer + ".tmp", "w", encoding="utf-8") as f:
+        f.write(name)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(pointer + ".tmp", pointer)
+
+    for old in existing[:max(0, len(existing) - keep + 1)]:
+        shutil.rmtree(os.path.join(root, old), ignore_errors=True)
+    logger.info(f"Published generation {name} of {root}")
+    return generation_dir
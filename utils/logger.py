@@ -1,5 +1,6 @@
 import logging
 import os
+import random
 from datetime import datetime
 
 LOGS_DIR="logs"
@@ -13,7 +14,20 @@ logging.basicConfig(
     level=logging.INFO
 )
 
+# Fraction of per-call hot path log lines (queries, fuzzy matches, text extraction) that are written, 0 disables them;
+# configured per process through VSM_LOG_SAMPLE_RATE
+LOG_SAMPLE_RATE=float(os.environ.get("VSM_LOG_SAMPLE_RATE", "1"))
+
 def get_logger(name):
     logger=logging.getLogger(name)
     logger.setLevel(logging.INFO)
-    return logger
\ No newline at end of file
+    return logger
+
+def log_sampled()->bool:
+    """
+    Guards per-call log lines, so unsampled calls skip formatting the message as well as writing it
+
+    Returns:
+        bool: whether this call should be logged
+    """
+    return LOG_SAMPLE_RATE >= 1 or (LOG_SAMPLE_RATE > 0 and random.random() < LOG_SAMPLE_RATE)
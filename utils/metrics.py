@@ -0,0 +1,225 @@
+import os
+import bisect
+import threading
+from utils.logger import get_logger
+
+logger=get_logger(__name__)
+
+# In-process metrics rendered in the Prometheus text exposition format.
+# Recording is a dictionary update under a lock; with metrics disabled (VSM_METRICS=0 or set_enabled(False))
+# every record call returns immediately.
+
+# Histogram bucket upper bounds in seconds
+LATENCY_BUCKETS=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BUILD_BUCKETS=(0.01, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0, 3600.0)
+
+def _format_value(value)->str:
+    if value==float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+def _escape(value)->str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_labels(names: tuple, values: tuple, extra="")->str:
+    pairs=[f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Metric:
+    """
+    A named metric with optional labels, holding one value per combination of label values
+    """
+    kind="untyped"
+
+    def __init__(self, registry, name: str, documentation: str, labelnames=())->None:
+        """
+        Args:
+            registry: Registry the metric belongs to
+            name: Metric name
+            documentation: Help text
+            labelnames: Names of the labels, whose values are passed positionally when recording
+        """
+        self.registry=registry
+        self.name=name
+        self.documentation=documentation
+        self.labelnames=tuple(labelnames)
+        self.values={} # label values --> value
+        self._lock=threading.Lock()
+
+    def samples(self)->list:
+        """
+        Returns:
+            list: (sample name, label string, value) exposition lines
+        """
+        with self._lock:
+            return [(self.name, _format_labels(self.labelnames, labels), value) for labels, value in sorted(self.values.items())]
+
+    def drain(self)->dict:
+        """
+        Returns:
+            dict: label values --> value recorded since the last drain, resetting them
+        """
+        with self._lock:
+            values=self.values
+            self.values={}
+            return values
+
+
+class Counter(Metric):
+    kind="counter"
+
+    def inc(self, amount=1, *labels)->None:
+        if not self.registry.enabled:
+            return
+        with self._lock:
+            self.values[labels]=self.values.get(labels, 0) + amount
+
+    def merge(self, values: dict)->None:
+        with self._lock:
+            for labels, value in values.items():
+                self.values[labels]=self.values.get(labels, 0) + value
+
+
+class Gauge(Metric):
+    kind="gauge"
+
+    def set(self, value, *labels)->None:
+        if not self.registry.enabled:
+            return
+        with self._lock:
+            self.values[labels]=value
+
+    def clear(self)->None:
+        """
+        Drops all label combinations, before setting the current ones of a changing set such as the served indexes
+        """
+        with self._lock:
+            self.values={}
+
+    def merge(self, values: dict)->None:
+        with self._lock:
+            self.values.update(values)
+
+
+class Histogram(Metric):
+    kind="histogram"
+
+    def __init__(self, registry, name: str, documentation: str, labelnames=(), buckets=LATENCY_BUCKETS)->None:
+        """
+        Args:
+            registry: Registry the metric belongs to
+            name: Metric name
+            documentation: Help text
+            labelnames: Names of the labels
+            buckets: Ascending bucket upper bounds, an implicit +Inf bucket is added
+        """
+        super().__init__(registry, name, documentation, labelnames)
+        self.buckets=tuple(buckets)
+
+    def observe(self, value, *labels)->None:
+        if not self.registry.enabled:
+            return
+        with self._lock:
+            state=self.values.get(labels)
+            if state is None:
+                # per bucket counts (not cumulative, last one is +Inf) and the sum of observations
+                state=self.values[labels]=[[0] * (len(self.buckets) + 1), 0.0]
+            state[0][bisect.bisect_left(self.buckets, value)]+=1
+            state[1]+=value
+
+    def merge(self, values: dict)->None:
+        with self._lock:
+            for labels, (counts, total) in values.items():
+                state=self.values.setdefault(labels, [[0] * (len(self.buckets) + 1), 0.0])
+                state[0]=[a + b for a, b in zip(state[0], counts)]
+                state[1]+=total
+
+    def samples(self)->list:
+        lines=[]
+        with self._lock:
+            for labels, (counts, total) in sorted(self.values.items()):
+                cumulative=0
+                for bound, count in zip(self.buckets + (float("inf"),), counts):
+                    cumulative+=count
+                    lines.append((self.name + "_bucket", _format_labels(self.labelnames, labels, f'le="{_format_value(bound)}"'), cumulative))
+                lines.append((self.name + "_sum", _format_labels(self.labelnames, labels), total))
+                lines.append((self.name + "_count", _format_labels(self.labelnames, labels), cumulative))
+        return lines
+
+
+class Registry:
+    """
+    Collection of metrics rendered together by the /metrics endpoint
+    """
+    def __init__(self, enabled=True)->None:
+        self.enabled=enabled
+        self.metrics={}
+
+    def _register(self, cls, name: str, *args, **kwargs):
+        if name not in self.metrics:
+            self.metrics[name]=cls(self, name, *args, **kwargs)
+        return self.metrics[name]
+
+    def counter(self, name: str, documentation: str, labelnames=())->Counter:
+        return self._register(Counter, name, documentation, labelnames)
+
+    def gauge(self, name: str, documentation: str, labelnames=())->Gauge:
+        return self._register(Gauge, name, documentation, labelnames)
+
+    def histogram(self, name: str, documentation: str, labelnames=(), buckets=LATENCY_BUCKETS)->Histogram:
+        return self._register(Histogram, name, documentation, labelnames, buckets)
+
+    def render(self)->str:
+        """
+        Returns:
+            str: All metrics in the Prometheus text exposition format
+        """
+        lines=[]
+        for name, metric in sorted(self.metrics.items()):
+            lines.append(f"# HELP {name} {metric.documentation}")
+            lines.append(f"# TYPE {name} {metric.kind}")
+            lines.extend(f"{sample}{labels} {_format_value(value)}" for sample, labels, value in metric.samples())
+        return "\n".join(lines) + "\n"
+
+    def drain(self)->dict:
+        """
+        Takes the values recorded in this process since the last drain, e.g. in an ingestion worker process,
+        for merging into the parent's registry
+
+        Returns:
+            dict: metric name --> recorded values
+        """
+        return {name: values for name, values in ((name, metric.drain()) for name, metric in self.metrics.items()) if values}
+
+    def merge(self, drained: dict)->None:
+        """
+        Args:
+            drained: Output of drain() in another process
+        """
+        for name, values in drained.items():
+            if name in self.metrics:
+                self.metrics[name].merge(values)
+
+
+REGISTRY=Registry(enabled=os.environ.get("VSM_METRICS", "1")!="0")
+
+def set_enabled(enabled: bool)->None:
+    """
+    Turns recording on or off, values recorded so far are kept
+    """
+    REGISTRY.enabled=enabled
+
+def counter(name: str, documentation: str, labelnames=())->Counter:
+    return REGISTRY.counter(name, documentation, labelnames)
+
+def gauge(name: str, documentation: str, labelnames=())->Gauge:
+    return REGISTRY.gauge(name, documentation, labelnames)
+
+def histogram(name: str, documentation: str, labelnames=(), buckets=LATENCY_BUCKETS)->Histogram:
+    return REGISTRY.histogram(name, documentation, labelnames, buckets)
+
+def render()->str:
+    return REGISTRY.render()
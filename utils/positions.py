@@ -0,0 +1,162 @@
+import heapq
+from utils.logger import get_logger
+
+logger=get_logger(__name__)
+
+# Phrase and proximity matching over a positional index.
+# Positions are token offsets in the preprocessed token stream of a document (stop words already removed),
+# stored per posting as variable-byte encoded gaps: 7 bits per byte, high bit set on all but the last byte.
+
+def encode_positions(positions: list)->bytes:
+    """
+    Args:
+        positions: Ascending token positions
+
+    Returns:
+        bytes: Variable-byte encoded position gaps
+    """
+    out=bytearray()
+    previous=0
+    for position in positions:
+        gap=position - previous
+        previous=position
+        while gap >= 0x80:
+            out.append((gap & 0x7F) | 0x80)
+            gap>>=7
+        out.append(gap)
+    return bytes(out)
+
+def decode_positions(data: bytes)->list:
+    """
+    Args:
+        data: Output of encode_positions
+
+    Returns:
+        list: Ascending token positions
+    """
+    positions=[]
+    position=0
+    gap=0
+    shift=0
+    for byte in data:
+        gap|=(byte & 0x7F) << shift
+        if byte & 0x80:
+            shift+=7
+        else:
+            position+=gap
+            positions.append(position)
+            gap=0
+            shift=0
+    return positions
+
+def gallop(seq, target, lo=0)->int:
+    """
+    Exponential search for the first index at or after lo whose item is >= target.
+    Costs O(log d) for a jump of d items, so intersecting a short list with a long one stays cheap.
+
+    Args:
+        seq: Ascending sequence (postings can be searched with a (document id,) target)
+        target: Value to search for
+        lo: Index to start from
+
+    Returns:
+        int: Insertion index of target
+    """
+    n=len(seq)
+    if lo >= n or seq[lo] >= target:
+        return lo
+    step=1
+    hi=lo + 1
+    while hi < n and seq[hi] < target:
+        lo=hi
+        step<<=1
+        hi=lo + step
+    hi=min(hi, n)
+    # seq[lo] < target <= seq[hi]
+    while lo + 1 < hi:
+        mid=(lo + hi) // 2
+        if seq[mid] < target:
+            lo=mid
+        else:
+            hi=mid
+    return hi
+
+def intersect_postings(posting_lists: list)->list:
+    """
+    Intersects postings lists by leapfrogging cursors: the rarest list proposes document ids and the others
+    skip ahead to them block by block through their skip data
+
+    Args:
+        posting_lists: PostingsList objects
+
+    Returns:
+        list: (document id, index of the document in each postings list) for documents in every list
+    """
+    if not posting_lists or not all(len(posting_list) for posting_list in posting_lists):
+        return []
+    order=sorted(range(len(posting_lists)), key=lambda i: len(posting_lists[i]))
+    cursors=[posting_list.cursor() for posting_list in posting_lists]
+    driver=cursors[order[0]]
+    matches=[]
+
+    docID=driver.doc
+    while docID is not None:
+        for i in order[1:]:
+            found=cursors[i].advance(docID)
+            if found is None:
+                return matches
+            if found!=docID:
+                # no list can match before the larger document id
+                docID=driver.advance(found)
+                break
+        else:
+            matches.append((docID, [cursor.index for cursor in cursors]))
+            docID=driver.next()
+    return matches
+
+def contains_phrase(position_lists: list)->bool:
+    """
+    Args:
+        position_lists: Positions of each phrase term in one document, in phrase order
+
+    Returns:
+        bool: whether the terms occur consecutively in phrase order
+    """
+    # a phrase starting at p has its i-th term at p + i
+    starts=sorted(([p - i for p in positions] for i, positions in enumerate(position_lists)), key=len)
+    cursors=[0] * len(starts)
+    for start in starts[0]:
+        found=True
+        for i in range(1, len(starts)):
+            cursors[i]=gallop(starts[i], start, cursors[i])
+            if cursors[i]==len(starts[i]):
+                return False
+            if starts[i][cursors[i]]!=start:
+                found=False
+                break
+        if found:
+            return True
+    return False
+
+def within_window(position_lists: list, span: int)->bool:
+    """
+    Args:
+        position_lists: Positions of each term in one document
+        span: Maximum distance between the first and last term of a match
+
+    Returns:
+        bool: whether one occurrence of every term lies within span positions, in any order
+    """
+    heap=[(positions[0], i, 0) for i, positions in enumerate(position_lists)]
+    heapq.heapify(heap)
+    high=max(position for position, _, _ in heap)
+
+    while True:
+        low, i, j=heap[0]
+        if high - low <= span:
+            return True
+        if j + 1==len(position_lists[i]):
+            return False
+        position=position_lists[i][j+1]
+        heapq.heapreplace(heap, (position, i, j + 1))
+        high=max(high, position)
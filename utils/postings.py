@@ -0,0 +1,285 @@
+import bisect
+import numpy as np
+from utils.logger import get_logger
+
+logger=get_logger(__name__)
+
+# Postings per skip block: cursors jump over whole blocks and decode at most one block per skip
+BLOCK_SIZE=128
+
+# Supported encodings of the document id gaps and term frequencies
+ENCODINGS=("raw", "varbyte")
+
+def varbyte_encode(values)->bytes:
+    """
+    Variable-byte encodes non-negative integers: 7 bits per byte, least significant group first,
+    high bit set on all but the last byte of a value (the same layout as utils.positions)
+
+    Args:
+        values: Integer array
+
+    Returns:
+        bytes: Encoded values
+    """
+    values=np.asarray(values, dtype=np.uint64)
+    n_bytes=np.ones(len(values), dtype=np.int64)
+    for bits in (7, 14, 21, 28):
+        n_bytes+=values >= (1 << bits)
+    starts=np.cumsum(n_bytes) - n_bytes
+
+    out=np.empty(int(n_bytes.sum()), dtype=np.uint8)
+    for k in range(5):
+        has_byte=n_bytes > k
+        groups=((values[has_byte] >> np.uint64(7 * k)) & np.uint64(0x7F)).astype(np.uint8)
+        groups[n_bytes[has_byte] - 1 > k]|=0x80
+        out[starts[has_byte] + k]=groups
+    return out.tobytes()
+
+def varbyte_decode(data)->np.ndarray:
+    """
+    Args:
+        data: Output of varbyte_encode
+
+    Returns:
+        nparray: Decoded values as int64
+    """
+    encoded=np.frombuffer(data, dtype=np.uint8)
+    if not len(encoded):
+        return np.zeros(0, dtype=np.int64)
+    ends=np.flatnonzero((encoded & 0x80)==0)
+    starts=np.empty(len(ends), dtype=np.int64)
+    starts[0]=0
+    starts[1:]=ends[:-1] + 1
+    # byte number within its value, each shifts its 7 bits further left
+    offsets=np.arange(len(encoded)) - np.repeat(starts, ends - starts + 1)
+    groups=(encoded & 0x7F).astype(np.int64) << (7 * offsets)
+    return np.add.reduceat(groups, starts)
+
+def _as_uint32(buffer)->np.ndarray:
+    return buffer if isinstance(buffer, np.ndarray) else np.frombuffer(buffer, dtype=np.uint32)
+
+
+class PostingsList:
+    """
+    Compact, immutable postings list of one term.
+    Document ids are stored as gaps and term frequencies alongside, either as raw uint32 arrays or variable-byte
+    encoded. Skip data holds the last document id of every BLOCK_SIZE postings (and, for varbyte, the byte offsets
+    of each block), so a cursor can jump to a document id while decoding only the block that holds it.
+    Iterating yields (document id, term frequency) pairs like the former list of tuples.
+    """
+    __slots__=("df", "encoding", "docs", "tfs", "skips")
+
+    def __init__(self, df: int, encoding: str, docs, tfs, skips=None)->None:
+        """
+        Args:
+            df: Number of postings
+            encoding: "raw" or "varbyte"
+            docs: Encoded document id gaps (bytes, or a uint32 array for raw postings such as memory-mapped ones)
+            tfs: Encoded term frequencies
+            skips: Encoded skip data, derived from the raw gaps on first use if None
+        """
+        self.df=df
+        self.encoding=encoding
+        self.docs=docs
+        self.tfs=tfs
+        self.skips=skips
+
+    @classmethod
+    def from_arrays(cls, doc_ids, tfs, encoding="raw"):
+        """
+        Args:
+            doc_ids: Ascending document ids
+            tfs: Term frequencies aligned with doc_ids
+            encoding: "raw" or "varbyte"
+
+        Returns:
+            PostingsList: Encoded postings
+        """
+        if encoding not in ENCODINGS:
+            raise ValueError(f"Unknown postings encoding: {encoding}")
+        doc_ids=np.asarray(doc_ids, dtype=np.int64)
+        tfs=np.asarray(tfs, dtype=np.int64)
+        gaps=np.diff(doc_ids, prepend=0)
+        last_docs=doc_ids[BLOCK_SIZE-1::BLOCK_SIZE]
+        if len(doc_ids) % BLOCK_SIZE:
+            last_docs=np.append(last_docs, doc_ids[-1])
+
+        if encoding=="raw":
+            skips=last_docs.astype(np.uint32).tobytes() if len(doc_ids) > BLOCK_SIZE else None
+            return cls(len(doc_ids), encoding, gaps.astype(np.uint32).tobytes(), tfs.astype(np.uint32).tobytes(), skips)
+
+        # varbyte blocks are found through the byte offsets where each block starts
+        doc_offsets=[0]
+        tf_offsets=[0]
+        docs=bytearray()
+        encoded_tfs=bytearray()
+        for start in range(0, len(doc_ids), BLOCK_SIZE):
+            docs+=varbyte_encode(gaps[start:start+BLOCK_SIZE])
+            encoded_tfs+=varbyte_encode(tfs[start:start+BLOCK_SIZE])
+            doc_offsets.append(len(docs))
+            tf_offsets.append(len(encoded_tfs))
+        skips=np.stack([last_docs, doc_offsets[:-1], tf_offsets[:-1]], axis=1).astype(np.uint32).tobytes()
+        return cls(len(doc_ids), encoding, bytes(docs), bytes(encoded_tfs), skips)
+
+    @classmethod
+    def from_pairs(cls, pairs: list, encoding="raw"):
+        """
+        Args:
+            pairs: (document id, term frequency) pairs ascending by document id
+            encoding: "raw" or "varbyte"
+
+        Returns:
+            PostingsList: Encoded postings
+        """
+        return cls.from_arrays([docID for docID, _ in pairs], [tf for _, tf in pairs], encoding)
+
+    def __len__(self):
+        return self.df
+
+    def __iter__(self):
+        doc_ids, tfs=self.arrays()
+        return zip(doc_ids.tolist(), tfs.tolist())
+
+    def __repr__(self):
+        return f"PostingsList(df={self.df}, encoding={self.encoding!r}, nbytes={self.nbytes()})"
+
+    def arrays(self)->tuple:
+        """
+        Returns:
+            tuple: (document ids, term frequencies) as int64 arrays
+        """
+        if self.encoding=="raw":
+            return np.cumsum(_as_uint32(self.docs), dtype=np.int64), _as_uint32(self.tfs).astype(np.int64)
+        return np.cumsum(varbyte_decode(self.docs)), varbyte_decode(self.tfs)
+
+    def skip_table(self)->np.ndarray:
+        """
+        Returns:
+            nparray: one row per block, the last document id of the block (plus both byte offsets for varbyte)
+        """
+        if self.skips is None:
+            doc_ids=np.cumsum(_as_uint32(self.docs), dtype=np.int64)
+            last_docs=doc_ids[BLOCK_SIZE-1::BLOCK_SIZE]
+            if self.df % BLOCK_SIZE:
+                last_docs=np.append(last_docs, doc_ids[-1])
+            self.skips=last_docs.astype(np.uint32).tobytes()
+        table=np.frombuffer(self.skips, dtype=np.uint32)
+        return table.reshape(-1, 3) if self.encoding=="varbyte" else table.reshape(-1, 1)
+
+    def block(self, b: int, skip_table=None)->tuple:
+        """
+        Decodes one block of postings
+
+        Args:
+            b: Block number
+            skip_table: Output of skip_table, if the caller already has it
+
+        Returns:
+            tuple: (document ids, term frequencies) of the block as int64 arrays
+        """
+        if skip_table is None:
+            skip_table=self.skip_table()
+        base=int(skip_table[b-1, 0]) if b else 0
+        if self.encoding=="raw":
+            start, end=b * BLOCK_SIZE, min((b + 1) * BLOCK_SIZE, self.df)
+            gaps=_as_uint32(self.docs)[start:end]
+            tfs=_as_uint32(self.tfs)[start:end].astype(np.int64)
+        else:
+            last=b + 1==len(skip_table)
+            doc_end=len(self.docs) if last else int(skip_table[b+1, 1])
+            tf_end=len(self.tfs) if last else int(skip_table[b+1, 2])
+            gaps=varbyte_decode(self.docs[int(skip_table[b, 1]):doc_end])
+            tfs=varbyte_decode(self.tfs[int(skip_table[b, 2]):tf_end])
+        return base + np.cumsum(gaps, dtype=np.int64), tfs
+
+    def cursor(self):
+        """
+        Returns:
+            PostingsCursor: Cursor positioned on the first posting
+        """
+        return PostingsCursor(self)
+
+    def nbytes(self)->int:
+        """
+        Returns:
+            int: Size of the encoded document ids, term frequencies and skip data
+        """
+        return sum(len(part) * (part.itemsize if isinstance(part, np.ndarray) else 1) for part in (self.docs, self.tfs, self.skips or b""))
+
+
+class PostingsCursor:
+    """
+    Forward cursor over a PostingsList, decoding one block at a time.
+    doc and tf describe the current posting, doc is None once the postings are exhausted; index is its position.
+    """
+    __slots__=("postings", "skip_table", "last_docs", "block_number", "block_docs", "block_tfs", "position", "index", "doc", "tf")
+
+    def __init__(self, postings: PostingsList)->None:
+        self.postings=postings
+        self.skip_table=postings.skip_table() if postings.df > BLOCK_SIZE or postings.encoding=="varbyte" else None
+        self.last_docs=self.skip_table[:, 0].tolist() if self.skip_table is not None else None
+        self.doc=None
+        self.tf=None
+        self.index=0
+        if postings.df:
+            self._load(0, 0)
+
+    def _load(self, b: int, position: int)->None:
+        if self.skip_table is None:
+            doc_ids, tfs=self.postings.arrays()
+        else:
+            doc_ids, tfs=self.postings.block(b, self.skip_table)
+        self.block_number=b
+        self.block_docs=doc_ids.tolist()
+        self.block_tfs=tfs.tolist()
+        self._seek(position)
+
+    def _seek(self, position: int)->None:
+        self.position=position
+        if position < len(self.block_docs):
+            self.index=self.block_number * BLOCK_SIZE + position
+            self.doc=self.block_docs[position]
+            self.tf=self.block_tfs[position]
+        else:
+            self.index=self.postings.df
+            self.doc=None
+            self.tf=None
+
+    def next(self):
+        """
+        Moves to the next posting
+
+        Returns:
+            int: The new document id, or None when exhausted
+        """
+        if self.doc is None:
+            return None
+        if self.position + 1 < len(self.block_docs) or self.skip_table is None or self.block_number + 1==len(self.last_docs):
+            self._seek(self.position + 1)
+        else:
+            self._load(self.block_number + 1, 0)
+        return self.doc
+
+    def advance(self, target: int):
+        """
+        Moves to the first posting at or after the current one with a document id of at least target,
+        skipping whole blocks through the skip data
+
+        Args:
+            target: Document id to move to
+
+        Returns:
+            int: The new document id, or None when exhausted
+        """
+        if self.doc is None or self.doc >= target:
+            return self.doc
+        if self.skip_table is not None and target > self.last_docs[self.block_number]:
+            b=bisect.bisect_left(self.last_docs, target, lo=self.block_number + 1)
+            if b==len(self.last_docs):
+                self.block_number=b - 1
+                self.block_docs=[]
+                self._seek(0)
+                return None
+            self._load(b, 0)
+        self._seek(bisect.bisect_left(self.block_docs, target, lo=self.position))
+        return self.doc
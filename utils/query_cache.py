@@ -0,0 +1,126 @@
+import time
+import threading
+from collections import OrderedDict
+from utils.logger import get_logger
+
+logger=get_logger(__name__)
+
+# Rough per-entry bookkeeping overhead in bytes (dict slot, tuples, floats), added to the string sizes
+ENTRY_OVERHEAD=200
+RESULT_OVERHEAD=64
+
+class QueryCache:
+    """
+    Bounded in-memory cache of ranked query results.
+    Entries are evicted least recently used first once either the entry count or the estimated size
+    exceeds its bound, and expire after ttl seconds if a ttl is set. Every entry belongs to an index
+    generation; looking up a newer generation drops all entries of the old one.
+    """
+    def __init__(self, max_entries=1024, max_bytes=64 << 20, ttl=None)->None:
+        """
+        Args:
+            max_entries: Maximum number of cached queries, 0 disables the cache
+            max_bytes: Upper bound on the estimated size of the cached results
+            ttl: Seconds after which an entry expires, None to keep entries until evicted
+        """
+        self.max_entries=max_entries
+        self.max_bytes=max_bytes
+        self.ttl=ttl
+
+        self.entries=OrderedDict() # key --> (results, size, expiry time)
+        self.size=0
+        self.generation=None
+        self.hits=0
+        self.misses=0
+        self.evictions=0
+        self._lock=threading.Lock()
+
+    @staticmethod
+    def _estimate_size(key: tuple, results: list)->int:
+        size=ENTRY_OVERHEAD + sum(len(term) for term, _ in key[0])
+        return size + sum(RESULT_OVERHEAD + len(filename) for filename, _ in results)
+
+    def _check_generation(self, generation: int)->None:
+        if generation!=self.generation:
+            if self.entries:
+                logger.info(f"Index generation changed to {generation}, dropping {len(self.entries)} cached queries")
+            self.entries.clear()
+            self.size=0
+            self.generation=generation
+
+    def get(self, generation: int, key: tuple):
+        """
+        Args:
+            generation: Current index generation
+            key: Normalized query key
+
+        Returns:
+            list: Cached results, or None on a miss
+        """
+        if not self.max_entries:
+            return None
+        with self._lock:
+            self._check_generation(generation)
+            entry=self.entries.get(key)
+            if entry is not None and entry[2] is not None and entry[2] < time.monotonic():
+                self.entries.pop(key)
+                self.size-=entry[1]
+                entry=None
+            if entry is None:
+                self.misses+=1
+                return None
+            self.entries.move_to_end(key)
+            self.hits+=1
+            return entry[0]
+
+    def put(self, generation: int, key: tuple, results: list)->None:
+        """
+        Args:
+            generation: Index generation the results were computed on
+            key: Normalized query key
+            results: Ranked (filename, score) pairs
+        """
+        if not self.max_entries:
+            return
+        size=self._estimate_size(key, results)
+        if size > self.max_bytes:
+            return
+        expiry=time.monotonic() + self.ttl if self.ttl is not None else None
+
+        with self._lock:
+            self._check_generation(generation)
+            previous=self.entries.pop(key, None)
+            if previous is not None:
+                self.size-=previous[1]
+            self.entries[key]=(results, size, expiry)
+            self.size+=size
+
+            while len(self.entries) > self.max_entries or self.size > self.max_bytes:
+                _, (_, evicted_size, _)=self.entries.popitem(last=False)
+                self.size-=evicted_size
+                self.evictions+=1
+
+    def clear(self)->None:
+        with self._lock:
+            self.entries.clear()
+            self.size=0
+
+    def stats(self)->dict:
+        """
+        Returns:
+            dict: entry count, estimated bytes, bounds, hits, misses and evictions
+        """
+        with self._lock:
+            lookups=self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "bytes": self.size,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "ttl": self.ttl,
+                "generation": self.generation,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+            }
@@ -0,0 +1,87 @@
+import functools
+import threading
+from contextlib import contextmanager
+
+class ReadWriteLock:
+    """
+    Lock shared by any number of readers or held by one writer.
+    Writers are preferred: once a writer waits, new readers wait behind it, so a steady stream of queries cannot
+    starve an update. A thread may take the read lock again while it holds the read or the write lock.
+    """
+    def __init__(self)->None:
+        self._condition=threading.Condition(threading.Lock())
+        self._readers=0
+        self._writer=None # ident of the thread holding the write lock
+        self._writers_waiting=0
+        self._local=threading.local() # read lock depth of each thread
+
+    @contextmanager
+    def read(self):
+        me=threading.get_ident()
+        depth=getattr(self._local, "depth", 0)
+        if depth or self._writer==me:
+            # nested in a read or write section of this thread
+            self._local.depth=depth + 1
+            try:
+                yield
+            finally:
+                self._local.depth=depth
+            return
+
+        with self._condition:
+            while self._writer is not None or self._writers_waiting:
+                self._condition.wait()
+            self._readers+=1
+        self._local.depth=1
+        try:
+            yield
+        finally:
+            self._local.depth=0
+            with self._condition:
+                self._readers-=1
+                if not self._readers:
+                    self._condition.notify_all()
+
+    @contextmanager
+    def write(self):
+        me=threading.get_ident()
+        if self._writer==me:
+            yield
+            return
+        if getattr(self._local, "depth", 0):
+            raise RuntimeError("Cannot take the write lock while holding the read lock")
+
+        with self._condition:
+            self._writers_waiting+=1
+            try:
+                while self._writer is not None or self._readers:
+                    self._condition.wait()
+            finally:
+                self._writers_waiting-=1
+            self._writer=me
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._writer=None
+                self._condition.notify_all()
+
+def reads_index(method):
+    """
+    Runs a method of an index under the read lock of its index_lock, so it never sees a change half applied
+    """
+    @functools.wraps(method)
+    def locked(self, *args, **kwargs):
+        with self.index_lock.read():
+            return method(self, *args, **kwargs)
+    return locked
+
+def writes_index(method):
+    """
+    Runs a method of an index under the write lock of its index_lock, queries wait until it returns
+    """
+    @functools.wraps(method)
+    def locked(self, *args, **kwargs):
+        with self.index_lock.write():
+            return method(self, *args, **kwargs)
+    return locked